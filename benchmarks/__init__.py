@@ -0,0 +1,6 @@
+"""
+Benchmarks for the Inventory Service
+
+These scripts are not part of the unit test suite. Each one can be run as a
+module from the project root, e.g. ``python -m benchmarks.worker_rss``.
+"""
@@ -0,0 +1,84 @@
+"""
+Compares two benchmark reports and flags regressions
+
+Both files must be JSON reports written by one of the benchmarks in this
+package, i.e. ``{"meta": {...}, "results": {name: {metric: value}}}``.
+Metrics named ``*_rps`` or ``*_per_sec`` are better when higher; metrics
+ending in a time unit (``*_ms``, ``*_us``, ``*_ns``) are better when lower.
+Anything else is reported but never flagged.
+
+Usage:
+    python -m benchmarks.compare baseline.json current.json --threshold 10
+
+Exits with status 1 when any metric is worse than the baseline by more
+than the threshold (in percent).
+"""
+import sys
+import json
+import argparse
+
+HIGHER_IS_BETTER = ("_rps", "_per_sec")
+LOWER_IS_BETTER = ("_ms", "_us", "_ns")
+
+
+def direction(metric: str) -> int:
+    """Returns 1 if higher is better, -1 if lower is better, 0 if neither"""
+    if metric.endswith(HIGHER_IS_BETTER):
+        return 1
+    if metric.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def compare(baseline: dict, current: dict, threshold: float, metrics=None) -> tuple:
+    """Returns (rows, regressions) comparing the results of two reports
+
+    Each row is (name, metric, baseline value, current value, change in
+    percent, regressed flag). Only entries present in both reports are
+    compared.
+    """
+    rows, regressions = [], []
+    for name, base_metrics in baseline["results"].items():
+        if name not in current["results"]:
+            continue
+        for metric, base_value in base_metrics.items():
+            if metrics and metric not in metrics:
+                continue
+            value = current["results"][name].get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(base_value, (int, float)):
+                continue
+            change = (value - base_value) / base_value * 100 if base_value else 0.0
+            regressed = direction(metric) * change < -threshold
+            row = (name, metric, base_value, value, change, regressed)
+            rows.append(row)
+            if regressed:
+                regressions.append(row)
+    return rows, regressions
+
+
+def main():
+    """Prints the comparison and exits non-zero on regressions"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed slowdown in percent")
+    parser.add_argument("--metrics", help="comma separated subset of metrics to compare")
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as base_file, open(args.current, encoding="utf-8") as current_file:
+        baseline, current = json.load(base_file), json.load(current_file)
+
+    metrics = set(args.metrics.split(",")) if args.metrics else None
+    rows, regressions = compare(baseline, current, args.threshold, metrics)
+    for name, metric, base_value, value, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:<32} {metric:<16} {base_value:>12.3f} -> {value:>12.3f} {change:+8.1f}%{flag}")
+
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.threshold}%")
+        sys.exit(1)
+    print(f"\nNo regressions beyond {args.threshold}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Bandwidth and latency trade-off of compressing inventory list responses
+
+Builds the JSON body of GET /api/inventory for several list sizes from
+tests.factories.InventoryItemFactory (fixed seed) and, for every available
+encoding and level, reports:
+
+    bytes         - size of the compressed body
+    ratio         - uncompressed size / compressed size
+    compress_us   - time to compress the body (median of --repeat runs)
+    decompress_us - time for the client to decompress it
+    total_ms_<bw> - compress + transfer + decompress at a link bandwidth
+
+"identity" is the uncompressed baseline. brotli and zstd are only measured
+when the brotli and zstandard packages are installed.
+
+Usage:
+    python -m benchmarks.compression
+    python -m benchmarks.compression --sizes 100,1000 --output compression.json
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+import platform
+import statistics
+from datetime import datetime, timezone
+
+os.environ.setdefault("DATABASE_URI", "sqlite://")
+
+# pylint: disable=wrong-import-position
+import factory.random  # noqa: E402
+from service.common.compression import available_encoders, compress  # noqa: E402
+from tests.factories import InventoryItemFactory  # noqa: E402
+
+LEVELS = {"gzip": (1, 6, 9), "br": (1, 4, 11), "zstd": (1, 3, 19)}
+BANDWIDTHS = {"10mbit": 10e6, "100mbit": 100e6, "1gbit": 1e9}
+
+
+def decompressors() -> dict:
+    """Returns {encoding: function that decompresses a body}"""
+    # pylint: disable=import-outside-toplevel
+    functions = {"gzip": lambda data: zlib.decompress(data, 31)}
+    encoders = available_encoders()
+    if "br" in encoders:
+        import brotli
+        functions["br"] = brotli.decompress
+    if "zstd" in encoders:
+        import zstandard
+        functions["zstd"] = zstandard.ZstdDecompressor().decompress
+    return functions
+
+
+def median_us(func, repeat: int) -> float:
+    """Returns the median time of func() in microseconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1e6
+
+
+def measure(body: bytes, encoding: str, level: int, repeat: int) -> dict:
+    """Measures one encoding and level on one body"""
+    if encoding == "identity":
+        data, compress_us, decompress_us = body, 0.0, 0.0
+    else:
+        data = compress(body, encoding, level)
+        compress_us = median_us(lambda: compress(body, encoding, level), repeat)
+        decompress = decompressors()[encoding]
+        decompress_us = median_us(lambda: decompress(data), repeat)
+    result = {
+        "bytes": len(data),
+        "ratio": round(len(body) / len(data), 2),
+        "compress_us": round(compress_us, 1),
+        "decompress_us": round(decompress_us, 1),
+    }
+    for name, bits_per_second in BANDWIDTHS.items():
+        transfer_us = len(data) * 8 / bits_per_second * 1e6
+        result[f"total_ms_{name}"] = round((compress_us + transfer_us + decompress_us) / 1000, 3)
+    return result
+
+
+def main():
+    """Measures every encoding and level at every list size"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,100,1000,10000", help="comma separated numbers of items")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="file to write the JSON report to")
+    args = parser.parse_args()
+
+    factory.random.reseed_random(42)
+    encodings = [("identity", 0)] + [
+        (encoding, level) for encoding in available_encoders() for level in LEVELS[encoding]
+    ]
+    report = {
+        "meta": {
+            "benchmark": "compression",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "results": {},
+    }
+    for size in (int(size) for size in args.sizes.split(",")):
+        items = [item.serialize() for item in InventoryItemFactory.build_batch(size)]
+        body = json.dumps(items).encode("utf-8")
+        for encoding, level in encodings:
+            name = f"{size}/{encoding}" + (f"-{level}" if level else "")
+            result = measure(body, encoding, level, args.repeat)
+            report["results"][name] = result
+            print(f"{name:<18} {result['bytes']:>10} B  x{result['ratio']:<6} "
+                  f"compress {result['compress_us']:>9.1f}us  "
+                  f"10mbit {result['total_ms_10mbit']:>8.2f}ms  1gbit {result['total_ms_1gbit']:>7.2f}ms",
+                  file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            out.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+HTTP load test for every Inventory Service endpoint
+
+For each requested table size the database is reset and seeded, the service
+is started under gunicorn with the shipped gunicorn.conf.py, and every route
+is driven by a pool of concurrent clients for a fixed time. Throughput and
+latency percentiles are written as JSON that benchmarks/compare.py can diff
+against an earlier run.
+
+Usage:
+    python -m benchmarks.http_load --sizes 100,10000 --concurrency 8 \\
+        --duration 10 --output results.json
+
+The database defaults to a throwaway SQLite file; set --database-uri (or
+DATABASE_URI) to point at a local PostgreSQL instead. Never point it at a
+database you care about: it is dropped and re-created for every size.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timezone
+from http.client import HTTPConnection
+from urllib.parse import quote_plus
+from sqlalchemy import create_engine, insert, select
+from service.models import db, InventoryItem
+
+CONDITIONS = ["new", "open box", "used"]
+
+
+######################################################################
+# Database seeding
+######################################################################
+def make_item(rng: random.Random) -> dict:
+    """Returns a random inventory item as a plain dictionary"""
+    return {
+        "name": f"item-{rng.randrange(1_000_000)}",
+        "description": "benchmark item",
+        "quantity": rng.randint(0, 100),
+        "price": f"{rng.uniform(0.01, 999.99):.2f}",
+        "product_id": rng.randint(1, 100),
+        "restock_level": rng.randint(0, 50),
+        "condition": rng.choice(CONDITIONS),
+    }
+
+
+def seed_database(database_uri: str, size: int, rng: random.Random) -> list:
+    """Re-creates the tables, inserts `size` items and returns their ids"""
+    engine = create_engine(database_uri)
+    try:
+        db.metadata.drop_all(engine)
+        db.metadata.create_all(engine)
+        with engine.begin() as conn:
+            for start in range(0, size, 5000):
+                batch = [make_item(rng) for _ in range(min(5000, size - start))]
+                conn.execute(insert(InventoryItem.__table__), batch)
+        with engine.connect() as conn:
+            return list(conn.execute(select(InventoryItem.__table__.c.id)).scalars())
+    finally:
+        engine.dispose()
+
+
+######################################################################
+# Server process
+######################################################################
+def start_server(database_uri: str, port: int, workers: int, timeout: float):
+    """Starts gunicorn and waits until the health check answers"""
+    env = dict(os.environ, DATABASE_URI=database_uri)
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py",
+         "--bind", f"127.0.0.1:{port}", "--workers", str(workers),
+         "--log-level", "warning", "wsgi:app"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/health")
+            conn.getresponse().read()
+            conn.close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Server did not come up")
+
+
+######################################################################
+# Scenarios
+######################################################################
+class Scenario:
+    """A route under test: builds one request at a time from shared state"""
+
+    def __init__(self, name: str, build, expected=(200,), on_success=None):
+        self.name = name
+        self.build = build
+        self.expected = expected
+        self.on_success = on_success
+
+
+def build_scenarios(ids: list, rng: random.Random) -> list:
+    """Returns the scenarios in the order they are run
+
+    Destructive scenarios (delete, archive) consume ids from their own pools
+    so that every request does real work instead of hitting a 404; a builder
+    returns None once its pool is exhausted, which ends that client's run.
+    Delete takes the items the create scenario made first and then the seeded
+    ones (archived or not), so it also has work when it runs on its own.
+    """
+    lock = threading.Lock()
+    created = []
+    archive_pool = list(ids)
+    rng.shuffle(archive_pool)
+    delete_pool = list(ids)
+    rng.shuffle(delete_pool)
+
+    def pop(pool):
+        with lock:
+            return pool.pop() if pool else None
+
+    def pop_deletable():
+        with lock:
+            pool = created or delete_pool
+            return pool.pop() if pool else None
+
+    def path_for(method, template, item_id):
+        return None if item_id is None else (method, template.format(item_id), None)
+
+    def create():
+        return "POST", "/api/inventory", make_item(rng)
+
+    def remember(response_body):
+        with lock:
+            created.append(json.loads(response_body)["id"])
+
+    def put():
+        item_id = rng.choice(ids)
+        return "PUT", f"/api/inventory/{item_id}", dict(make_item(rng), id=item_id)
+
+    return [
+        Scenario("list", lambda: ("GET", "/api/inventory", None)),
+        Scenario("filtered_list", lambda: ("GET", f"/api/inventory?condition={quote_plus(rng.choice(CONDITIONS))}", None)),
+        Scenario("get", lambda: ("GET", f"/api/inventory/{rng.choice(ids)}", None)),
+        Scenario("create", create, expected=(201,), on_success=remember),
+        Scenario("put", put),
+        Scenario("decrement", lambda: ("PUT", f"/api/inventory/{rng.choice(ids)}/decrement", None)),
+        Scenario("archive", lambda: path_for("PUT", "/api/inventory/{}/archive", pop(archive_pool))),
+        Scenario("delete", lambda: path_for("DELETE", "/api/inventory/{}", pop_deletable()), expected=(204,)),
+    ]
+
+
+######################################################################
+# Load driver
+######################################################################
+def percentile(ordered: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def drive(scenario: Scenario, port: int, concurrency: int, duration: float) -> dict:
+    """Runs one scenario with `concurrency` clients for `duration` seconds"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        conn = HTTPConnection("127.0.0.1", port, timeout=30)
+        local_latencies, local_errors = [], 0
+        while time.monotonic() < deadline:
+            request = scenario.build()
+            if request is None:
+                break
+            method, path, payload = request
+            body = json.dumps(payload) if payload is not None else None
+            headers = {"Content-Type": "application/json"} if body else {}
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except OSError:
+                conn.close()
+                local_errors += 1
+                continue
+            local_latencies.append(time.perf_counter() - start)
+            if response.status not in scenario.expected:
+                local_errors += 1
+            elif scenario.on_success:
+                scenario.on_success(data)
+        conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            errors.append(local_errors)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+######################################################################
+# Main
+######################################################################
+def git_revision() -> str:
+    """Returns the current git commit, if there is one"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    """Runs every scenario at every size and writes the JSON report"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,10000", help="comma separated table sizes to seed")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per route")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--port", type=int, default=8098)
+    parser.add_argument("--routes", help="comma separated subset of routes to run")
+    parser.add_argument("--database-uri", default=os.getenv("DATABASE_URI"))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="file to write the JSON report to")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    report = {
+        "meta": {
+            "benchmark": "http_load",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "workers": args.workers,
+        },
+        "results": {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_uri = args.database_uri or f"sqlite:///{tmpdir}/bench.db"
+        report["meta"]["database"] = database_uri.split(":", 1)[0]
+        for size in (int(size) for size in args.sizes.split(",")):
+            ids = seed_database(database_uri, size, rng)
+            server = start_server(database_uri, args.port, args.workers, timeout=60)
+            try:
+                for scenario in build_scenarios(ids, rng):
+                    if args.routes and scenario.name not in args.routes.split(","):
+                        continue
+                    result = drive(scenario, args.port, args.concurrency, args.duration)
+                    report["results"][f"{size}/{scenario.name}"] = result
+                    print(f"{size:>8} {scenario.name:<14} {result['throughput_rps']:>9.1f} req/s "
+                          f"p50 {result['p50_ms']:.1f}ms p95 {result['p95_ms']:.1f}ms "
+                          f"p99 {result['p99_ms']:.1f}ms errors {result['errors']}", file=sys.stderr)
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            out.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
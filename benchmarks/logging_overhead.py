@@ -0,0 +1,173 @@
+"""
+Request latency cost of logging to a slow stdout
+
+Seeds one inventory item and times --requests GET and PUT requests of it
+through the Flask test client, while the server's log handler writes to a
+stream that takes --write-ms milliseconds per line, like a congested pipe
+to a log collector. It runs once per logging mode:
+
+    sync     - the handler writes on the request thread (LOG_QUEUE=false)
+    queue    - the request only queues the record (LOG_QUEUE=true)
+    json     - queue, formatted as JSON (LOG_FORMAT=json)
+    sampled  - queue, keeping one INFO line in ten (LOG_SAMPLE_RATES=INFO=0.1)
+
+and reports for each request type:
+
+    throughput_rps - requests per second
+    p50/p95/p99_ms - latency of one request
+    lines          - log lines written, once the queue was drained
+
+Usage:
+    python -m benchmarks.logging_overhead --requests 2000 --write-ms 0.2 --output logging.json
+
+The database is a throwaway SQLite file unless --database-uri is given. The
+tables are dropped and re-created, so never point it at a database you care
+about.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+from datetime import datetime, timezone
+
+MODES = {
+    "sync": {"LOG_QUEUE": False, "LOG_FORMAT": "text", "LOG_SAMPLE_RATES": {}},
+    "queue": {"LOG_QUEUE": True, "LOG_FORMAT": "text", "LOG_SAMPLE_RATES": {}},
+    "json": {"LOG_QUEUE": True, "LOG_FORMAT": "json", "LOG_SAMPLE_RATES": {}},
+    "sampled": {"LOG_QUEUE": True, "LOG_FORMAT": "text", "LOG_SAMPLE_RATES": {"INFO": 0.1}},
+}
+
+
+class SlowStream:
+    """A stream that takes a while for every write and counts the lines"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.lines = 0
+
+    def write(self, text: str) -> None:
+        """Waits, as if the pipe were full"""
+        time.sleep(self.delay)
+        self.lines += text.count("\n")
+
+    def flush(self) -> None:
+        """Nothing is buffered"""
+
+
+def seed(app) -> int:
+    """Re-creates the tables with one item and returns its id"""
+    # pylint: disable=import-outside-toplevel
+    from service.models import InventoryItem, db
+
+    with app.app_context():
+        db.drop_all(bind_key=None)
+        db.create_all(bind_key=None)
+        item = InventoryItem(
+            name="widget", description="logged item", quantity=10, price=1,
+            product_id=1, restock_level=0, condition="new",
+        )
+        item.create()
+        item_id = item.id
+        db.session.remove()
+    return item_id
+
+
+def timed(requests: int, call) -> dict:
+    """Calls call() `requests` times and returns its throughput and latency"""
+    # pylint: disable=import-outside-toplevel
+    from benchmarks.http_load import percentile
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "throughput_rps": round(requests / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def run(app, stream: SlowStream, item_id: int, mode: dict, requests: int) -> dict:
+    """Sets up logging in one mode and times the requests"""
+    # pylint: disable=import-outside-toplevel
+    from service.common.log_handlers import init_logging
+
+    app.config.update(mode)
+    init_logging(app, "gunicorn.error")
+    client = app.test_client()
+    url = f"/api/inventory/{item_id}"
+    payload = client.get(url).get_json()
+    stream.lines = 0
+    result = {
+        "get": timed(requests, lambda: client.get(url)),
+        "put": timed(requests, lambda: client.put(url, json=payload)),
+    }
+    listener = app.extensions.get("log_listener")
+    if listener is not None:
+        # wait for the queued lines, so that every mode counts all of them
+        listener.stop()
+    result["lines"] = stream.lines
+    return result
+
+
+def main():
+    """Measures every logging mode"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="requests of each type per mode")
+    parser.add_argument("--write-ms", type=float, default=0.2, help="milliseconds the stream takes per line")
+    parser.add_argument("--database-uri", default=os.getenv("DATABASE_URI"))
+    parser.add_argument("--output", help="file to write the JSON report to")
+    args = parser.parse_args()
+
+    stream = SlowStream(args.write_ms / 1000)
+    server_logger = logging.getLogger("gunicorn.error")
+    server_logger.addHandler(logging.StreamHandler(stream))
+    server_logger.setLevel(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_uri = args.database_uri or f"sqlite:///{tmpdir}/bench.db"
+        # the config module reads DATABASE_URI when it is imported
+        os.environ["DATABASE_URI"] = database_uri
+        # pylint: disable=import-outside-toplevel
+        from service import create_app
+
+        app = create_app()
+        report = {
+            "meta": {
+                "benchmark": "logging_overhead",
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "database": database_uri.split(":", 1)[0],
+                "requests": args.requests,
+                "write_ms": args.write_ms,
+            },
+            "results": {},
+        }
+        item_id = seed(app)
+        for name, mode in MODES.items():
+            result = report["results"][name] = run(app, stream, item_id, mode, args.requests)
+            print(f"{name:<8} GET p50 {result['get']['p50_ms']:.3f}ms p99 {result['get']['p99_ms']:.3f}ms "
+                  f"PUT p50 {result['put']['p50_ms']:.3f}ms p99 {result['put']['p99_ms']:.3f}ms "
+                  f"lines {result['lines']}", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            out.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Micro-benchmarks for InventoryItem serialization and validation
+
+Times the per-call cost of the code that runs on every write and every
+returned row: InventoryItem.serialize(), InventoryItem.deserialize() and the
+payload validator (single and bulk). Inputs are built with
+tests.factories.InventoryItemFactory from a fixed seed.
+
+Each case is calibrated so that one repeat takes at least --min-time
+seconds, then repeated --repeat times with the garbage collector disabled
+(as timeit does). The median and minimum cost per call are reported in
+nanoseconds.
+
+Usage:
+    python -m benchmarks.micro                    # run and print
+    python -m benchmarks.micro --save             # store a new baseline
+    python -m benchmarks.micro --check            # fail on regressions
+    python -m benchmarks.micro --check --threshold 25
+
+Baselines live in benchmarks/baselines/micro.json and are only meaningful
+on the machine that produced them: re-run with --save after changing
+hardware or Python version.
+"""
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+from datetime import datetime, timezone
+
+os.environ.setdefault("DATABASE_URI", "sqlite://")
+
+# pylint: disable=wrong-import-position
+import factory.random  # noqa: E402
+from service import create_app  # noqa: E402
+from service.models import InventoryItem, item_validator  # noqa: E402
+from tests.factories import InventoryItemFactory  # noqa: E402
+from benchmarks.compare import compare  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "micro.json")
+
+
+def build_cases() -> dict:
+    """Returns the benchmark cases as {name: zero-argument callable}"""
+    factory.random.reseed_random(42)
+    item = InventoryItemFactory()
+    data = item.serialize()
+    target = InventoryItem()
+    rows = [factory_item.serialize() for factory_item in InventoryItemFactory.build_batch(100)]
+
+    return {
+        "serialize": item.serialize,
+        "deserialize": lambda: target.deserialize(data),
+        "deserialize_new": lambda: InventoryItem().deserialize(data),
+        "validate": lambda: item_validator.validate(data),
+        "validate_many_100": lambda: item_validator.validate_many(rows),
+    }
+
+
+def calibrate(func, min_time: float) -> int:
+    """Returns a loop count that makes one repeat last at least min_time"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        if time.perf_counter() - start >= min_time:
+            return number
+        number *= 2
+
+
+def measure(func, repeat: int, min_time: float) -> dict:
+    """Times func and returns its per-call cost in nanoseconds"""
+    number = calibrate(func, min_time)
+    timings = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter_ns()
+            for _ in range(number):
+                func()
+            timings.append((time.perf_counter_ns() - start) / number)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return {
+        "median_ns": round(statistics.median(timings), 1),
+        "min_ns": round(min(timings), 1),
+        "loops": number,
+        "repeat": repeat,
+    }
+
+
+def main():
+    """Runs the micro-benchmarks and optionally saves or checks a baseline"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per repeat")
+    parser.add_argument("--cases", help="comma separated subset of cases to run")
+    parser.add_argument("--output", help="file to write the JSON report to")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--check", action="store_true", help="compare against the baseline")
+    parser.add_argument("--threshold", type=float, default=20.0, help="allowed slowdown in percent")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        cases = build_cases()
+        if args.cases:
+            cases = {name: func for name, func in cases.items() if name in args.cases.split(",")}
+        report = {
+            "meta": {
+                "benchmark": "micro",
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+            },
+            "results": {},
+        }
+        for name, func in cases.items():
+            report["results"][name] = measure(func, args.repeat, args.min_time)
+            print(f"{name:<24} {report['results'][name]['median_ns']:>10.1f} ns/call", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            out.write(output + "\n")
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as out:
+            out.write(output + "\n")
+        print(f"Baseline saved to {args.baseline}", file=sys.stderr)
+
+    if args.check:
+        with open(args.baseline, encoding="utf-8") as base_file:
+            baseline = json.load(base_file)
+        _, regressions = compare(baseline, report, args.threshold, metrics={"median_ns"})
+        for name, _, base_value, value, change, _ in regressions:
+            print(f"REGRESSION {name}: {base_value:.1f} -> {value:.1f} ns ({change:+.1f}%)", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold}%", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Offline profile of the service start-up and of the list endpoint
+
+Profiles create_app() and then --requests GET /api/inventory calls through
+the Flask test client against a table of --items items, and writes one
+profile of each next to --output-dir:
+
+    create_app.collapsed, list.collapsed  - with --mode sample, collapsed
+                                            stacks for flamegraph.pl or
+                                            speedscope
+    create_app.prof, list.prof            - with --mode cprofile, pstats for
+                                            snakeviz, flameprof or pstats
+
+The functions with the most cumulative time (cprofile) or that were running
+in the most samples (sample) are printed as well.
+
+Usage:
+    python -m benchmarks.profile_app --items 10000 --requests 20
+    python -m benchmarks.profile_app --mode cprofile --output-dir /tmp/profiles
+
+The database is a throwaway SQLite file unless --database-uri is given. The
+tables are dropped and re-created, so never point it at a database you care
+about. Run it in a fresh interpreter: create_app() imports the service, and a
+second import in the same process costs nothing to profile.
+"""
+import io
+import os
+import sys
+import random
+import pstats
+import argparse
+import tempfile
+from collections import Counter
+
+TOP = 15
+
+
+def profiled(mode: str, interval: float, func) -> bytes:
+    """Runs func() under the profiler and returns the profile"""
+    # pylint: disable=import-outside-toplevel
+    from service.common.profiling import Profile
+
+    profile = Profile(mode, interval)
+    profile.start()
+    try:
+        func()
+    finally:
+        data = profile.stop()
+    return data
+
+
+def summary(mode: str, path: str) -> str:
+    """Returns the functions that took the most time"""
+    if mode == "cprofile":
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(TOP)
+        return out.getvalue()
+    # the innermost frame of a stack is the function that was running
+    counts = Counter()
+    with open(path, encoding="utf-8") as stacks:
+        for line in stacks:
+            stack, _, count = line.rpartition(" ")
+            counts[stack.rpartition(";")[2]] += int(count)
+    total = counts.total() or 1
+    return "".join(f"{count * 100 / total:6.1f}%  {name}\n" for name, count in counts.most_common(TOP))
+
+
+def profile_list(app, mode: str, interval: float, requests: int) -> bytes:
+    """Profiles `requests` calls of GET /api/inventory"""
+    client = app.test_client()
+
+    def list_items():
+        for _ in range(requests):
+            client.get("/api/inventory")
+
+    return profiled(mode, interval, list_items)
+
+
+def main():
+    """Profiles the start-up and the list endpoint"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("sample", "cprofile"), default="sample")
+    parser.add_argument("--interval-ms", type=float, default=1.0, help="milliseconds between samples")
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--database-uri", default=os.getenv("DATABASE_URI"))
+    parser.add_argument("--output-dir", default=".")
+    args = parser.parse_args()
+    suffix = "prof" if args.mode == "cprofile" else "collapsed"
+    interval = args.interval_ms / 1000
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_uri = args.database_uri or f"sqlite:///{tmpdir}/bench.db"
+        # the config module reads DATABASE_URI when it is imported
+        os.environ["DATABASE_URI"] = database_uri
+        # pylint: disable=import-outside-toplevel
+        import service
+
+        apps = []
+        outputs = {"create_app": profiled(args.mode, interval, lambda: apps.append(service.create_app()))}
+
+        from benchmarks.http_load import seed_database
+        seed_database(database_uri, args.items, random.Random(42))
+        outputs["list"] = profile_list(apps[0], args.mode, interval, args.requests)
+
+    for name, data in outputs.items():
+        path = os.path.join(args.output_dir, f"{name}.{suffix}")
+        with open(path, "wb") as output:
+            output.write(data)
+        print(f"==> {path}", file=sys.stderr)
+        print(summary(args.mode, path), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Per-worker memory measurement for the gunicorn configuration
+
+Starts gunicorn twice, once with the app preloaded in the master and once
+without, warms every worker up with a few requests and then reports the
+memory of each worker process as read from /proc/<pid>/smaps_rollup:
+
+    rss - resident set size (what `ps` and the k8s limit count)
+    pss - proportional set size (shared pages split between sharers)
+    uss - unique set size (pages only this worker holds)
+
+Usage:
+    python -m benchmarks.worker_rss --workers 4 --output rss.json
+
+Linux only. Uses a throwaway SQLite database unless DATABASE_URI is set.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from urllib.request import urlopen
+
+
+def read_memory(pid: int) -> dict:
+    """Returns the rss, pss and uss of a process in kB"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup", encoding="utf-8") as rollup:
+        for line in rollup:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss_kb": values.get("Rss", 0),
+        "pss_kb": values.get("Pss", 0),
+        "uss_kb": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+    }
+
+
+def worker_pids(master_pid: int) -> list:
+    """Returns the pids of the gunicorn workers forked by the master"""
+    with open(f"/proc/{master_pid}/task/{master_pid}/children", encoding="utf-8") as children:
+        return [int(pid) for pid in children.read().split()]
+
+
+def wait_until_up(url: str, timeout: float) -> None:
+    """Polls the health check until the server answers"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urlopen(url, timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server did not come up at {url}")
+
+
+def measure(preload: bool, args) -> dict:
+    """Runs gunicorn in one mode and measures its workers"""
+    env = dict(os.environ, GUNICORN_PRELOAD="true" if preload else "false")
+    bind = f"127.0.0.1:{args.port}"
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py",
+         "--bind", bind, "--workers", str(args.workers), "--log-level", "warning", "wsgi:app"],
+        env=env,
+    )
+    try:
+        base_url = f"http://{bind}"
+        wait_until_up(f"{base_url}/health", args.timeout)
+        # give every worker a chance to handle real traffic
+        for _ in range(args.workers * args.requests):
+            with urlopen(f"{base_url}/api/inventory", timeout=5) as response:
+                response.read()
+        time.sleep(1)
+        workers = [read_memory(pid) for pid in worker_pids(server.pid)]
+        result = {
+            "preload": preload,
+            "master": read_memory(server.pid),
+            "workers": workers,
+        }
+        for key in ("rss_kb", "pss_kb", "uss_kb"):
+            result[f"mean_worker_{key}"] = round(sum(w[key] for w in workers) / len(workers))
+        result["total_pss_kb"] = result["master"]["pss_kb"] + sum(w["pss_kb"] for w in workers)
+        return result
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    """Measures both modes and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--requests", type=int, default=20, help="warm-up requests per worker")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--output", help="file to write the JSON results to")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ.setdefault("DATABASE_URI", f"sqlite:///{tmpdir}/bench.db")
+        results = {
+            "workers": args.workers,
+            "without_preload": measure(False, args),
+            "with_preload": measure(True, args),
+        }
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
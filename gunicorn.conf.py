@@ -0,0 +1,65 @@
+"""
+Gunicorn configuration for the Inventory Service
+
+The application is imported once in the master process (``preload_app``) so
+that every worker shares the imported code and module data copy-on-write
+instead of carrying its own copy. To keep those pages shared, the garbage
+collector is disabled while the master imports the app, the surviving objects
+are frozen right before each fork, and collection is re-enabled in the worker,
+and in the master once the app is imported.
+Each worker also disposes of the SQLAlchemy connection pool it inherited so
+that no two processes ever share a database socket, and starts its own log
+writer thread, as the master's does not survive the fork.
+
+Set GUNICORN_PRELOAD=false to fall back to importing the app in every worker.
+Each worker serves requests from a pool of GUNICORN_THREADS threads (4 by
+default), so a slow request does not hold up the ones behind it, identical
+concurrent reads share one query, and admission control has requests to
+shed. Set it to 1 for plain sync workers.
+"""
+import gc
+import os
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("true", "yes", "1")
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+
+if preload_app:
+    # Avoid leaving freed "holes" in pages that the workers will inherit
+    gc.disable()
+
+
+def _dispose_engines(app, close: bool) -> None:
+    """Drops every pooled connection held by the app's SQLAlchemy engines"""
+    # pylint: disable=import-outside-toplevel
+    from service.models import db
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=close)
+
+
+def when_ready(server):
+    """Closes the connections the master opened while importing the app and re-enables collection"""
+    if server.cfg.preload_app:
+        _dispose_engines(server.app.wsgi(), close=True)
+        # the master runs for as long as the service does, and pre_fork freezes whatever it allocated
+        gc.enable()
+
+
+def pre_fork(server, worker):  # pylint: disable=unused-argument
+    """Moves everything allocated so far out of reach of the collector"""
+    if server.cfg.preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    """Re-enables collection, resets the inherited connection pool and restarts the log writer"""
+    if server.cfg.preload_app:
+        # pylint: disable=import-outside-toplevel
+        from service.common.log_handlers import restart_logging
+
+        gc.enable()
+        app = worker.app.wsgi()
+        # close=False leaves any inherited sockets to the master
+        _dispose_engines(app, close=False)
+        restart_logging(app)
@@ -22,7 +22,9 @@ import sys
 from flask import Flask
 from flask_restx import Api
 from service import config
-from service.common import log_handlers
+from service.common import (
+    admission, assets, compression, log_handlers, openapi, profiling, readiness, tracing, write_behind
+)
 
 # Will be initialize when app is created
 api = None  # pylint: disable=invalid-name
@@ -39,12 +41,18 @@ def create_app():
 
     # Initialize Plugins
     # pylint: disable=import-outside-toplevel
-    from service.models import db
+    from service.models import db, create_shard_tables, upgrade_tables
     db.init_app(app)
 
     # Turn off strict slashes because it violates best practices
     app.url_map.strict_slashes = False
 
+    # Serve the UI assets under fingerprinted, cacheable URLs
+    assets.init_assets(app)
+
+    # Tell the load balancer whether the databases can be reached
+    readiness.init_readiness(app)
+
     ######################################################################
     # Configure Swagger before initializing it
     ######################################################################
@@ -67,12 +75,26 @@ def create_app():
         from service.common import error_handlers, cli_commands  # noqa: F401, E402
 
         try:
-            db.create_all()
+            # the replicas are read only copies of the primary
+            db.create_all(bind_key=None)
+            upgrade_tables(db.engine)
+            create_shard_tables()
         except Exception as error:  # pylint: disable=broad-except
             app.logger.critical("%s: Cannot continue", error)
             # gunicorn requires exit code 4 to stop spawning workers when they die
             sys.exit(4)
 
+        # Build swagger.json once instead of on request
+        openapi.init_openapi(app, api)
+
+        # Shed load before it reaches the routes
+        admission.init_admission(app)
+        # Trace every request, including the ones shed above
+        tracing.init_tracing(app)
+        compression.init_compression(app)
+        profiling.init_profiling(app)
+        write_behind.init_write_behind(app)
+
         # Set up logging for production
         log_handlers.init_logging(app, "gunicorn.error")
 
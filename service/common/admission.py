@@ -0,0 +1,197 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Admission Control
+
+Sheds load in the worker before a request touches the database, so that a
+traffic spike is answered quickly with 429 or 503 instead of queueing until
+the connection pool times out. Every request is given a priority:
+
+    CRITICAL  - health checks and decrements, always admitted
+    NORMAL    - single item reads and writes
+    EXPENSIVE - listing the inventory, shed first (counting it with HEAD is
+                NORMAL)
+
+A request is refused with 503 when it already waited longer than its
+priority may in the queue in front of the worker (measured from the
+X-Request-Start header the proxy adds), or when the worker already runs as
+many requests as its priority may use, and with 429 when its client has run
+out of tokens. Every refusal carries a Retry-After header. Behind
+TRUSTED_PROXIES proxies, clients are told apart by the address the proxies
+forward in X-Forwarded-For instead of the proxy's own.
+
+The tokens of a client are split evenly between the worker processes of a
+pod, so that the pod as a whole lets the client send at the configured rate.
+"""
+import math
+import time
+import threading
+from collections import OrderedDict
+from flask import g, request
+from werkzeug.middleware.proxy_fix import ProxyFix
+from . import status  # pylint: disable=E0611
+
+CRITICAL = "critical"
+NORMAL = "normal"
+EXPENSIVE = "expensive"
+
+CRITICAL_ENDPOINTS = frozenset(["health_check", "ready_check", "decrement_resource"])
+EXPENSIVE_ENDPOINTS = frozenset(["inventory_item_collection"])
+
+
+def queue_age(header, now: float = None):
+    """Returns the seconds since the proxy received a request, from its X-Request-Start header, or None"""
+    try:
+        started = float((header or "").strip().removeprefix("t="))
+    except ValueError:
+        return None
+    # nginx sends seconds, other proxies milliseconds or microseconds
+    while started > 1e11:
+        started /= 1000
+    return max(0.0, (time.time() if now is None else now) - started)
+
+
+def priority_of(endpoint: str, method: str) -> str:
+    """Returns the priority of a request to an endpoint"""
+    if endpoint in CRITICAL_ENDPOINTS:
+        return CRITICAL
+    if endpoint in EXPENSIVE_ENDPOINTS and method == "GET":
+        return EXPENSIVE
+    return NORMAL
+
+
+class TokenBuckets:
+    """
+    One token bucket per client, refilled continuously at rate tokens per second
+
+    Only the max_clients most recently seen clients are remembered; a client
+    that is forgotten starts again with a full bucket.
+    """
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, client: str, cost: float) -> float:
+        """Takes cost tokens and returns 0, or the seconds to wait if there are too few"""
+        with self._lock:
+            now = self._clock()
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / self.rate
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class ConcurrencyLimit:
+    """
+    Caps the requests a worker runs at once
+
+    NORMAL requests may use every slot, EXPENSIVE requests only a share of
+    them, so the expensive ones are refused first as load builds up.
+    CRITICAL requests are always let in but still occupy a slot.
+    """
+
+    def __init__(self, limit: int, expensive_share: float):
+        self.limit = limit
+        self.expensive_limit = max(1, int(limit * expensive_share))
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, priority: str) -> bool:
+        """Takes a slot and returns True, or returns False if none is free"""
+        with self._lock:
+            allowed = {CRITICAL: math.inf, NORMAL: self.limit, EXPENSIVE: self.expensive_limit}[priority]
+            if self.active >= allowed:
+                return False
+            self.active += 1
+            return True
+
+    def release(self) -> None:
+        """Gives a slot back"""
+        with self._lock:
+            self.active -= 1
+
+
+def _refuse(status_code: int, error: str, message: str, retry_after: float):
+    """Returns an error response in the shape of the error handlers"""
+    body = {"status": status_code, "error": error, "message": message}
+    return body, status_code, {"Retry-After": str(max(1, math.ceil(retry_after)))}
+
+
+def init_admission(app) -> None:
+    """Installs admission control in front of every route of the app"""
+    share = app.config["ADMISSION_EXPENSIVE_SHARE"]
+    limit = ConcurrencyLimit(app.config["ADMISSION_MAX_CONCURRENT"], share)
+    max_queue = app.config["ADMISSION_MAX_QUEUE_MS"] / 1000
+    queue_limits = {NORMAL: max_queue, EXPENSIVE: max_queue * share} if max_queue > 0 else {}
+    costs = {CRITICAL: 0, NORMAL: 1, EXPENSIVE: app.config["ADMISSION_EXPENSIVE_COST"]}
+    rate, workers = app.config["ADMISSION_RATE"], app.config["ADMISSION_WORKERS"]
+    # a bucket must still hold one expensive request
+    burst = max(app.config["ADMISSION_BURST"] / workers, costs[EXPENSIVE])
+    buckets = TokenBuckets(rate / workers, burst) if rate > 0 else None
+    proxies = app.config["TRUSTED_PROXIES"]
+    if proxies:
+        # every client would otherwise share the bucket of the proxy's address
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies)
+
+    def admit():
+        """Refuses the request early if it waited too long, or the worker or the client is over its limit"""
+        priority = priority_of(request.endpoint, request.method)
+        waited = queue_age(request.headers.get("X-Request-Start"))
+        if priority in queue_limits and waited is not None and waited > queue_limits[priority]:
+            app.logger.warning(
+                "Shed %s request %s %s after %.3fs in the queue", priority, request.method, request.path, waited
+            )
+            return _refuse(
+                status.HTTP_503_SERVICE_UNAVAILABLE, "Service Unavailable",
+                "The request waited too long for the server", app.config["ADMISSION_RETRY_AFTER"],
+            )
+        if buckets and costs[priority]:
+            wait = buckets.take(request.remote_addr or "", costs[priority])
+            if wait:
+                app.logger.warning("Rate limited %s %s from %s", request.method, request.path, request.remote_addr)
+                return _refuse(status.HTTP_429_TOO_MANY_REQUESTS, "Too Many Requests", "Rate limit exceeded", wait)
+        if limit.limit > 0:
+            if not limit.acquire(priority):
+                app.logger.warning("Shed %s request %s %s", priority, request.method, request.path)
+                return _refuse(
+                    status.HTTP_503_SERVICE_UNAVAILABLE, "Service Unavailable",
+                    "The server is too busy, try again later", app.config["ADMISSION_RETRY_AFTER"],
+                )
+            g.admission_slot = True
+        return None
+
+    def release(_error):
+        """Frees the slot of an admitted request"""
+        if g.pop("admission_slot", False):
+            limit.release()
+
+    # run before every other hook, so refused requests cost as little as possible
+    app.before_request_funcs.setdefault(None, []).insert(0, admit)
+    app.teardown_request(release)
+    app.extensions["admission"] = limit
@@ -0,0 +1,152 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Static Assets
+
+Serves the files of the static folder under fingerprinted URLs such as
+/assets/js/rest_api.0123456789ab.js, where the fingerprint is a hash of the
+file. Because the URL changes whenever the file does, browsers may cache
+assets for a year without revalidating them. index.html is rewritten to
+point at those URLs and is only cached briefly.
+
+Run this module to write precompressed .gz (and, with brotli installed,
+.br) copies of the assets, which are served to clients that accept them:
+
+    python -m service.common.assets service/static
+"""
+import os
+import re
+import sys
+import gzip
+import hashlib
+import mimetypes
+from flask import abort, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+INDEX_MAX_AGE = 60
+PRECOMPRESSED = {"br": ".br", "gzip": ".gz"}  # in order of preference
+COMPRESSIBLE_EXTENSIONS = (".css", ".html", ".js", ".json", ".svg", ".txt")
+STATIC_REFERENCE = re.compile(r'(src|href)="/?static/([^"]+)"')
+
+
+class Assets:
+    """The fingerprinted URLs and precompressed copies of a static folder"""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.urls = {}  # original path -> fingerprinted path
+        self.originals = {}  # fingerprinted path -> original path
+        self.encodings = {}  # original path -> encodings with a precompressed copy
+        for path in _static_files(folder):
+            with open(os.path.join(folder, path), "rb") as asset:
+                digest = hashlib.sha256(asset.read()).hexdigest()[:12]
+            stem, extension = os.path.splitext(path)
+            fingerprinted = f"{stem}.{digest}{extension}"
+            self.urls[path] = fingerprinted
+            self.originals[fingerprinted] = path
+            self.encodings[path] = [
+                encoding for encoding, suffix in PRECOMPRESSED.items()
+                if os.path.exists(os.path.join(folder, path + suffix))
+            ]
+        with open(os.path.join(folder, "index.html"), "rb") as index:
+            self.index = STATIC_REFERENCE.sub(self._asset_reference, index.read().decode("utf-8")).encode("utf-8")
+        self.index_etag = hashlib.sha256(self.index).hexdigest()[:16]
+
+    def url_for(self, path: str) -> str:
+        """Returns the fingerprinted URL of a static file"""
+        return f"/assets/{self.urls[path]}"
+
+    def _asset_reference(self, match) -> str:
+        """Replaces a static/ reference found in index.html"""
+        attribute, path = match.groups()
+        if path not in self.urls:
+            return match.group(0)
+        return f'{attribute}="{self.url_for(path)}"'
+
+
+def _static_files(folder: str):
+    """Yields the path of every asset under folder, relative to it"""
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            if name == "index.html" or name.endswith(tuple(PRECOMPRESSED.values())):
+                continue
+            yield os.path.relpath(os.path.join(root, name), folder).replace(os.sep, "/")
+
+
+def init_assets(app) -> None:
+    """Adds the /assets route to the app"""
+    assets = Assets(app.static_folder)
+    app.extensions["assets"] = assets
+
+    @app.route("/assets/<path:filename>")
+    def asset(filename):
+        """Serves a fingerprinted asset that may be cached forever"""
+        path = assets.originals.get(filename)
+        if path is None:
+            abort(404)
+        encoding = None
+        if assets.encodings[path]:
+            encoding = request.accept_encodings.best_match(assets.encodings[path]) if request.accept_encodings else None
+        mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        response = send_from_directory(
+            assets.folder, path + PRECOMPRESSED[encoding] if encoding else path, mimetype=mimetype
+        )
+        response.headers["Cache-Control"] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+        if assets.encodings[path]:
+            response.vary.add("Accept-Encoding")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        return response
+
+
+def send_index(app):
+    """Returns index.html pointing at the fingerprinted assets"""
+    assets = app.extensions["assets"]
+    response = app.response_class(assets.index, mimetype="text/html")
+    response.set_etag(assets.index_etag)
+    response.headers["Cache-Control"] = f"public, max-age={INDEX_MAX_AGE}"
+    return response.make_conditional(request)
+
+
+def precompress(folder: str) -> list:
+    """Writes a .gz, and with brotli a .br, copy of every text asset and returns their paths"""
+    written = []
+    for path in _static_files(folder):
+        if not path.endswith(COMPRESSIBLE_EXTENSIONS):
+            continue
+        source = os.path.join(folder, path)
+        with open(source, "rb") as asset:
+            data = asset.read()
+        # mtime=0 keeps the output identical from one build to the next
+        copies = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            copies[".br"] = brotli.compress(data, quality=11)
+        for suffix, compressed in copies.items():
+            with open(source + suffix, "wb") as copy:
+                copy.write(compressed)
+            written.append(path + suffix)
+    return written
+
+
+if __name__ == "__main__":
+    for written_path in precompress(sys.argv[1] if len(sys.argv) > 1 else "service/static"):
+        print(f"Wrote {written_path}")
@@ -0,0 +1,46 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Background Threads
+
+gunicorn imports the app once in the master and forks the workers from it
+(see gunicorn.conf.py). A fork copies the memory of the master but none of
+its threads, so a thread or pool started while the app is imported would be
+dead in every worker while still looking alive to the code holding it.
+Lazy defers starting one until it is first used, which is always in the
+process that goes on to use it.
+"""
+import threading
+
+
+class Lazy:
+    """Creates a thread or a thread pool on first use, once"""
+
+    def __init__(self, start):
+        """
+        :param start: called without arguments to start the thread or pool and return it
+        """
+        self._start = start
+        self._lock = threading.Lock()
+        self._value = None
+
+    def get(self):
+        """Returns the thread or pool, starting it if this is the first use"""
+        with self._lock:
+            if self._value is None:
+                self._value = self._start()
+            return self._value
@@ -16,8 +16,21 @@
 """
 Flask CLI Command Extensions
 """
+import os
+import csv
+import gzip
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from contextlib import closing
+from itertools import islice
+import click
 from flask import current_app as app  # Import Flask application
-from service.models import db
+from sqlalchemy import delete, func, select
+from service.models import (
+    db, DataValidationError, InventoryItem, InventoryItemArchive, ITEM_FIELDS,
+    allocate_ids, create_shard_tables, item_validator, record_shards, shard_for, shard_keys
+)
 
 
 ######################################################################
@@ -31,6 +44,342 @@ def db_create():
     Recreates a local database. You probably should not use this on
     production. ;-)
     """
-    db.drop_all()
-    db.create_all()
+    db.drop_all(bind_key=None)
+    db.create_all(bind_key=None)
+    create_shard_tables(drop=True)
     db.session.commit()
+
+
+######################################################################
+# Command to write the OpenAPI specification, e.g. for the API gateway
+# Usage:
+#   flask openapi-dump swagger.json
+#   flask openapi-dump -
+######################################################################
+@app.cli.command("openapi-dump")
+@click.argument("output", type=click.File("wb"))
+def openapi_dump(output):
+    """Writes the OpenAPI (swagger.json) specification of the service"""
+    spec = app.extensions.get("openapi")
+    if spec is None:
+        raise click.ClickException("The OpenAPI specification could not be built, see the log")
+    output.write(spec.body)
+    click.echo(f"Wrote the OpenAPI specification, ETag \"{spec.etag}\"", err=True)
+
+
+######################################################################
+# Command to spread the quantity of a hot item over several counter rows
+# Usage:
+#   flask inventory-hot 42 --slots 16
+#   flask inventory-hot 42 --slots 1      # back to a single row
+######################################################################
+@app.cli.command("inventory-hot")
+@click.argument("item_id", type=int)
+@click.option("--slots", default=8, show_default=True, help="Counter rows to spread the quantity over")
+def inventory_hot(item_id, slots):
+    """Spreads the quantity of an inventory item over several counter rows"""
+    item = InventoryItem.find(item_id)
+    if not item:
+        raise click.ClickException(f"Item with id '{item_id}' was not found.")
+    item.split_quantity(slots)
+    if slots > 1:
+        click.echo(f"Spread the quantity of item {item_id} ({item.quantity}) over {slots} slots")
+    else:
+        click.echo(f"Moved the quantity of item {item_id} ({item.quantity}) back into the item")
+
+
+######################################################################
+# Command to move inventory items onto the shards that own them
+# Usage:
+#   flask inventory-rebalance
+#   flask inventory-rebalance --dry-run
+######################################################################
+@app.cli.command("inventory-rebalance")
+@click.option("--batch-size", default=1000, show_default=True, help="Rows read from a database at a time")
+@click.option("--dry-run", is_flag=True, help="Only count the rows that would move")
+def inventory_rebalance(batch_size, dry_run):
+    """
+    Moves every item that is not on the shard its product_id maps to, e.g.
+    after adding a shard to DATABASE_SHARD_URIS. Items still stored on the
+    primary database from before sharding was enabled are moved as well.
+    Then records where every item and archived item is in the shard directory.
+    """
+    keys = shard_keys()
+    if not keys:
+        raise click.ClickException("No shards are configured, set DATABASE_SHARD_URIS")
+    moved = highest = 0
+    for key in [None] + keys:
+        engine = db.engines[key]
+        with engine.connect() as connection:
+            highest = max(highest, connection.execute(select(func.max(InventoryItem.id))).scalar() or 0)
+        for rows in _misplaced(engine, key, keys, batch_size):
+            if not dry_run:
+                InventoryItem.bulk_load(rows)
+                if key is None:
+                    with engine.begin() as connection:
+                        connection.execute(delete(InventoryItem.__table__).where(
+                            InventoryItem.id.in_([row["id"] for row in rows])
+                        ))
+            moved += len(rows)
+            click.echo(f"{'Would move' if dry_run else 'Moved'} {len(rows)} items from {key or 'the primary'}")
+    if not dry_run:
+        # new items must never reuse an id that was stored before sharding
+        allocate_ids(0, highest)
+        for key in keys:
+            for item_ids in _stored_ids(db.engines[key], batch_size):
+                record_shards(dict.fromkeys(item_ids, key))
+    click.echo(f"{'Would move' if dry_run else 'Moved'} {moved} items in total")
+
+
+def _stored_ids(engine, batch_size: int):
+    """Yields batches of the ids of the items and archived items of one database"""
+    for table in (InventoryItem.__table__, InventoryItemArchive.__table__):
+        last_id = 0
+        while True:
+            with engine.connect() as connection:
+                item_ids = connection.execute(
+                    select(table.c.id).where(table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+                ).scalars().all()
+            if not item_ids:
+                break
+            last_id = item_ids[-1]
+            yield item_ids
+
+
+def _misplaced(engine, key, keys: list, batch_size: int):
+    """Yields batches of the rows of one database that belong on another shard"""
+    table = InventoryItem.__table__
+    last_id = 0
+    while True:
+        with engine.connect() as connection:
+            rows = connection.execute(
+                select(table).where(table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+            ).mappings().all()
+        if not rows:
+            return
+        last_id = rows[-1]["id"]
+        misplaced = [dict(row) for row in rows if shard_for(row["product_id"], keys) != key]
+        if misplaced:
+            yield misplaced
+
+
+######################################################################
+# Command to bulk load inventory items from a file
+# Usage:
+#   flask inventory-import items.csv
+#   flask inventory-import items.ndjson.gz --chunk-size 10000
+######################################################################
+INTEGER_COLUMNS = ("id", "quantity", "product_id", "restock_level")
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+@app.cli.command("inventory-import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "file_format", type=click.Choice(["csv", "ndjson"]),
+              help="File format (default: guessed from the file name)")
+@click.option("--chunk-size", default=5000, show_default=True, help="Rows validated and loaded at a time")
+@click.option("--rejects", type=click.Path(dir_okay=False),
+              help="Where to write rejected rows (default: PATH.rejects.ndjson)")
+def inventory_import(path, file_format, chunk_size, rejects):
+    """
+    Streams inventory items from a CSV or NDJSON file (optionally gzipped)
+    into the database. Rows with an id replace the stored item with that id.
+    Rows that fail validation are written to a rejects file with the reason.
+    """
+    file_format = file_format or ("csv" if ".csv" in path.lower() else "ndjson")
+    reader = _read_csv if file_format == "csv" else _read_ndjson
+    started = time.perf_counter()
+    loaded = 0
+    with _open_text(path) as stream, closing(_Rejects(rejects or f"{path}.rejects.ndjson")) as rejected:
+        rows = reader(stream)
+        while chunk := list(islice(rows, chunk_size)):
+            try:
+                loaded += InventoryItem.bulk_load(_validate_chunk(chunk, rejected))
+            except DataValidationError as error:
+                raise click.ClickException(
+                    f"Loading the rows ending at line {chunk[-1][0]} failed after {loaded} rows: {error}"
+                ) from error
+
+    elapsed = time.perf_counter() - started
+    click.echo(f"Imported {loaded} items in {elapsed:.2f}s ({loaded / elapsed:.0f} rows/s)")
+    if rejected.count:
+        click.echo(f"Rejected {rejected.count} rows, see {rejected.path}")
+
+
+class _Rejects:
+    """Writes rejected rows to an NDJSON side file that is created on first use"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._file = None
+
+    def write(self, line: int, row, errors: list) -> None:
+        """Records one rejected row and the reasons it was rejected"""
+        if self._file is None:
+            self._file = open(self.path, "w", encoding="utf-8")  # pylint: disable=consider-using-with
+        self._file.write(json.dumps({"line": line, "errors": errors, "row": row}) + "\n")
+        self.count += 1
+
+    def close(self) -> None:
+        """Closes the side file if anything was written to it"""
+        if self._file is not None:
+            self._file.close()
+
+
+def _validate_chunk(chunk: list, rejected: _Rejects) -> list:
+    """Returns the cleaned rows of a chunk and hands the bad ones to rejected"""
+    cleaned, failures = item_validator.validate_many(row for _, row in chunk)
+    errors = dict(failures)
+    # the cleaned rows are the ones without errors, in the order of the chunk
+    cleaned = iter(cleaned)
+    valid = []
+    for index, (line, row) in enumerate(chunk):
+        row_errors = errors.get(index)
+        item = None if row_errors else next(cleaned)
+        item_id = row.get("id") if isinstance(row, dict) else None
+        if item_id is not None and not isinstance(item_id, int):
+            row_errors = (row_errors or []) + [f"Invalid type for integer [id]: {type(item_id)}"]
+        if row_errors:
+            rejected.write(line, row, row_errors)
+            continue
+        if item_id is not None:
+            item["id"] = item_id
+        valid.append(item)
+    return valid
+
+
+def _open_text(path: str, mode: str = "r", compress: bool = False):
+    """Opens a text file, gzipped if asked to, if its name ends in .gz or, when reading, if its content is"""
+    if mode == "r" and not compress:
+        with open(path, "rb") as raw:
+            compress = raw.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+    if compress or path.endswith(".gz"):
+        return gzip.open(path, f"{mode}t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")  # pylint: disable=consider-using-with
+
+
+def _read_csv(stream):
+    """Yields (line number, row) for every record of a CSV file with a header"""
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, {key: _csv_value(key, value) for key, value in row.items()}
+
+
+def _csv_value(key: str, value):
+    """Converts a CSV cell into the type the validator expects"""
+    if value == "":
+        return None
+    if key in INTEGER_COLUMNS:
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _read_ndjson(stream):
+    """Yields (line number, object) for every non-blank line of an NDJSON file"""
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            yield line, json.loads(text)
+        except json.JSONDecodeError:
+            # the validator rejects anything that is not an object
+            yield line, text.rstrip("\n")
+
+
+######################################################################
+# Command to export every inventory item to a file
+# Usage:
+#   flask inventory-export items.csv
+#   flask inventory-export items.ndjson --gzip
+######################################################################
+@app.cli.command("inventory-export")
+@click.argument("path", type=click.Path(dir_okay=False))
+@click.option("--format", "file_format", type=click.Choice(["csv", "ndjson"]),
+              help="File format (default: guessed from the file name)")
+@click.option("--gzip", "compress", is_flag=True, help="Compress the output (implied by a .gz file name)")
+@click.option("--batch-size", default=1000, show_default=True, help="Rows fetched per database round trip")
+def inventory_export(path, file_format, compress, batch_size):
+    """
+    Writes every inventory item to a CSV or NDJSON file from one consistent
+    snapshot of the database, streaming so memory use stays constant.
+    """
+    file_format = file_format or ("csv" if ".csv" in path.lower() else "ndjson")
+    writer = _write_csv if file_format == "csv" else _write_ndjson
+    started = time.perf_counter()
+    with _open_text(path, "w", compress) as stream:
+        exported = writer(stream, InventoryItem.export_rows(batch_size))
+    elapsed = time.perf_counter() - started
+    click.echo(f"Exported {exported} items to {path} in {elapsed:.2f}s ({exported / elapsed:.0f} rows/s)")
+
+
+def _write_csv(stream, rows) -> int:
+    """Writes rows as CSV with a header and returns how many were written"""
+    writer = csv.DictWriter(stream, fieldnames=ITEM_FIELDS)
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def _write_ndjson(stream, rows) -> int:
+    """Writes rows as one JSON object per line and returns how many were written"""
+    count = 0
+    for row in rows:
+        stream.write(json.dumps(row) + "\n")
+        count += 1
+    return count
+
+
+######################################################################
+# Command to move old archived items out of the database
+# Usage:
+#   flask archive-compact archive-2024.ndjson.gz
+#   flask archive-compact archive-2024.ndjson.gz --older-than 90
+######################################################################
+@app.cli.command("archive-compact")
+@click.argument("path", type=click.Path(dir_okay=False))
+@click.option("--older-than", "days", default=365, show_default=True, help="Days since the items were archived")
+@click.option("--batch-size", default=1000, show_default=True, help="Rows read and deleted at a time")
+def archive_compact(path, days, batch_size):
+    """
+    Moves inventory items still marked archived into the archive, then writes
+    the items archived more than --older-than days ago to a gzipped NDJSON
+    file and deletes them from the database.
+    """
+    if os.path.exists(path):
+        raise click.ClickException(f"{path} already exists, compacting never overwrites a file")
+    swept = InventoryItemArchive.sweep()
+    if swept:
+        click.echo(f"Moved {swept} items marked archived into the archive")
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    last_ids = {}
+
+    def remember(rows):
+        for key, row in rows:
+            last_ids[key] = row["id"]
+            yield row
+
+    # nothing is deleted before every row is on disk
+    with open(path, "xb") as raw:
+        with gzip.open(raw, "wt", encoding="utf-8", newline="") as stream:
+            _write_ndjson(stream, remember(InventoryItemArchive.archived_before(cutoff, batch_size)))
+        raw.flush()
+        os.fsync(raw.fileno())
+    _fsync_directory(path)
+    compacted = InventoryItemArchive.purge(cutoff, last_ids, batch_size)
+    click.echo(f"Compacted {compacted} archived items into {path}")
+
+
+def _fsync_directory(path: str) -> None:
+    """Makes the creation of a file durable"""
+    descriptor = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
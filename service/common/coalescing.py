@@ -0,0 +1,90 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Request Coalescing
+
+When several threads of a worker ask for the same thing at the same time,
+only the first one runs the query; the others wait for it and share its
+result. Nothing is cached: a call that starts after the first one finished
+runs again. A caller that waited longer than the timeout for the first one
+stops waiting and runs the call itself. This only helps threaded workers
+(GUNICORN_THREADS > 1), as a sync worker never has two requests in flight.
+"""
+import threading
+from collections import defaultdict
+
+
+class _Call:  # pylint: disable=too-few-public-methods
+    """A call in flight that others can wait for"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs concurrent calls with the same key once and shares the result"""
+
+    def __init__(self, timeout: float = None):
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = defaultdict(lambda: {"executions": 0, "coalesced": 0, "timed_out": 0})
+
+    def do(self, name: str, key, func):
+        """
+        Returns func(), or the result of an identical call already in flight
+
+        Args:
+            name (str): what is being called, used to group the metrics
+            key: hashable arguments that make two calls identical
+            func: the call to make, without arguments
+        """
+        with self._lock:
+            call = self._calls.get((name, key))
+            leader = call is None
+            if leader:
+                call = self._calls[(name, key)] = _Call()
+                self._stats[name]["executions"] += 1
+            else:
+                self._stats[name]["coalesced"] += 1
+
+        if not leader:
+            if not call.done.wait(self._timeout):
+                with self._lock:
+                    self._stats[name]["timed_out"] += 1
+                return func()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[(name, key)]
+            call.done.set()
+        return call.result
+
+    def stats(self) -> dict:
+        """Returns how many calls ran and how many shared a result, by name"""
+        with self._lock:
+            return {name: dict(counts) for name, counts in self._stats.items()}
@@ -0,0 +1,172 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Response Compression
+
+Compresses JSON and text responses with the best encoding both sides support,
+as negotiated through Accept-Encoding. gzip is always available; brotli (br)
+and zstd are offered when the brotli and zstandard packages are installed.
+Bodies smaller than COMPRESSION_MIN_SIZE are sent as they are, and streamed
+responses are compressed chunk by chunk so they keep streaming.
+"""
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_TYPES = frozenset([
+    "application/json",
+    "application/javascript",
+    "image/svg+xml",
+    "text/css",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+])
+
+
+class GzipEncoder:
+    """Incremental gzip compression"""
+
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        """Compresses a chunk, possibly holding some of it back"""
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        """Returns everything compressed so far, so a chunk can be sent"""
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        """Ends the stream"""
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder:
+    """Incremental brotli compression"""
+
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        """Compresses a chunk, possibly holding some of it back"""
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        """Returns everything compressed so far, so a chunk can be sent"""
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        """Ends the stream"""
+        return self._compressor.finish()
+
+
+class ZstdEncoder:
+    """Incremental zstd compression"""
+
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        """Compresses a chunk, possibly holding some of it back"""
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        """Returns everything compressed so far, so a chunk can be sent"""
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        """Ends the stream"""
+        return self._compressor.flush()
+
+
+def available_encoders() -> dict:
+    """Returns {encoding: encoder class} in order of preference"""
+    encoders = {}
+    if zstandard is not None:
+        encoders["zstd"] = ZstdEncoder
+    if brotli is not None:
+        encoders["br"] = BrotliEncoder
+    encoders["gzip"] = GzipEncoder
+    return encoders
+
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    """Compresses a whole body in one go"""
+    encoder = available_encoders()[encoding](level)
+    return encoder.compress(data) + encoder.finish()
+
+
+def _stream(chunks, encoder):
+    """Compresses a streamed body, sending every chunk on as soon as it arrives"""
+    for chunk in chunks:
+        data = encoder.compress(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+        data += encoder.flush()
+        if data:
+            yield data
+    yield encoder.finish()
+
+
+def init_compression(app) -> None:
+    """Compresses the responses of the app when the client accepts it"""
+    encoders = available_encoders()
+    min_size = app.config["COMPRESSION_MIN_SIZE"]
+    levels = app.config["COMPRESSION_LEVELS"]
+
+    @app.after_request
+    def compress_response(response):
+        """Compresses a response with the best encoding the client accepts"""
+        if (
+            response.mimetype not in COMPRESSIBLE_TYPES
+            or response.status_code < 200
+            or response.status_code in (204, 304)
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+        # the body depends on Accept-Encoding, even when it is not compressed
+        response.vary.add("Accept-Encoding")
+        if not response.is_streamed and response.content_length is not None and response.content_length < min_size:
+            return response
+        if not request.accept_encodings:
+            return response
+        encoding = request.accept_encodings.best_match(list(encoders))
+        if encoding is None:
+            return response
+
+        level = levels[encoding]
+        if response.is_streamed:
+            response.response = _stream(response.response, encoders[encoding](level))
+            response.headers.pop("Content-Length", None)
+        else:
+            response.set_data(compress(response.get_data(), encoding, level))
+        response.headers["Content-Encoding"] = encoding
+        etag, _ = response.get_etag()
+        if etag:
+            # the bytes differ but the content does not, so If-None-Match still works
+            response.set_etag(etag, weak=True)
+        return response
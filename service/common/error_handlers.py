@@ -18,7 +18,7 @@ Module: error_handlers
 """
 
 from flask import current_app as app  # Import Flask application
-from service.models import DataValidationError
+from service.models import DataValidationError, InsufficientStockError
 from service import api
 from . import status  # pylint: disable=E0611
 
@@ -40,6 +40,18 @@ def request_validation_error(error):
     }, status.HTTP_400_BAD_REQUEST
 
 
+@api.errorhandler(InsufficientStockError)
+def insufficient_stock(error):
+    """Handles requests for more stock than an item has with 409_CONFLICT"""
+    message = str(error)
+    app.logger.warning(message)
+    return {
+        "status": status.HTTP_409_CONFLICT,
+        "error": "Conflict",
+        "message": message,
+    }, status.HTTP_409_CONFLICT
+
+
 @app.errorhandler(status.HTTP_404_NOT_FOUND)
 def not_found(error):
     """Handles resources not found with 404_NOT_FOUND"""
@@ -19,18 +19,119 @@ Log Handlers
 
 This module contains utility functions to set up logging
 consistently
+
+With LOG_QUEUE on, a request only puts its log records on a queue; a
+listener thread formats them and writes them to the gunicorn handlers, so a
+slow stdout never stalls a request. LOG_SAMPLE_RATES keeps only a fraction
+of the app's records of the noisy levels, before they are even queued. While
+requests are traced, every line of the app carries the trace id of the
+request that wrote it. The filters sit on the app's logger, so the server's
+own lines are never sampled.
 """
+import json
+import queue
+import atexit
+import random
 import logging
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from service.common.tracing import current_span
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s"
+TRACED_TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] [%(trace_id)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one line of JSON"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "trace_id", "-") != "-":
+            entry["trace_id"] = record.trace_id
+            entry["span_id"] = record.span_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class SamplingFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """Keeps the given fraction of the records of each level, and every record of the others"""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = {logging.getLevelName(level.upper()): rate for level, rate in rates.items()}
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno)
+        return rate is None or random.random() < rate
+
+
+class TraceFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """Adds the trace and span id of the request being served to a record, "-" outside of one"""
+
+    def filter(self, record):
+        span = current_span()
+        record.trace_id = span.trace_id if span else "-"
+        record.span_id = span.span_id if span else "-"
+        return True
+
+
+def _stop(listener: QueueListener) -> None:
+    """Writes the queued records and stops the listener, unless it was stopped already"""
+    if listener._thread is not None:
+        listener.stop()
 
 
 def init_logging(app, logger_name: str):
     """Set up logging for production"""
     app.logger.propagate = False
     gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
+    handlers = list(gunicorn_logger.handlers)
     app.logger.setLevel(gunicorn_logger.level)
     # Make all log formats consistent
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
-    for handler in app.logger.handlers:
+    traced = bool(app.config.get("TRACING_EXPORTER"))
+    if app.config.get("LOG_FORMAT") == "json":
+        formatter = JsonFormatter()
+    else:
+        # the server's own records have no trace id
+        formatter = logging.Formatter(TRACED_TEXT_FORMAT if traced else TEXT_FORMAT, DATE_FORMAT, defaults={"trace_id": "-"})
+    for handler in handlers:
         handler.setFormatter(formatter)
+
+    # a second call replaces the listener of the first
+    listener = app.extensions.pop("log_listener", None)
+    if listener is not None:
+        _stop(listener)
+    if app.config.get("LOG_QUEUE"):
+        records = queue.SimpleQueue()
+        listener = QueueListener(records, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(_stop, listener)
+        app.extensions["log_listener"] = listener
+        handlers = [QueueHandler(records)]
+    # a second call replaces the filters of the first
+    app.logger.filters = [
+        known for known in app.logger.filters if not isinstance(known, (SamplingFilter, TraceFilter))
+    ]
+    if app.config.get("LOG_SAMPLE_RATES"):
+        app.logger.addFilter(SamplingFilter(app.config["LOG_SAMPLE_RATES"]))
+    if traced:
+        # read here, on the thread that serves the request
+        app.logger.addFilter(TraceFilter())
+    app.logger.handlers = handlers
     app.logger.info("Logging handler established")
+
+
+def restart_logging(app):
+    """Starts the listener thread again in a worker forked from the master"""
+    listener = app.extensions.get("log_listener")
+    if listener is not None:
+        # the thread the master started did not survive the fork
+        listener._thread = None
+        listener.start()
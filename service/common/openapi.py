@@ -0,0 +1,60 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+OpenAPI Specification
+
+flask-restx builds swagger.json from the models on the first request that
+asks for it and encodes it again as JSON for every later one. This builds
+and encodes it once, when the app is created (in the gunicorn master, with
+preloading), and serves those bytes with an ETag and a long max-age, so the
+API gateway revalidates it with a body-less 304.
+"""
+import json
+import hashlib
+from flask import request
+
+OPENAPI_MAX_AGE = 24 * 60 * 60
+
+
+class Spec:  # pylint: disable=too-few-public-methods
+    """The encoded specification of an API"""
+
+    def __init__(self, schema: dict):
+        self.body = json.dumps(schema, separators=(",", ":")).encode("utf-8")
+        self.etag = hashlib.sha256(self.body).hexdigest()[:16]
+
+
+def init_openapi(app, api) -> None:
+    """Replaces the swagger.json view of the api with one that serves a prebuilt spec"""
+    # the spec holds URLs, which can only be built within a request
+    with app.test_request_context("/"):
+        schema = api.__schema__
+    if "error" in schema:
+        # leave the flask-restx view to report it
+        app.logger.error("Cannot build the OpenAPI specification: %s", schema["error"])
+        return
+    spec = Spec(schema)
+    app.extensions["openapi"] = spec
+
+    def specs():
+        """Serves the prebuilt spec"""
+        response = app.response_class(spec.body, mimetype="application/json")
+        response.set_etag(spec.etag)
+        response.headers["Cache-Control"] = f"public, max-age={OPENAPI_MAX_AGE}"
+        return response.make_conditional(request)
+
+    app.view_functions[api.endpoint("specs")] = specs
@@ -0,0 +1,174 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Request Profiling
+
+With PROFILING_TOKEN set, a request that sends the token in the X-Profile
+header runs under a profiler:
+
+    sample   - samples the stack of the request thread every
+               PROFILING_INTERVAL_MS and writes collapsed stacks, the input
+               of flamegraph.pl and speedscope (the default)
+    cprofile - traces every call with cProfile and writes pstats, for
+               snakeviz or flameprof
+
+Pick one with the X-Profile-Mode header or ?profile_mode=. The profile
+replaces the response body, or, with PROFILING_DIR set, is written there and
+named in the X-Profile-File header. One request per worker is profiled at a
+time; others are served as usual. The token is never read from the URL,
+which ends up in access logs and traces.
+"""
+import os
+import sys
+import hmac
+import time
+import pstats
+import marshal
+import cProfile
+import threading
+from collections import Counter
+from flask import current_app, g, request
+
+MODES = ("sample", "cprofile")
+SUFFIXES = {"sample": "collapsed", "cprofile": "prof"}
+MIMETYPES = {"sample": "text/plain", "cprofile": "application/octet-stream"}
+
+
+def _frame_name(frame) -> str:
+    """Returns how a frame is shown in a flame graph"""
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Counts the stacks of one thread, sampled from a background thread"""
+
+    def __init__(self, interval: float, thread_id: int = None):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self._done = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """Starts sampling the given thread, or the calling one"""
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops sampling"""
+        self._done.set()
+        self._thread.join()
+
+    def _sample(self) -> None:
+        """Adds the current stack of the thread every interval"""
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)  # pylint: disable=protected-access
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def collapsed(self) -> str:
+        """Returns the stacks in the collapsed format, one "stack count" per line"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class Profile:
+    """Runs one profiler and returns its output"""
+
+    def __init__(self, mode: str, interval: float):
+        self.mode = mode
+        if mode == "cprofile":
+            self._profiler = cProfile.Profile()
+        else:
+            self._profiler = SamplingProfiler(interval)
+
+    def start(self) -> None:
+        """Starts profiling the calling thread"""
+        if self.mode == "cprofile":
+            self._profiler.enable()
+        else:
+            self._profiler.start()
+
+    def stop(self) -> bytes:
+        """Stops profiling and returns the profile"""
+        if self.mode == "cprofile":
+            self._profiler.disable()
+            # what pstats.Stats.dump_stats() writes
+            return marshal.dumps(pstats.Stats(self._profiler).stats)
+        self._profiler.stop()
+        return self._profiler.collapsed().encode("utf-8")
+
+
+def _start_profile():
+    """Starts the profiler for a request with the right token"""
+    token = current_app.config["PROFILING_TOKEN"]
+    sent = request.headers.get("X-Profile")
+    if not sent or not hmac.compare_digest(sent.encode("utf-8"), token.encode("utf-8")):
+        return
+    mode = request.headers.get("X-Profile-Mode") or request.args.get("profile_mode") or "sample"
+    if mode not in MODES or not current_app.extensions["profiling"].acquire(blocking=False):
+        current_app.logger.warning("Not profiling %s %s in mode %s", request.method, request.path, mode)
+        return
+    g.profile = Profile(mode, current_app.config["PROFILING_INTERVAL_MS"] / 1000)
+    g.profile.start()
+
+
+def _end_profile(response):
+    """Returns the profile, or stores it"""
+    profile = g.pop("profile", None)
+    if profile is None:
+        return response
+    try:
+        data = profile.stop()
+    finally:
+        current_app.extensions["profiling"].release()
+    current_app.logger.info("Profiled %s %s in mode %s", request.method, request.path, profile.mode)
+    directory = current_app.config["PROFILING_DIR"]
+    if not directory:
+        response.set_data(data)
+        response.mimetype = MIMETYPES[profile.mode]
+        return response
+    name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{request.endpoint}.{SUFFIXES[profile.mode]}"
+    with open(os.path.join(directory, name), "wb") as output:
+        output.write(data)
+    response.headers["X-Profile-File"] = name
+    return response
+
+
+def _abandon_profile(_error):
+    """Stops a profiler that no response was made for"""
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profile.stop()
+        current_app.extensions["profiling"].release()
+
+
+def init_profiling(app) -> None:
+    """Lets requests that carry PROFILING_TOKEN be profiled"""
+    if not app.config.get("PROFILING_TOKEN"):
+        return
+    # held while a request of this worker is profiled
+    app.extensions["profiling"] = threading.Lock()
+    app.before_request(_start_profile)
+    app.after_request(_end_profile)
+    app.teardown_request(_abandon_profile)
@@ -0,0 +1,124 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Readiness Probe
+
+/health only says the process is alive. /ready also says whether the worker
+can serve requests right now:
+
+    OK       - every database answered SELECT 1 within READY_TIMEOUT_MS
+    DEGRADED - a connection pool has no connection left, so new requests
+               would queue; the databases are not even asked
+    FAIL     - a database did not answer in time, or refused
+
+Anything but OK is answered with 503 so the load balancer stops sending
+traffic to the pod. The result is kept for READY_CACHE_SECONDS and only one
+check runs at a time, so probes never pile up on the database.
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from sqlalchemy import text
+from service.models import db
+from . import status  # pylint: disable=E0611
+from .background import Lazy
+
+OK = "OK"
+DEGRADED = "DEGRADED"
+FAIL = "FAIL"
+
+
+def pool_usage(engine) -> tuple:
+    """Returns (connections checked out, most that can be) of an engine, capacity None if unbounded"""
+    pool = engine.pool
+    if not hasattr(pool, "checkedout"):
+        # SQLite in memory shares one connection and cannot run out
+        return 0, None
+    overflow = getattr(pool, "_max_overflow", -1)
+    return pool.checkedout(), None if overflow < 0 else pool.size() + overflow
+
+
+def ping(engines: dict) -> dict:
+    """Runs SELECT 1 on every engine and returns {name: milliseconds}"""
+    latencies = {}
+    for name, engine in engines.items():
+        start = time.perf_counter()
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        latencies[name] = round((time.perf_counter() - start) * 1000, 3)
+    return latencies
+
+
+class Readiness:
+    """Checks the databases of the app, at most once per cache interval"""
+
+    def __init__(self, app, timeout: float, ttl: float, clock=time.monotonic):
+        self.app = app
+        self.timeout = timeout
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._result = None
+        self._expires = 0.0
+        self._executor = Lazy(lambda: ThreadPoolExecutor(max_workers=1, thread_name_prefix="ready"))
+        self._running = None
+
+    def status(self) -> dict:
+        """Returns the cached result, or checks again once it is too old"""
+        with self._lock:
+            if self._result is None or self.clock() >= self._expires:
+                self._result = self._check()
+                self._expires = self.clock() + self.ttl
+            return self._result
+
+    def _check(self) -> dict:
+        """Checks the pools, and then the databases if no pool is exhausted"""
+        engines = {key or "primary": engine for key, engine in db.engines.items()}
+        pools = {}
+        for name, engine in engines.items():
+            checked_out, capacity = pool_usage(engine)
+            exhausted = capacity is not None and checked_out >= capacity
+            pools[name] = {"status": DEGRADED if exhausted else OK, "checked_out": checked_out, "capacity": capacity}
+        if any(pool["status"] != OK for pool in pools.values()):
+            return {"status": DEGRADED, "pools": pools}
+
+        if self._running is not None and not self._running.done():
+            # the last check is still stuck; do not send another one after it
+            return {"status": FAIL, "pools": pools, "databases": {}, "message": "The last check has not finished"}
+        self._running = self._executor.get().submit(ping, engines)
+        try:
+            databases = self._running.result(timeout=self.timeout)
+        except FutureTimeout:
+            return {"status": FAIL, "pools": pools, "databases": {}, "message": "The databases did not answer in time"}
+        except Exception as error:  # pylint: disable=broad-except
+            self.app.logger.warning("Readiness check failed: %s", error)
+            return {"status": FAIL, "pools": pools, "databases": {}, "message": str(error)}
+        return {"status": OK, "pools": pools, "databases": databases}
+
+
+def init_readiness(app) -> None:
+    """Adds the /ready route to the app"""
+    readiness = Readiness(app, app.config["READY_TIMEOUT_MS"] / 1000, app.config["READY_CACHE_SECONDS"])
+    app.extensions["readiness"] = readiness
+
+    @app.route("/ready")
+    def ready_check():
+        """Tells the load balancer whether to send requests to this worker"""
+        result = readiness.status()
+        if result["status"] == OK:
+            return result, status.HTTP_200_OK
+        return result, status.HTTP_503_SERVICE_UNAVAILABLE
@@ -0,0 +1,254 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Request Tracing
+
+With TRACING_EXPORTER set, every request opens a span, and every SQL
+statement and serialization within it a child span. A request that carries
+a W3C traceparent header joins that trace and keeps its sampling decision;
+any other request starts a new trace, sampled at TRACING_SAMPLE_RATE. The
+response carries the traceparent of the request's span, and log lines carry
+its trace id.
+
+The spans of a sampled request are handed to the exporter together when the
+request ends: "stdout", "file" (NDJSON in TRACING_FILE) or "module:factory",
+a callable that takes the app and returns an object with export(spans).
+"""
+import re
+import sys
+import json
+import time
+import random
+import secrets
+import threading
+import importlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+STATEMENT_MAX_LENGTH = 1000
+
+_current = ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed operation within a trace"""
+
+    def __init__(self, name: str, trace_id: str, parent_id, sampled: bool, finished: list):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = {}
+        self.start = time.time()
+        self.duration = None
+        self._started = time.perf_counter()
+        # the ended spans of the trace in this request, shared with the children
+        self._finished = finished
+
+    @property
+    def traceparent(self) -> str:
+        """Returns the W3C traceparent header that makes a callee a child of this span"""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def child(self, name: str, **attributes) -> "Span":
+        """Returns a new span within this one"""
+        span = Span(name, self.trace_id, self.span_id, self.sampled, self._finished)
+        span.attributes.update(attributes)
+        return span
+
+    def end(self) -> None:
+        """Stops the clock"""
+        self.duration = time.perf_counter() - self._started
+        self._finished.append(self)
+
+    def serialize(self) -> dict:
+        """Converts the span into a dictionary"""
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+        }
+
+
+def current_span():
+    """Returns the innermost open span of this request, or None"""
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Opens a child span of the current one, when the request is being traced"""
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        yield None
+        return
+    child = parent.child(name, **attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except Exception as error:
+        child.attributes["error"] = type(error).__name__
+        raise
+    finally:
+        _current.reset(token)
+        child.end()
+
+
+def parse_traceparent(header):
+    """Returns (trace id, parent span id, sampled) of a traceparent header, or None if it is not valid"""
+    match = TRACEPARENT.match((header or "").strip().lower())
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+######################################################################
+# Exporters
+######################################################################
+class StreamExporter:  # pylint: disable=too-few-public-methods
+    """Writes every span as one line of JSON to a stream"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def export(self, spans: list) -> None:
+        """Writes the spans of one request"""
+        lines = "".join(json.dumps(span.serialize()) + "\n" for span in spans)
+        with self._lock:
+            self.stream.write(lines)
+            self.stream.flush()
+
+
+def file_exporter(app) -> StreamExporter:
+    """Appends the spans to TRACING_FILE"""
+    # kept open for the life of the worker
+    return StreamExporter(open(app.config["TRACING_FILE"], "a", encoding="utf-8"))  # pylint: disable=consider-using-with
+
+
+EXPORTERS = {
+    "stdout": lambda app: StreamExporter(sys.stdout),
+    "file": file_exporter,
+}
+
+
+def load_exporter(app, name: str):
+    """Returns the exporter called `name`, or made by the factory at "module:factory" """
+    if name in EXPORTERS:
+        return EXPORTERS[name](app)
+    module, _, factory = name.partition(":")
+    if not factory:
+        raise ValueError(f"Unknown trace exporter {name!r}")
+    return getattr(importlib.import_module(module), factory)(app)
+
+
+######################################################################
+# SQL statements
+######################################################################
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=R0913,W0613
+    """Opens a span for a statement run while a traced request is in progress"""
+    parent = _current.get()
+    if parent is not None and parent.sampled:
+        conn.info.setdefault("tracing_spans", []).append(
+            parent.child("db.query", statement=statement[:STATEMENT_MAX_LENGTH], executemany=executemany)
+        )
+
+
+def _after_cursor_execute(conn, *args):  # pylint: disable=W0613
+    """Closes the span of the statement"""
+    spans = conn.info.get("tracing_spans")
+    if spans:
+        spans.pop().end()
+
+
+def _handle_error(context):
+    """Closes the span of a statement that failed"""
+    spans = context.connection.info.get("tracing_spans") if context.connection is not None else None
+    if spans:
+        failed = spans.pop()
+        failed.attributes["error"] = type(context.original_exception).__name__
+        failed.end()
+
+
+######################################################################
+# Requests
+######################################################################
+def _start_trace():
+    """Opens the span of a request, within the caller's trace if it sent one"""
+    parent = parse_traceparent(request.headers.get("traceparent"))
+    if parent:
+        trace_id, parent_id, sampled = parent
+    else:
+        rate = current_app.config["TRACING_SAMPLE_RATE"]
+        trace_id, parent_id, sampled = secrets.token_hex(16), None, random.random() < rate
+    rule = request.url_rule.rule if request.url_rule else request.path
+    root = Span(f"{request.method} {rule}", trace_id, parent_id, sampled, [])
+    root.attributes.update({"http.method": request.method, "http.target": request.full_path.rstrip("?")})
+    g.trace_span = root
+    _current.set(root)
+
+
+def _add_traceparent(response):
+    """Tells the caller which span served the request"""
+    root = g.get("trace_span")
+    if root is not None:
+        root.attributes["http.status_code"] = response.status_code
+        response.headers["traceparent"] = root.traceparent
+    return response
+
+
+def _end_trace(error):
+    """Closes the span of the request and exports the trace"""
+    root = g.pop("trace_span", None)
+    if root is None:
+        return
+    _current.set(None)
+    if error is not None:
+        root.attributes["error"] = type(error).__name__
+    root.end()
+    if root.sampled:
+        try:
+            current_app.extensions["tracing"].export(root._finished)
+        except Exception:  # pylint: disable=broad-except
+            current_app.logger.exception("Cannot export the trace %s", root.trace_id)
+
+
+def init_tracing(app) -> None:
+    """Traces the requests of the app when TRACING_EXPORTER is set"""
+    if not app.config.get("TRACING_EXPORTER"):
+        return
+    app.extensions["tracing"] = load_exporter(app, app.config["TRACING_EXPORTER"])
+    for name, listener in (
+        ("before_cursor_execute", _before_cursor_execute),
+        ("after_cursor_execute", _after_cursor_execute),
+        ("handle_error", _handle_error),
+    ):
+        if not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+    # run before every other hook, so requests they answer early are traced too
+    app.before_request_funcs.setdefault(None, []).insert(0, _start_trace)
+    app.after_request(_add_traceparent)
+    app.teardown_request(_end_trace)
@@ -0,0 +1,145 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Write-behind Decrements
+
+Decrements sent with "Prefer: respond-async" are answered with 202 Accepted
+and only counted in memory. A background thread writes the counts of every
+item every WRITE_BEHIND_MS milliseconds with one statement, so a thousand
+decrements of a hundred items cost one commit instead of a thousand.
+
+A batch that cannot be written is appended to the WRITE_BEHIND_JOURNAL file
+and retried with the next batch, by whichever worker writes first. Journal
+lines that cannot be read are moved to WRITE_BEHIND_JOURNAL.rejected, so one
+bad line never holds up the rest. Counts that could be neither written nor
+journaled go back into memory for the next batch. Counts still in memory when
+a worker is killed are lost; a clean shutdown writes them first.
+"""
+import os
+import json
+import time
+import fcntl
+import atexit
+import threading
+from collections import Counter
+from service.models import InventoryItem
+from .background import Lazy
+
+
+class DecrementBuffer:
+    """Collects decrements in memory and writes them in batches"""
+
+    def __init__(self, app, interval: float, journal: str):
+        self.app = app
+        self.interval = interval
+        self.journal = journal
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        self._wake = threading.Event()
+        self._thread = Lazy(self._start)
+
+    def add(self, item_id: int) -> int:
+        """Counts one decrement of an item and returns how many are waiting for it"""
+        with self._lock:
+            self._pending[item_id] += 1
+            pending = self._pending[item_id]
+        self._thread.get()
+        self._wake.set()
+        return pending
+
+    def pending(self, item_id: int) -> int:
+        """Returns how many decrements of an item are waiting to be written"""
+        with self._lock:
+            return self._pending[item_id]
+
+    def flush(self) -> int:
+        """Writes every waiting decrement, and any journaled ones, and returns their number"""
+        with open(self.journal, "a+", encoding="utf-8") as journal:
+            fcntl.flock(journal, fcntl.LOCK_EX)
+            journal.seek(0)
+            journaled, rejected = self._read(journal)
+            with self._lock:
+                amounts, self._pending = self._pending, Counter()
+            batch = journaled + amounts
+            try:
+                if batch:
+                    with self.app.app_context():
+                        InventoryItem.apply_decrements(batch)
+            except Exception:  # pylint: disable=broad-except
+                self.app.logger.exception("Journaling %d decrements that could not be written", amounts.total())
+                self._append(journal, [json.dumps(amounts)] if amounts else [], amounts)
+                return 0
+            if rejected:
+                with open(f"{self.journal}.rejected", "a", encoding="utf-8") as quarantine:
+                    self._append(quarantine, rejected)
+            journal.truncate(0)
+        return batch.total()
+
+    def _read(self, journal) -> tuple:
+        """Returns the counts in a journal, and the lines that could not be read"""
+        counts, rejected = Counter(), []
+        for line in journal:
+            if not line.strip():
+                continue
+            try:
+                counts.update({int(item_id): int(amount) for item_id, amount in json.loads(line).items()})
+            except (ValueError, TypeError, AttributeError):
+                self.app.logger.error("Rejecting the unreadable decrement journal line %r", line)
+                rejected.append(line.rstrip("\n"))
+        return counts, rejected
+
+    def _append(self, stream, lines: list, amounts: Counter = None) -> None:
+        """Appends lines durably, or puts the amounts back in memory if they cannot be written"""
+        try:
+            for line in lines:
+                stream.write(line + "\n")
+            stream.flush()
+            os.fsync(stream.fileno())
+        except OSError:
+            if amounts:
+                with self._lock:
+                    self._pending.update(amounts)
+            raise
+
+    def _start(self) -> threading.Thread:
+        """Starts the thread that writes the decrements"""
+        thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        thread.start()
+        return thread
+
+    def _run(self) -> None:
+        """Writes the waiting decrements shortly after the first of them arrives"""
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            # let the decrements of the next few milliseconds join the batch
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=broad-except
+                # the thread must outlive any error, or nothing would be written again
+                self.app.logger.exception("Cannot write the decrements through the journal %s", self.journal)
+
+
+def init_write_behind(app) -> None:
+    """Sets up the decrement buffer when WRITE_BEHIND_MS is above zero"""
+    interval = app.config["WRITE_BEHIND_MS"] / 1000
+    if interval <= 0:
+        return
+    buffer = DecrementBuffer(app, interval, app.config["WRITE_BEHIND_JOURNAL"])
+    app.extensions["write_behind"] = buffer
+    atexit.register(buffer.flush)
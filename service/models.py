@@ -6,6 +6,7 @@ All of the models are stored in this module
 Models
 ------
 InventoryItem - An item in the inventory
+InventoryItemArchive - An archived item, moved out of the inventory table
 
 Attributes:
 -----------
@@ -18,13 +19,27 @@ restock_level (integer) - the level at which restocking is needed
 condition (string) - the condition of the item (new, open box, used, archived)
 
 """
+# pylint: disable=too-many-lines
 
 import os
+import heapq
+import random
 import logging
+import contextvars
 from enum import Enum
+from datetime import datetime, timezone
+from operator import attrgetter, itemgetter
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal, InvalidOperation
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Numeric
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Numeric, Select, UpdateBase, bindparam, case, delete, func, insert, inspect, select, text, update
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session as ShardSession
+from sqlalchemy.orm.attributes import flag_modified, set_committed_value
+from sqlalchemy.schema import CreateIndex, DropIndex
+from service.common.background import Lazy
 
 # Global variables for retry (must be int)
 RETRY_COUNT = int(os.environ.get("RETRY_COUNT", 5))
@@ -33,14 +48,47 @@ RETRY_BACKOFF = int(os.environ.get("RETRY_BACKOFF", 2))
 
 logger = logging.getLogger("flask.app")
 
+
+class RoutingSession(Session):  # pylint: disable=too-few-public-methods
+    """
+    Session that sends reads to a read replica and everything else to the primary
+
+    Replicas are the binds named replica_<n> (see DATABASE_REPLICA_URI). Once
+    a session has written, or use_primary() has been called, every later read
+    in it goes to the primary as well so callers always see their own writes.
+    A session pointed at a shard with use_shard() sends everything there.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get("shard"):
+            return self._db.engines[self.info["shard"]]
+        if bind is None and not self.info.get("use_primary"):
+            if isinstance(clause, Select) and not self._flushing:
+                replicas = [engine for key, engine in self._db.engines.items() if key and key.startswith("replica_")]
+                if replicas:
+                    return random.choice(replicas)
+            elif self._flushing or isinstance(clause, UpdateBase):
+                self.info["use_primary"] = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def use_primary() -> None:
+    """Sends every remaining read of the current session to the primary"""
+    db.session.info["use_primary"] = True
+
+
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+class InsufficientStockError(Exception):
+    """Used when an item does not have the stock that was asked of it"""
+
+
 class Condition(Enum):
     """Enumeration of valid Inventory Item Conditions"""
 
@@ -50,7 +98,381 @@ class Condition(Enum):
     ARCHIVED = "archived"
 
 
-class InventoryItem(db.Model):  # pylint: disable=too-many-instance-attributes
+######################################################################
+#  S H A R D I N G
+######################################################################
+# Ids are handed out from one counter on the primary so they stay unique
+# across shards and survive an item moving from one shard to another
+ID_COUNTER = db.Table(
+    "inventory_item_id_counter",
+    db.Column("id", db.Integer, primary_key=True),
+    db.Column("next_id", db.Integer, nullable=False),
+)
+
+# Which shard stores each item, archived or not, so that a lookup by id goes
+# to that shard only. Kept on the primary next to the id counter
+SHARD_DIRECTORY = db.Table(
+    "inventory_item_shard",
+    db.Column("item_id", db.Integer, primary_key=True),
+    db.Column("shard", db.String(31), nullable=False),
+)
+
+_fan_out_pool = Lazy(lambda: ThreadPoolExecutor(max_workers=4 * len(shard_keys()), thread_name_prefix="shard"))
+
+
+def shard_keys() -> list:
+    """Returns the shard binds (see DATABASE_SHARD_URIS) in order, or [] if unsharded"""
+    keys = [key for key in db.engines if key and key.startswith("shard_")]
+    return sorted(keys, key=lambda key: int(key[len("shard_"):]))
+
+
+def shard_for(product_id: int, keys: list = None) -> str:
+    """Returns the shard that holds the items of a product"""
+    keys = keys or shard_keys()
+    return keys[product_id % len(keys)]
+
+
+def use_shard(key: str) -> None:
+    """Sends the following statements of the current session to one shard"""
+    session = db.session()
+    session.info["shard"] = key
+    # a refresh after commit could be sent to another item's shard
+    session.expire_on_commit = False
+
+
+def fan_out(task, keys: list) -> list:
+    """Calls task(engine) for every shard in parallel and returns the results in shard order"""
+    pool = _fan_out_pool.get()
+    # every call runs in a copy of the caller's context, so its statements join the request's trace
+    futures = [pool.submit(contextvars.copy_context().run, task, db.engines[key]) for key in keys]
+    return [future.result() for future in futures]
+
+
+def query_shards(model, *criteria) -> list:
+    """Runs a query on every shard in parallel and merges the results in id order"""
+    statement = select(model).where(*criteria).order_by(model.id)
+
+    def run(engine):
+        with ShardSession(engine, expire_on_commit=False) as session:
+            return list(session.scalars(statement))
+
+    return list(heapq.merge(*fan_out(run, shard_keys()), key=attrgetter("id")))
+
+
+def count_rows(model, *criteria) -> int:
+    """Counts the rows of a table that match the criteria, on every shard in parallel"""
+    statement = select(func.count()).select_from(model).where(*criteria)
+    if not shard_keys():
+        return db.session.scalar(statement)
+
+    def run(engine):
+        with engine.connect() as connection:
+            return connection.execute(statement).scalar()
+
+    return sum(fan_out(run, shard_keys()))
+
+
+def estimate_rows(model):
+    """Returns the planner's estimate of the rows in a table, or None if the database has none"""
+    keys = shard_keys()
+    engines = [db.engines[key] for key in keys] or [db.engine]
+    if any(engine.dialect.name != "postgresql" for engine in engines):
+        return None
+    # kept up to date by VACUUM and ANALYZE, and -1 until the table has been analyzed
+    statement = text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:name)")
+
+    def run(engine):
+        with engine.connect() as connection:
+            return connection.execute(statement, {"name": model.__table__.name}).scalar()
+
+    estimates = fan_out(run, keys) if keys else [run(db.engine)]
+    if any(estimate is None or estimate < 0 for estimate in estimates):
+        return None
+    return sum(estimates)
+
+
+def locate_shards(item_ids: list) -> dict:
+    """Returns {item id: shard} for the ids the shard directory knows"""
+    directory = SHARD_DIRECTORY.c
+    with db.engine.connect() as connection:
+        rows = connection.execute(select(directory.item_id, directory.shard).where(directory.item_id.in_(item_ids)))
+        return dict(rows.all())
+
+
+def locate_shard(item_id: int):
+    """Returns the shard that stores the item with an id, archived or not, or None if there is none"""
+    return locate_shards([item_id]).get(item_id)
+
+
+def record_shards(placements: dict) -> None:
+    """Stores in the shard directory that each item id of {item id: shard} is on that shard"""
+    directory = SHARD_DIRECTORY.c
+    with db.engine.begin() as connection:
+        connection.execute(delete(SHARD_DIRECTORY).where(directory.item_id.in_(list(placements))))
+        connection.execute(
+            insert(SHARD_DIRECTORY), [{"item_id": item_id, "shard": key} for item_id, key in placements.items()]
+        )
+
+
+def forget_shards(item_ids: list) -> None:
+    """Removes deleted items from the shard directory"""
+    with db.engine.begin() as connection:
+        connection.execute(delete(SHARD_DIRECTORY).where(SHARD_DIRECTORY.c.item_id.in_(item_ids)))
+
+
+def truncate(connection, table) -> None:
+    """Deletes every row of a table and restarts its ids"""
+    if connection.dialect.name == "postgresql":
+        connection.execute(text(f"TRUNCATE TABLE {table.name} RESTART IDENTITY"))
+    else:
+        connection.execute(delete(table))
+        if inspect(connection).has_table("sqlite_sequence"):
+            connection.execute(text("DELETE FROM sqlite_sequence WHERE name = :table"), {"table": table.name})
+
+
+def allocate_ids(count: int = 1, floor: int = 0) -> int:
+    """
+    Reserves count consecutive item ids that no shard has used
+
+    :param count: the number of ids to reserve
+    :type count: int
+    :param floor: an id that is already taken; only larger ids are handed out
+    :type floor: int
+    :return: the first of the reserved ids
+    :rtype: int
+    """
+    column = ID_COUNTER.c.next_id
+    start = case((column > floor, column), else_=floor + 1)
+    try:
+        with db.engine.begin() as connection:
+            next_id = connection.execute(
+                update(ID_COUNTER).where(ID_COUNTER.c.id == 1).values(next_id=start + count).returning(column)
+            ).scalar()
+            if next_id is None:
+                next_id = floor + 1 + count
+                connection.execute(insert(ID_COUNTER).values(id=1, next_id=next_id))
+    except IntegrityError:
+        # another process created the counter first
+        return allocate_ids(count, floor)
+    return next_id - count
+
+
+def create_shard_tables(drop: bool = False) -> None:
+    """Creates the inventory tables on every shard"""
+    tables = [InventoryItem.__table__, InventoryItemArchive.__table__, QUANTITY_SLOTS]
+    for key in shard_keys():
+        if drop:
+            db.metadata.drop_all(db.engines[key], tables=tables)
+        db.metadata.create_all(db.engines[key], tables=tables)
+        upgrade_tables(db.engines[key])
+
+
+def upgrade_tables(engine) -> None:
+    """
+    Brings the inventory tables of a database created by an older version up to date
+
+    create_all() only creates the tables that are missing, it never changes
+    one that is there. Every step checks first, so this runs at every start.
+    """
+    with engine.begin() as connection:
+        if engine.dialect.name == "sqlite":
+            _add_sqlite_autoincrement(connection)
+        columns = {column["name"] for column in inspect(connection).get_columns("inventory_item")}
+        if "slots" not in columns:
+            logger.info("Adding the slots column to inventory_item")
+            connection.execute(text("ALTER TABLE inventory_item ADD COLUMN slots INTEGER NOT NULL DEFAULT 0"))
+        for table in (InventoryItem.__table__, InventoryItemArchive.__table__):
+            for index in table.indexes:
+                connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+def _add_sqlite_autoincrement(connection) -> None:
+    """Rebuilds an SQLite inventory_item table that was created without AUTOINCREMENT"""
+    schema = connection.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'inventory_item'")
+    ).scalar()
+    if "AUTOINCREMENT" in schema.upper():
+        return
+    logger.info("Rebuilding inventory_item with AUTOINCREMENT")
+    table = InventoryItem.__table__
+    names = ", ".join(column["name"] for column in inspect(connection).get_columns("inventory_item"))
+    connection.execute(text("ALTER TABLE inventory_item RENAME TO inventory_item_old"))
+    # the renamed table keeps its indexes, and their names
+    for index in table.indexes:
+        connection.execute(DropIndex(index, if_exists=True))
+    table.create(connection)
+    connection.execute(text(f"INSERT INTO inventory_item ({names}) SELECT {names} FROM inventory_item_old"))
+    connection.execute(text("DROP TABLE inventory_item_old"))
+    # nor may the ids of items archived before the rebuild be handed out again
+    highest = max(
+        connection.execute(select(func.max(model.id))).scalar() or 0 for model in (InventoryItem, InventoryItemArchive)
+    )
+    connection.execute(text("DELETE FROM sqlite_sequence WHERE name = 'inventory_item'"))
+    connection.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('inventory_item', :seq)"), {"seq": highest})
+
+
+######################################################################
+#  H O T   I T E M   C O U N T E R S
+######################################################################
+# The quantity of a hot item is spread over several rows, stored next to
+# the item, so that concurrent decrements lock different rows instead of
+# all queueing on the item's row. An item is hot while it has slot rows, and
+# its slots column says how many, so no other item ever looks for them.
+QUANTITY_SLOTS = db.Table(
+    "inventory_item_slot",
+    db.Column("item_id", db.Integer, primary_key=True),
+    db.Column("slot", db.Integer, primary_key=True),
+    db.Column("quantity", db.Integer, nullable=False),
+)
+
+# Lists with more hot items than this read every slot row instead of an IN (...) lookup
+SLOT_LOOKUP_LIMIT = 100
+
+
+def spread(quantity: int, slots: int) -> list:
+    """Splits a quantity into slots parts that differ by at most one"""
+    share, extra = divmod(quantity, slots)
+    return [share + 1 if slot < extra else share for slot in range(slots)]
+
+
+def slot_totals(item_ids: list = None, keys: set = None) -> dict:
+    """Returns {item id: quantity} of the hot items, only of item_ids and the shards keys if given"""
+    statement = select(QUANTITY_SLOTS.c.item_id, db.func.sum(QUANTITY_SLOTS.c.quantity)).group_by(
+        QUANTITY_SLOTS.c.item_id
+    )
+    if item_ids is not None:
+        statement = statement.where(QUANTITY_SLOTS.c.item_id.in_(item_ids))
+    if not shard_keys():
+        return dict(db.session.execute(statement).all())
+
+    def run(engine):
+        with engine.connect() as connection:
+            return connection.execute(statement).all()
+
+    return {item_id: total for rows in fan_out(run, keys or shard_keys()) for item_id, total in rows}
+
+
+######################################################################
+#  P A Y L O A D   V A L I D A T I O N
+######################################################################
+CONDITIONS = frozenset(condition.value for condition in Condition)
+
+
+def _integer(name: str):
+    """Returns a check that accepts integers only"""
+
+    def check(value):
+        if isinstance(value, int):
+            return value
+        raise DataValidationError(f"Invalid type for integer [{name}]: {type(value)}")
+
+    return check
+
+
+def _decimal(name: str):
+    """Returns a check that parses a value into a Decimal"""
+
+    def check(value):
+        try:
+            return Decimal(value)
+        except (InvalidOperation, TypeError, ValueError) as error:
+            raise DataValidationError(f"Invalid type for decimal [{name}]: {error}") from error
+
+    return check
+
+
+def _choice(name: str, choices: frozenset):
+    """Returns a check that accepts one of a set of strings"""
+
+    def check(value):
+        if isinstance(value, str) and value in choices:
+            return value
+        raise DataValidationError(f"Invalid value for [{name}]: {value}")
+
+    return check
+
+
+class ItemValidator:
+    """
+    Validates InventoryItem payloads without constructing ORM objects
+
+    The schema is compiled once into a tuple of (field, required, check)
+    entries. Validating a payload walks it a single time, parses every field
+    exactly once and collects the errors of every field instead of stopping
+    at the first one.
+    """
+
+    def __init__(self):
+        self._fields = (
+            ("name", True, None),
+            ("description", False, None),
+            ("quantity", True, _integer("quantity")),
+            ("price", True, _decimal("price")),
+            ("product_id", True, _integer("product_id")),
+            ("restock_level", False, _integer("restock_level")),
+            ("condition", False, _choice("condition", CONDITIONS)),
+        )
+
+    def check(self, data) -> tuple:
+        """
+        Validates one payload
+
+        Args:
+            data (dict): the InventoryItem data, e.g. a parsed JSON body
+        Returns:
+            tuple: (cleaned, errors) where cleaned holds the parsed values of
+            every field and errors is a list of messages (empty if valid)
+        """
+        if not isinstance(data, dict):
+            return {}, ["Invalid InventoryItem: body of request contained bad or no data"]
+        cleaned, errors = {}, []
+        for name, required, check in self._fields:
+            value = data.get(name)
+            if value is None:
+                if required and name not in data:
+                    errors.append(f"Invalid InventoryItem: missing {name}")
+                    continue
+                if not required:
+                    cleaned[name] = None
+                    continue
+            if check is None:
+                cleaned[name] = value
+                continue
+            try:
+                cleaned[name] = check(value)
+            except DataValidationError as error:
+                errors.append(str(error))
+        return cleaned, errors
+
+    def validate(self, data) -> dict:
+        """Returns the cleaned payload or raises a DataValidationError listing every error"""
+        cleaned, errors = self.check(data)
+        if errors:
+            raise DataValidationError("; ".join(errors))
+        return cleaned
+
+    def validate_many(self, rows) -> tuple:
+        """
+        Validates an iterable of payloads in bulk
+
+        Returns:
+            tuple: (valid, rejected) where valid is a list of cleaned payloads
+            and rejected is a list of (index, errors) for every bad row
+        """
+        valid, rejected = [], []
+        for index, row in enumerate(rows):
+            cleaned, errors = self.check(row)
+            if errors:
+                rejected.append((index, errors))
+            else:
+                valid.append(cleaned)
+        return valid, rejected
+
+
+item_validator = ItemValidator()
+
+
+class InventoryItem(db.Model):  # pylint: disable=too-many-instance-attributes,too-many-public-methods
     """
     Class that represents an InventoryItem
 
@@ -61,14 +483,19 @@ class InventoryItem(db.Model):  # pylint: disable=too-many-instance-attributes
     ##################################################
     # Table Schema
     ##################################################
+    # archived items keep their id, so SQLite must never hand it out again
+    __table_args__ = {"sqlite_autoincrement": True}
+
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(63), nullable=False)
+    name = db.Column(db.String(63), nullable=False, index=True)
     description = db.Column(db.String(255))
     quantity = db.Column(db.Integer, nullable=False)
     price = db.Column(Numeric(8, 2), nullable=False)  # Updated to Numeric
     product_id = db.Column(db.Integer, nullable=False)
     restock_level = db.Column(db.Integer)
-    condition = db.Column(db.String(15))
+    condition = db.Column(db.String(15), index=True)
+    # the number of slot rows of a hot item, 0 for every other item
+    slots = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     def __repr__(self):
         return f"<InventoryItem {self.name} id=[{self.id}]>"
@@ -80,6 +507,11 @@ class InventoryItem(db.Model):  # pylint: disable=too-many-instance-attributes
         logger.info("Creating %s", self.name)
         self.id = None  # pylint: disable=invalid-name
         try:
+            if shard_keys():
+                self.id = allocate_ids()
+                # recorded first: an entry for a row that was never written finds nothing
+                record_shards({self.id: shard_for(self.product_id)})
+                use_shard(shard_for(self.product_id))
             db.session.add(self)
             db.session.commit()
         except Exception as e:
@@ -91,11 +523,26 @@ class InventoryItem(db.Model):  # pylint: disable=too-many-instance-attributes
         """
         Updates a YourResourceModel to the database
         """
+        # read first: loading expired attributes would flush the change away
+        new_quantity = inspect(self).attrs.quantity.history.has_changes()
         logger.info("Saving %s", self.name)
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
         try:
+            source = self._stored_shard()
+            if source:
+                use_shard(source)
+            if new_quantity and self.slots:
+                # a new quantity for a hot item is spread over its slots again
+                held = self._take_slots()
+                if held:
+                    self._put_slots(spread(self.quantity, len(held)))
+            moved = source and shard_for(self.product_id) != source
+            if moved:
+                self._move(source, shard_for(self.product_id))
             db.session.commit()
+            if moved:
+                record_shards({self.id: shard_for(self.product_id)})
         except Exception as e:
             db.session.rollback()
             logger.error("Error updating record: %s", self)
@@ -105,17 +552,359 @@ class InventoryItem(db.Model):  # pylint: disable=too-many-instance-attributes
         """Removes a YourResourceModel from the data store"""
         logger.info("Deleting %s", self.name)
         try:
+            source = self._stored_shard()
+            if source:
+                use_shard(source)
+            if self.slots:
+                db.session.execute(delete(QUANTITY_SLOTS).where(QUANTITY_SLOTS.c.item_id == self.id))
             db.session.delete(self)
             db.session.commit()
+            if source:
+                forget_shards([self.id])
         except Exception as e:
             db.session.rollback()
             logger.error("Error deleting record: %s", self)
             raise DataValidationError(e) from e
 
-    def remove_all(self):
-        """Removes all documents from the database (use for testing)"""
-        for document in self.database:  # pylint: disable=(not-an-iterable
-            document.delete()
+    @classmethod
+    def delete_by_id(cls, item_id: int) -> bool:
+        """Deletes the item with an id, archived or not, without loading it first
+
+        PostgreSQL deletes the item, its slots and its archived copy in one
+        statement. Other databases delete the item, and then its slots if it
+        was hot, or its archived copy when the item was not in the inventory.
+
+        :param item_id: the id of the item to delete
+        :type item_id: int
+
+        :return: False if there was no item with the id
+        :rtype: bool
+        """
+        logger.info("Deleting the item with id %s", item_id)
+        try:
+            key = locate_shard(item_id) if shard_keys() else None
+            if shard_keys():
+                if key is None:
+                    return False
+                use_shard(key)
+            use_primary()
+            items, slots, archive = cls.__table__, QUANTITY_SLOTS, InventoryItemArchive.__table__
+            if db.session.get_bind().dialect.name == "postgresql":
+                deleted = delete(items).where(items.c.id == item_id).returning(items.c.id).cte("deleted_item")
+                unarchived = delete(archive).where(archive.c.id == item_id).returning(archive.c.id).cte("deleted_archive")
+                unslotted = delete(slots).where(slots.c.item_id == item_id).cte("deleted_slots")
+                statement = select(deleted.c.id).union_all(select(unarchived.c.id)).add_cte(unslotted)
+                found = db.session.execute(statement).first() is not None
+            else:
+                hot = db.session.execute(delete(items).where(items.c.id == item_id).returning(items.c.slots)).scalar()
+                found = hot is not None
+                if hot:
+                    db.session.execute(delete(slots).where(slots.c.item_id == item_id))
+                elif not found:
+                    found = db.session.execute(delete(archive).where(archive.c.id == item_id)).rowcount > 0
+            db.session.commit()
+            if key:
+                forget_shards([item_id])
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error deleting the item with id %s", item_id)
+            raise DataValidationError(e) from e
+        return found
+
+    def archive(self):
+        """
+        Moves the item to the archive table and returns the archived copy
+
+        The copy is inserted and the item deleted in one transaction, so the
+        item is always in exactly one of the two tables.
+        """
+        logger.info("Archiving %s", self.name)
+        try:
+            source = self._stored_shard()
+            if source:
+                use_shard(source)
+            columns = {column.name: getattr(self, column.name) for column in self.__table__.columns}
+            del columns["slots"]
+            held = self._take_slots() if self.slots else []
+            if held:
+                columns["quantity"] = sum(quantity for _, quantity in held)
+            archived = InventoryItemArchive(**dict(columns, condition=Condition.ARCHIVED.value))
+            archived.archived_at = datetime.now(timezone.utc)
+            db.session.add(archived)
+            db.session.delete(self)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error archiving record: %s", self)
+            raise DataValidationError(e) from e
+        return archived
+
+    def _stored_shard(self):
+        """Returns the shard the item is stored on, or None when unsharded"""
+        keys = shard_keys()
+        if not keys:
+            return None
+        # looked up by id like find() does, as the product_id may have been changed since
+        key = locate_shard(self.id)
+        if key is not None:
+            return key
+        # not in the directory yet (see inventory-rebalance): where its product_id puts it
+        changed = inspect(self).attrs.product_id.history.deleted
+        return shard_for(changed[0] if changed else self.product_id, keys)
+
+    def _move(self, source: str, target: str) -> None:
+        """Moves the item to another shard after its product_id changed"""
+        logger.info("Moving %s from %s to %s", self, source, target)
+        table = self.__table__
+        row = {column.name: getattr(self, column.name) for column in table.columns}
+        held = self._take_slots() if self.slots else []
+        db.session.expunge(self)
+        db.session.execute(delete(table).where(table.c.id == self.id))
+        use_shard(target)
+        db.session.execute(insert(table), row)
+        if held:
+            self._put_slots([quantity for _, quantity in held])
+
+    def decrement(self) -> bool:
+        """
+        Takes one unit of the item out of stock
+
+        The stock is changed with a conditional UPDATE, so concurrent
+        decrements never lose each other's change nor go below zero. A hot
+        item (see split_quantity) takes the unit from a random slot that
+        still has stock.
+
+        :return: False if the item was out of stock
+        :rtype: bool
+        """
+        logger.info("Decrementing %s", self.name)
+        try:
+            source = self._stored_shard()
+            if source:
+                use_shard(source)
+            use_primary()
+            slots = QUANTITY_SLOTS.c
+            if self.slots:
+                order = list(range(self.slots))
+                random.shuffle(order)
+                # another decrement may empty a slot first, so move on to the next one
+                taken = any(
+                    db.session.execute(
+                        update(QUANTITY_SLOTS)
+                        .where(slots.item_id == self.id, slots.slot == slot, slots.quantity > 0)
+                        .values(quantity=slots.quantity - 1)
+                    ).rowcount
+                    for slot in order
+                )
+                quantity = db.session.execute(select(db.func.sum(slots.quantity)).where(slots.item_id == self.id)).scalar()
+            else:
+                table = self.__table__
+                quantity = db.session.execute(
+                    update(table)
+                    .where(table.c.id == self.id, table.c.quantity > 0)
+                    .values(quantity=table.c.quantity - 1)
+                    .returning(table.c.quantity)
+                ).scalar()
+                taken = quantity is not None
+                if not taken:
+                    quantity = max(self.quantity, 0)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error decrementing record: %s", self)
+            raise DataValidationError(e) from e
+        set_committed_value(self, "quantity", quantity)
+        return taken
+
+    @classmethod
+    def decrement_by_id(cls, item_id: int):
+        """
+        Takes one unit of the item with an id out of stock without reading it first
+
+        A conditional UPDATE takes the unit and returns the whole row, so an
+        item in stock costs one statement. Only when nothing was updated, as
+        the item is out of stock, hot or not there, is it read to tell which.
+
+        :param item_id: the id of the item to decrement
+        :type item_id: int
+
+        :return: the item after the decrement, or None if it was not found
+        :rtype: InventoryItem
+        """
+        logger.info("Decrementing the item with id %s", item_id)
+        try:
+            if shard_keys():
+                key = locate_shard(item_id)
+                if key is None:
+                    return None
+                use_shard(key)
+            use_primary()
+            item = db.session.scalars(
+                update(cls)
+                .where(cls.id == item_id, cls.quantity > 0, cls.slots == 0)
+                .values(quantity=cls.quantity - 1)
+                .returning(cls)
+                # the returned row refreshes the item, so nothing is read before the update
+                .execution_options(synchronize_session=False, populate_existing=True)
+            ).first()
+            if item is not None:
+                # keeps the returned row instead of reading it again after the commit
+                db.session.expunge(item)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error decrementing the item with id %s", item_id)
+            raise DataValidationError(e) from e
+        if item is None:
+            item = cls.find(item_id)
+            if item is not None and item.slots:
+                item.decrement()
+        return item
+
+    def split_quantity(self, slots: int) -> None:
+        """
+        Spreads the quantity of a hot item over several counter rows
+
+        Decrements then pick a row at random instead of all waiting for the
+        lock on the item's row, and reads add the rows up. With fewer than
+        two slots the quantity is moved back into the item.
+
+        :param slots: the number of counter rows
+        :type slots: int
+        """
+        logger.info("Splitting the quantity of %s over %d slots", self.name, slots)
+        try:
+            source = self._stored_shard()
+            if source:
+                use_shard(source)
+            use_primary()
+            held = self._take_slots()
+            if held:
+                self.quantity = sum(quantity for _, quantity in held)
+                # the stored column may be behind what was read from the slots
+                flag_modified(self, "quantity")
+            if slots > 1:
+                self._put_slots(spread(self.quantity, slots))
+            self.slots = slots if slots > 1 else 0
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error splitting record: %s", self)
+            raise DataValidationError(e) from e
+
+    @classmethod
+    def transfer(cls, source_id: int, target_id: int, quantity: int):
+        """
+        Moves units of stock from one InventoryItem to another in one transaction
+
+        Both rows are locked in id order before either is changed, so
+        concurrent transfers between the same items wait for each other
+        instead of deadlocking, and the stock taken always equals the stock
+        given. The decrement of the source is conditional, so its stock can
+        never go below zero even where rows cannot be locked (SQLite).
+
+        :param source_id: the id of the item to take the units from
+        :type source_id: int
+        :param target_id: the id of the item to give the units to
+        :type target_id: int
+        :param quantity: the number of units to move, at least 1
+        :type quantity: int
+
+        :return: the (source, target) items after the transfer, or None if either was not found
+        :rtype: tuple
+        """
+        for name, value in (("from_id", source_id), ("to_id", target_id), ("quantity", quantity)):
+            _integer(name)(value)
+        if quantity < 1 or source_id == target_id:
+            raise DataValidationError("A transfer moves at least 1 unit between two different items")
+        logger.info("Transferring %d units from %s to %s", quantity, source_id, target_id)
+        try:
+            items = cls._lock_rows([source_id, target_id])
+            if len(items) < 2:
+                db.session.rollback()
+                return None
+            if any(item.slots for item in items.values()):
+                raise DataValidationError("Hot items cannot take part in a transfer")
+            table = cls.__table__
+            left = db.session.execute(
+                update(table)
+                .where(table.c.id == source_id, table.c.quantity >= quantity)
+                .values(quantity=table.c.quantity - quantity)
+                .returning(table.c.quantity)
+            ).scalar()
+            if left is None:
+                raise InsufficientStockError(
+                    f"Item with id '{source_id}' has {items[source_id].quantity} units, {quantity} were asked for"
+                )
+            given = db.session.execute(
+                update(table).where(table.c.id == target_id).values(quantity=table.c.quantity + quantity)
+                .returning(table.c.quantity)
+            ).scalar()
+            db.session.commit()
+        except (DataValidationError, InsufficientStockError):
+            db.session.rollback()
+            raise
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error transferring stock from %s to %s", source_id, target_id)
+            raise DataValidationError(e) from e
+        set_committed_value(items[source_id], "quantity", left)
+        set_committed_value(items[target_id], "quantity", given)
+        return items[source_id], items[target_id]
+
+    @classmethod
+    def _lock_rows(cls, item_ids: list) -> dict:
+        """Locks the rows of items, which must share a shard, in id order and returns the items found"""
+        if shard_keys():
+            placements = locate_shards(item_ids)
+            if len(placements) < len(item_ids):
+                return {}
+            keys = set(placements.values())
+            if len(keys) > 1:
+                raise DataValidationError("Both items of a transfer must be stored on the same shard")
+            use_shard(keys.pop())
+        use_primary()
+        locked = select(cls).where(cls.id.in_(item_ids)).order_by(cls.id).with_for_update()
+        return {item.id: item for item in db.session.scalars(locked)}
+
+    @staticmethod
+    def _take_from_slots(amounts: dict) -> None:
+        """Takes units out of the slot rows of hot items, fullest slot first and never below zero"""
+        slots = QUANTITY_SLOTS.c
+        rows = db.session.execute(
+            select(slots.item_id, slots.slot, slots.quantity)
+            .where(slots.item_id.in_(list(amounts)), slots.quantity > 0)
+            .order_by(slots.item_id, slots.quantity.desc())
+            .with_for_update()
+        ).all()
+        wanted = dict(amounts)
+        params = []
+        for item_id, slot, quantity in rows:
+            taken = min(quantity, wanted[item_id])
+            if taken:
+                wanted[item_id] -= taken
+                params.append({"slot_item": item_id, "slot_number": slot, "slot_quantity": quantity - taken})
+        if params:
+            db.session.execute(
+                update(QUANTITY_SLOTS)
+                .where(slots.item_id == bindparam("slot_item"), slots.slot == bindparam("slot_number"))
+                .values(quantity=bindparam("slot_quantity")),
+                params,
+            )
+
+    def _take_slots(self) -> list:
+        """Deletes the slot rows of the item and returns them as (slot, quantity)"""
+        slots = QUANTITY_SLOTS.c
+        return db.session.execute(
+            delete(QUANTITY_SLOTS).where(slots.item_id == self.id).returning(slots.slot, slots.quantity)
+        ).all()
+
+    def _put_slots(self, quantities: list) -> None:
+        """Stores the slot rows of the item"""
+        db.session.execute(
+            insert(QUANTITY_SLOTS),
+            [{"item_id": self.id, "slot": slot, "quantity": quantity} for slot, quantity in enumerate(quantities)],
+        )
 
     def serialize(self) -> dict:
         """Serializes an InventoryItem into a dictionary"""
@@ -134,78 +923,52 @@ class InventoryItem(db.Model):  # pylint: disable=too-many-instance-attributes
     def deserialize(self, data: dict):
         """
         Deserializes an InventoryItem from a dictionary
+
         Args:
             data (dict): A dictionary containing the InventoryItem data
         """
-        try:
-            self.name = data["name"]
-            self.description = data.get("description")
-            self.quantity = self._validate_quantity(data["quantity"])
-            self.price = self._validate_price(data["price"])
-            self.product_id = self._validate_product_id(data["product_id"])
-            self.restock_level = self._validate_restock_level(data.get("restock_level"))
-            self.condition = self._validate_condition(data.get("condition"))
-        except AttributeError as error:
-            raise DataValidationError("Invalid attribute: " + error.args[0]) from error
-        except KeyError as error:
-            raise DataValidationError(
-                "Invalid InventoryItem: missing " + error.args[0]
-            ) from error
-        except TypeError as error:
-            raise DataValidationError(
-                "Invalid InventoryItem: body of request contained bad or no data "
-                + str(error)
-            ) from error
+        for name, value in item_validator.validate(data).items():
+            setattr(self, name, value)
         return self
 
-    def _validate_quantity(self, quantity):
-        if isinstance(quantity, int):
-            return quantity
-        raise DataValidationError(
-            "Invalid type for integer [quantity]: " + str(type(quantity))
-        )
-
-    def _validate_price(self, price):
-        try:
-            return Decimal(price)
-        except InvalidOperation as error:  # Catch the correct exception
-            raise DataValidationError(
-                f"Invalid type for decimal [price]: {error}"
-            ) from error
-
-    def _validate_product_id(self, product_id):
-        if isinstance(product_id, int):
-            return product_id
-        raise DataValidationError(
-            "Invalid type for integer [product_id]: " + str(type(product_id))
-        )
-
-    def _validate_restock_level(self, restock_level):
-        if restock_level is not None:
-            if isinstance(restock_level, int):
-                return restock_level
-            raise DataValidationError(
-                "Invalid type for integer [restock_level]: " + str(type(restock_level))
-            )
-        return None
-
-    def _validate_condition(self, condition):
-        if condition is not None:
-            if condition in ["new", "open box", "used", "archived"]:
-                return condition
-            raise DataValidationError(
-                "Invalid value for [condition]: " + str(condition)
-            )
-        return None
-
     ##################################################
     # CLASS METHODS
     ##################################################
 
+    @classmethod
+    def remove_all(cls) -> None:
+        """
+        Removes every InventoryItem, archived or not, and restarts the ids at 1
+        (use for testing)
+
+        PostgreSQL truncates the table, which takes the same time however many
+        rows it holds. SQLite has no TRUNCATE, so the rows are deleted with a
+        single statement and any AUTOINCREMENT counter is cleared.
+        """
+        logger.info("Removing all InventoryItems")
+        try:
+            for key in shard_keys() or [None]:
+                if key:
+                    use_shard(key)
+                truncate(db.session.connection(), cls.__table__)
+                truncate(db.session.connection(), InventoryItemArchive.__table__)
+                truncate(db.session.connection(), QUANTITY_SLOTS)
+            if shard_keys():
+                with db.engine.begin() as connection:
+                    connection.execute(delete(ID_COUNTER))
+                    connection.execute(delete(SHARD_DIRECTORY))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error removing all records")
+            raise DataValidationError(e) from e
+
     @classmethod
     def all(cls) -> list:
         """Returns all of the InventoryItems in the database"""
         logger.info("Processing all InventoryItems")
+        if shard_keys():
+            return query_shards(cls)
         return cls.query.all()
 
     @classmethod
@@ -219,8 +982,49 @@ class InventoryItem(db.Model):  # pylint: disable=too-many-instance-attributes
         :rtype: InventoryItem
         """
         logger.info("Processing lookup for id %s ...", item_id)
+        if shard_keys():
+            key = locate_shard(item_id)
+            if key is None:
+                return None
+            use_shard(key)
         return cls.query.filter(cls.id == item_id).first()
 
+    @classmethod
+    def find_many(cls, item_ids: list) -> list:
+        """Finds the InventoryItems with any of the given IDs in one query
+
+        :param item_ids: the ids of the InventoryItems to find
+        :type item_ids: list
+
+        :return: the instances that were found, in id order
+        :rtype: list
+        """
+        logger.info("Processing lookup for %d ids ...", len(item_ids))
+        if shard_keys():
+            return query_shards(cls, cls.id.in_(item_ids))
+        return cls.query.filter(cls.id.in_(item_ids)).order_by(cls.id).all()
+
+    @classmethod
+    def with_slot_quantities(cls, items) -> list:
+        """Returns the items as a list, with the quantity of hot items added up from their slots
+
+        :param items: InventoryItems as returned by the finders
+        :type items: list
+
+        :return: the same items
+        :rtype: list
+        """
+        items = list(items)
+        hot = [item for item in items if getattr(item, "slots", 0)]
+        if not hot:
+            return items
+        keys = {shard_for(item.product_id) for item in hot} if shard_keys() else None
+        totals = slot_totals([item.id for item in hot] if len(hot) <= SLOT_LOOKUP_LIMIT else None, keys)
+        for item in hot:
+            if item.id in totals:
+                set_committed_value(item, "quantity", totals[item.id])
+        return items
+
     @classmethod
     def find_by_name(cls, name: str) -> list:
         """Returns all InventoryItems with the given name
@@ -232,6 +1036,8 @@ class InventoryItem(db.Model):  # pylint: disable=too-many-instance-attributes
         :rtype: list
         """
         logger.info("Processing name query for %s ...", name)
+        if shard_keys():
+            return query_shards(cls, cls.name == name)
         return cls.query.filter(cls.name == name)
 
     @classmethod
@@ -246,4 +1052,458 @@ class InventoryItem(db.Model):  # pylint: disable=too-many-instance-attributes
 
         """
         logger.info("Processing condition query for %s ...", condition)
+        if shard_keys():
+            return query_shards(cls, cls.condition == condition)
         return cls.query.filter(cls.condition == condition)
+
+    @classmethod
+    def count(cls, name: str = None, condition: str = None, item_id: int = None) -> int:
+        """Counts the InventoryItems that match all of the given filters
+
+        :param name: only count the items with this name
+        :type name: str
+        :param condition: only count the items in this condition
+        :type condition: str
+        :param item_id: only count the item with this id
+        :type item_id: int
+
+        :return: the number of matching items
+        :rtype: int
+        """
+        criteria = []
+        if name is not None:
+            criteria.append(cls.name == name)
+        if condition is not None:
+            criteria.append(cls.condition == condition)
+        if item_id is not None:
+            criteria.append(cls.id == item_id)
+        logger.info("Processing count of InventoryItems ...")
+        return count_rows(cls, *criteria)
+
+    @classmethod
+    def apply_decrements(cls, amounts: dict) -> None:
+        """
+        Takes several units out of the stock of many items at once
+
+        One executemany UPDATE writes every item, never below zero, and one
+        commit makes it durable. Items that are hot by then are skipped by it,
+        and have the units taken from their slot rows instead. When sharded
+        every shard gets the statements, so an item is found wherever it is
+        stored.
+
+        :param amounts: {item id: units to take}
+        :type amounts: dict
+        """
+        logger.info("Applying decrements to %d InventoryItems", len(amounts))
+        table = cls.__table__
+        left = table.c.quantity - bindparam("amount")
+        statement = (
+            update(table)
+            .where(table.c.id == bindparam("item_id"), table.c.slots == 0)
+            .values(quantity=case((left > 0, left), else_=0))
+        )
+        params = [{"item_id": item_id, "amount": amount} for item_id, amount in amounts.items()]
+        try:
+            for key in shard_keys() or [None]:
+                if key:
+                    use_shard(key)
+                db.session.execute(statement, params)
+                # read after the update, so an item that turned hot meanwhile is found here
+                hot = db.session.scalars(select(table.c.id).where(table.c.id.in_(list(amounts)), table.c.slots > 0)).all()
+                if hot:
+                    cls._take_from_slots({item_id: amounts[item_id] for item_id in hot})
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error applying %d decrements", len(amounts))
+            raise DataValidationError(e) from e
+
+    @classmethod
+    def export_rows(cls, batch_size: int = 1000):
+        """
+        Yields every InventoryItem as a serialized dictionary, in id order
+
+        The rows are read through a server-side cursor, batch_size at a time,
+        on a dedicated connection so memory stays constant however large the
+        table is. On PostgreSQL the read runs in a single REPEATABLE READ
+        transaction, so the export is one consistent snapshot even while
+        writes continue; SQLite gives the same guarantee for one statement.
+        When sharded, every shard is read this way and the streams are merged,
+        so each shard is consistent but they are not one snapshot together.
+
+        :param batch_size: the number of rows fetched per round trip
+        :type batch_size: int
+        :return: a generator of dictionaries shaped like serialize()
+        """
+        logger.info("Exporting all InventoryItems")
+        engines = [db.engines[key] for key in shard_keys()] or [db.engine]
+        streams = [cls._export_engine(engine, batch_size) for engine in engines]
+        totals = slot_totals()
+        for row in heapq.merge(*streams, key=itemgetter("id")):
+            if row["id"] in totals:
+                row["quantity"] = totals[row["id"]]
+            yield row
+
+    @classmethod
+    def _export_engine(cls, engine, batch_size: int):
+        """Yields the rows of one database in id order"""
+        options = {"yield_per": batch_size}
+        if engine.dialect.name == "postgresql":
+            options["isolation_level"] = "REPEATABLE READ"
+        with engine.connect() as connection:
+            connection.execution_options(**options)
+            with connection.begin():
+                result = connection.execute(select(*(cls.__table__.c[name] for name in ITEM_FIELDS)).order_by(cls.id))
+                for row in result.mappings():
+                    data = dict(row)
+                    data["price"] = str(data["price"].quantize(Decimal(".01")))
+                    yield data
+
+    @classmethod
+    def bulk_load(cls, rows: list) -> int:
+        """
+        Inserts or updates a batch of validated rows in one round trip
+
+        Rows that carry an id replace the stored item with that id, all other
+        rows are inserted with a new id. On PostgreSQL the batch is streamed
+        with COPY into a temporary staging table and merged from there; on
+        SQLite it is a single executemany INSERT ... ON CONFLICT. No other
+        database is supported. When sharded, each shard gets one such load for
+        the rows it owns.
+
+        :param rows: cleaned payloads as returned by item_validator, plus an
+            optional "id"
+        :type rows: list
+        :return: the number of rows loaded
+        :rtype: int
+        """
+        # the last row wins when an id is repeated within the batch
+        by_id = {}
+        for index, row in enumerate(rows):
+            item_id = row.get("id")
+            by_id[("new", index) if item_id is None else item_id] = row
+        rows = list(by_id.values())
+        if not rows:
+            return 0
+        logger.info("Bulk loading %d InventoryItems", len(rows))
+        try:
+            placements = None
+            if shard_keys():
+                placements = cls._load_shards(rows)
+            else:
+                cls._load_rows(rows)
+            db.session.commit()
+            if placements:
+                record_shards(placements)
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error bulk loading %d records", len(rows))
+            raise DataValidationError(e) from e
+        return len(rows)
+
+    @classmethod
+    def _load_rows(cls, rows: list) -> None:
+        """Upserts rows into the database the session is bound to"""
+        dialect = db.session.get_bind().dialect.name
+        if dialect == "postgresql":
+            cls._copy_rows(rows)
+        elif dialect == "sqlite":
+            cls._insert_rows(rows)
+        else:
+            raise DataValidationError(f"Bulk loading is not supported on {dialect}")
+
+    @classmethod
+    def _load_shards(cls, rows: list) -> dict:
+        """
+        Upserts rows into the shards that own their product_id and returns {id: shard}
+
+        New rows get ids from the shared counter. A row whose id is stored on
+        a different shard (because its product_id changed) is removed there.
+        """
+        keys = shard_keys()
+        existing = {row["id"]: shard_for(row["product_id"], keys) for row in rows if row.get("id") is not None}
+        new = [row for row in rows if row.get("id") is None]
+        first = allocate_ids(len(new), max(existing, default=0))
+        for offset, row in enumerate(new):
+            row["id"] = first + offset
+        for key in keys:
+            use_shard(key)
+            owned = [row for row in rows if shard_for(row["product_id"], keys) == key]
+            if owned:
+                cls._load_rows(owned)
+            moved = [item_id for item_id, owner in existing.items() if owner != key]
+            if moved:
+                db.session.execute(delete(cls.__table__).where(cls.id.in_(moved)))
+        return {row["id"]: shard_for(row["product_id"], keys) for row in rows}
+
+    @classmethod
+    def _insert_rows(cls, rows: list) -> None:
+        """Upserts rows into SQLite with a single executemany statement"""
+        table = cls.__table__
+        # the slots of an item that is loaded again are left as they are
+        columns = ITEM_FIELDS
+        statement = sqlite.insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.id],
+            set_={name: statement.excluded[name] for name in columns if name != "id"},
+        )
+        db.session.execute(statement, [{name: row.get(name) for name in columns} for row in rows])
+
+    @classmethod
+    def _copy_rows(cls, rows: list) -> None:
+        """Streams rows into a staging table with COPY and merges them"""
+        table = cls.__table__.name
+        columns = ITEM_FIELDS
+        fields = [name for name in columns if name != "id"]
+        connection = db.session.connection()
+        sequence = connection.exec_driver_sql(f"SELECT pg_get_serial_sequence('{table}', 'id')").scalar()
+        connection.exec_driver_sql(
+            f"CREATE TEMP TABLE {table}_staging ON COMMIT DROP AS "
+            f"SELECT {', '.join(columns)} FROM {table} WITH NO DATA"
+        )
+        with connection.connection.driver_connection.cursor() as cursor:
+            with cursor.copy(f"COPY {table}_staging ({', '.join(columns)}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row([row.get(name) for name in columns])
+        connection.exec_driver_sql(
+            f"INSERT INTO {table} ({', '.join(columns)}) "
+            f"SELECT COALESCE(id, nextval('{sequence}')), {', '.join(fields)} FROM {table}_staging "
+            f"ON CONFLICT (id) DO UPDATE SET {', '.join(f'{name} = EXCLUDED.{name}' for name in fields)}"
+        )
+        # explicit ids must never be handed out again by the sequence
+        connection.exec_driver_sql(
+            f"SELECT setval('{sequence}', MAX(id)) FROM {table} "
+            f"HAVING MAX(id) >= (SELECT last_value FROM {sequence})"
+        )
+
+
+# the columns an item is exported and loaded with; its slots stay internal
+ITEM_FIELDS = [column.name for column in InventoryItem.__table__.columns if column.name != "slots"]
+
+
+class InventoryItemArchive(db.Model):  # pylint: disable=too-many-instance-attributes
+    """
+    Class that represents an archived InventoryItem
+
+    Archived items are moved out of the inventory table so that lists and
+    scans of the inventory do not pay for them. They keep their id.
+    """
+
+    ##################################################
+    # Table Schema
+    ##################################################
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(63), nullable=False, index=True)
+    description = db.Column(db.String(255))
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(Numeric(8, 2), nullable=False)
+    product_id = db.Column(db.Integer, nullable=False)
+    restock_level = db.Column(db.Integer)
+    condition = db.Column(db.String(15))
+    archived_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<InventoryItemArchive {self.name} id=[{self.id}]>"
+
+    def delete(self) -> None:
+        """Removes an archived item from the data store"""
+        logger.info("Deleting archived %s", self.name)
+        try:
+            if shard_keys():
+                use_shard(shard_for(self.product_id))
+            db.session.delete(self)
+            db.session.commit()
+            if shard_keys():
+                forget_shards([self.id])
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error deleting archived record: %s", self)
+            raise DataValidationError(e) from e
+
+    def serialize(self) -> dict:
+        """Serializes an archived item like an InventoryItem, plus when it was archived"""
+        return dict(InventoryItem.serialize(self), archived_at=self.archived_at.isoformat())
+
+    def restore(self) -> InventoryItem:
+        """
+        Moves the item back into the inventory table and returns it there
+
+        Like archive(), the row is moved in one transaction, and it keeps its
+        id and its condition until it is updated.
+        """
+        logger.info("Restoring %s", self.name)
+        try:
+            if shard_keys():
+                use_shard(shard_for(self.product_id))
+            columns = {column: getattr(self, column) for column in ITEM_FIELDS}
+            item = InventoryItem(**columns)
+            db.session.delete(self)
+            db.session.add(item)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error restoring archived record: %s", self)
+            raise DataValidationError(e) from e
+        return item
+
+    ##################################################
+    # CLASS METHODS
+    ##################################################
+
+    @classmethod
+    def all(cls) -> list:
+        """Returns all of the archived items in id order"""
+        logger.info("Processing all archived InventoryItems")
+        if shard_keys():
+            return query_shards(cls)
+        return cls.query.order_by(cls.id).all()
+
+    @classmethod
+    def find(cls, item_id: int):
+        """Finds an archived item by its ID
+
+        :param item_id: the id of the archived item to find
+        :type item_id: int
+
+        :return: an instance with the item_id, or None if not found
+        :rtype: InventoryItemArchive
+        """
+        logger.info("Processing archive lookup for id %s ...", item_id)
+        if shard_keys():
+            key = locate_shard(item_id)
+            if key is None:
+                return None
+            use_shard(key)
+        return cls.query.filter(cls.id == item_id).first()
+
+    @classmethod
+    def find_many(cls, item_ids: list) -> list:
+        """Finds the archived items with any of the given IDs in one query
+
+        :param item_ids: the ids of the archived items to find
+        :type item_ids: list
+
+        :return: the instances that were found, in id order
+        :rtype: list
+        """
+        logger.info("Processing archive lookup for %d ids ...", len(item_ids))
+        if shard_keys():
+            return query_shards(cls, cls.id.in_(item_ids))
+        return cls.query.filter(cls.id.in_(item_ids)).order_by(cls.id).all()
+
+    @classmethod
+    def find_by_name(cls, name: str) -> list:
+        """Returns all archived items with the given name
+
+        :param name: the name of the archived items you want to match
+        :type name: str
+
+        :return: a collection of archived items with that name
+        :rtype: list
+        """
+        logger.info("Processing archive name query for %s ...", name)
+        if shard_keys():
+            return query_shards(cls, cls.name == name)
+        return cls.query.filter(cls.name == name).order_by(cls.id).all()
+
+    @classmethod
+    def count(cls, name: str = None) -> int:
+        """Counts the archived items, or only the ones with the given name
+
+        :param name: only count the archived items with this name
+        :type name: str
+
+        :return: the number of matching archived items
+        :rtype: int
+        """
+        logger.info("Processing count of archived InventoryItems ...")
+        return count_rows(cls, *([cls.name == name] if name is not None else []))
+
+    @classmethod
+    def sweep(cls) -> int:
+        """
+        Moves inventory items that are marked archived into the archive
+
+        Items can be created or updated with the archived condition without
+        going through archive(); this brings them into the archive table.
+
+        :return: the number of items moved
+        :rtype: int
+        """
+        items = list(InventoryItem.find_by_condition(Condition.ARCHIVED.value))
+        for item in items:
+            if shard_keys():
+                # items from the other shards are detached
+                item = InventoryItem.find(item.id)
+            item.archive()
+        return len(items)
+
+    @classmethod
+    def archived_before(cls, cutoff: datetime, batch_size: int = 1000):
+        """
+        Yields (shard, row) for every item archived before a cutoff
+
+        Each database (every shard, or the primary when unsharded) is read in
+        id order, batch_size rows at a time, and nothing is changed: delete
+        the rows with purge() once they are safely stored elsewhere.
+
+        :param cutoff: only rows archived before this moment
+        :type cutoff: datetime
+        :param batch_size: the number of rows read at a time
+        :type batch_size: int
+        :return: a generator of (shard or None, dictionary shaped like serialize())
+        """
+        logger.info("Reading the items archived before %s", cutoff)
+        table = cls.__table__
+        for key in shard_keys() or [None]:
+            last_id = 0
+            while True:
+                with db.engines[key].connect() as connection:
+                    rows = connection.execute(
+                        select(table)
+                        .where(table.c.archived_at < cutoff, table.c.id > last_id)
+                        .order_by(table.c.id)
+                        .limit(batch_size)
+                    ).mappings().all()
+                if not rows:
+                    break
+                for row in rows:
+                    data = dict(row)
+                    data["price"] = str(data["price"].quantize(Decimal(".01")))
+                    data["archived_at"] = data["archived_at"].isoformat()
+                    yield key, data
+                last_id = rows[-1]["id"]
+
+    @classmethod
+    def purge(cls, cutoff: datetime, last_ids: dict, batch_size: int = 1000) -> int:
+        """
+        Deletes the items archived before a cutoff, up to the last id read from each database
+
+        :param cutoff: the cutoff that archived_before() was given
+        :type cutoff: datetime
+        :param last_ids: {shard or None: the highest id read from it}
+        :type last_ids: dict
+        :param batch_size: the number of rows deleted at a time
+        :type batch_size: int
+        :return: the number of rows deleted
+        :rtype: int
+        """
+        logger.info("Purging the items archived before %s", cutoff)
+        table = cls.__table__
+        purged = 0
+        for key, last_id in last_ids.items():
+            while True:
+                with db.engines[key].begin() as connection:
+                    ids = connection.execute(
+                        select(table.c.id)
+                        .where(table.c.archived_at < cutoff, table.c.id <= last_id)
+                        .order_by(table.c.id)
+                        .limit(batch_size)
+                    ).scalars().all()
+                    connection.execute(delete(table).where(table.c.id.in_(ids)))
+                if not ids:
+                    break
+                if key:
+                    forget_shards(ids)
+                purged += len(ids)
+        return purged
@@ -21,11 +21,16 @@ This service implements a REST API that allows you to Create, Read, Update
 and Delete Inventory items.
 """
 
-from decimal import Decimal, InvalidOperation
-from flask import current_app as app  # Import Flask application
-from flask_restx import Resource, reqparse, fields
-from service.models import InventoryItem
+import time
+from flask import request, current_app as app  # Import Flask application
+from flask_restx import Resource, reqparse, fields, inputs, marshal
+from service.models import (
+    Condition, DataValidationError, InventoryItem, InventoryItemArchive, db, estimate_rows, use_primary
+)
 from service.common import status  # HTTP Status Codes
+from service.common.assets import send_index
+from service.common.coalescing import SingleFlight
+from service.common.tracing import span
 from . import api
 
 
@@ -38,6 +43,15 @@ def health_check():
     return {"status": "OK"}, status.HTTP_200_OK
 
 
+######################################################################
+# GET METRICS
+######################################################################
+@app.route("/metrics")
+def metrics():
+    """Returns the counters of this worker"""
+    return {"coalescing": single_flight.stats()}, status.HTTP_200_OK
+
+
 ######################################################################
 # GET INDEX
 ######################################################################
@@ -45,23 +59,53 @@ def health_check():
 def index():
     """Root URL for Inventory Service"""
     app.logger.info("Request for Root URL")
-    return app.send_static_file("index.html")
+    return send_index(app)
 
 
-def validate_decimal(value):
-    """
-    Validates that the given value can be converted to a Decimal.
+######################################################################
+# READ YOUR WRITES WHEN READING FROM REPLICAS
+######################################################################
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+PRIMARY_COOKIE = "inventory_primary_until"
 
-    Args:
-        value: The value to validate.
 
-    Raises:
-        ValueError: If the value cannot be converted to a Decimal.
-    """
+######################################################################
+# COALESCE IDENTICAL READS
+######################################################################
+single_flight = SingleFlight(app.config["COALESCE_TIMEOUT_MS"] / 1000)
+
+
+def coalesce(name: str, key, func):
+    """Shares one query between identical concurrent reads of this worker"""
+    # a client that must read its own writes cannot share a replica read
+    return single_flight.do(name, (key, bool(db.session.info.get("use_primary"))), func)
+
+
+def replicas_enabled() -> bool:
+    """Returns True if any read replica is configured"""
+    return any(key.startswith("replica_") for key in app.config.get("SQLALCHEMY_BINDS") or {})
+
+
+@app.before_request
+def route_to_primary():
+    """Keeps writes, and the reads of a client that just wrote, on the primary"""
+    if not replicas_enabled():
+        return
     try:
-        Decimal(value)
-    except InvalidOperation as exc:
-        raise ValueError(f"{value} is not a valid decimal number") from exc
+        recently_wrote = float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        recently_wrote = False
+    if request.method not in SAFE_METHODS or recently_wrote:
+        use_primary()
+
+
+@app.after_request
+def remember_write(response):
+    """Makes a client read from the primary for a while after a successful write"""
+    if replicas_enabled() and request.method not in SAFE_METHODS and response.status_code < 400:
+        window = app.config["REPLICA_STICKY_SECONDS"]
+        response.set_cookie(PRIMARY_COOKIE, f"{time.time() + window:.3f}", max_age=window, httponly=True)
+    return response
 
 
 # Define the model so that the docs reflect what can be sent
@@ -74,7 +118,8 @@ create_model = api.model(
         "quantity": fields.Integer(
             required=True, description="Quantity of inventory item"
         ),
-        "price": fields.String(required=True, description="Price of the product", validate=validate_decimal),
+        # the price is parsed and validated once, by InventoryItem.deserialize()
+        "price": fields.String(required=True, description="Price of the product"),
         "product_id": fields.Integer(required=True, description="ID of the product"),
         "restock_level": fields.Integer(
             required=True, description="Restock level of inventory item"
@@ -99,6 +144,28 @@ inventoryItem_model = api.inherit(
     },
 )
 
+transfer_model = api.model(
+    "InventoryTransfer",
+    {
+        "from_id": fields.Integer(required=True, description="ID of the item to take the units from"),
+        "to_id": fields.Integer(required=True, description="ID of the item to give the units to"),
+        "quantity": fields.Integer(required=True, description="Number of units to move"),
+    },
+)
+
+batch_request_model = api.model(
+    "InventoryItemBatchRequest",
+    {"ids": fields.List(fields.Integer, required=True, description="IDs of the inventory items")},
+)
+
+batch_model = api.model(
+    "InventoryItemBatch",
+    {
+        "items": fields.List(fields.Nested(inventoryItem_model), description="The items that were found"),
+        "missing": fields.List(fields.Integer, description="IDs of the items that were not found"),
+    },
+)
+
 # query string arguments
 inventoryItem_args = reqparse.RequestParser()
 inventoryItem_args.add_argument(
@@ -114,6 +181,30 @@ inventoryItem_args.add_argument(
     required=False,
     help="List InventoryItems by it's id",
 )
+inventoryItem_args.add_argument(
+    "include_archived",
+    type=inputs.boolean,
+    location="args",
+    required=False,
+    default=False,
+    help="Also list the archived InventoryItems",
+)
+inventoryItem_args.add_argument(
+    "count",
+    type=str,
+    location="args",
+    required=False,
+    default="exact",
+    choices=("exact", "estimate"),
+    help="How to count the items in X-Total-Count: estimate reads the planner statistics of an unfiltered list",
+)
+inventoryItem_args.add_argument(
+    "ids",
+    type=str,
+    location="args",
+    required=False,
+    help="Fetch the InventoryItems with these comma separated ids",
+)
 
 ######################################################################
 #  R E S T   A P I   E N D P O I N T S
@@ -148,13 +239,13 @@ class InventoryItemResource(Resource):
         """
         app.logger.info("Request to Retrieve a item with id [%s]", item_id)
 
-        # Attempt to find the Item and abort if not found
-        item = InventoryItem.find(item_id)
-        if not item:
+        # Attempt to find the Item, archived or not, and abort if not found
+        data = coalesce("get_item", item_id, lambda: find_serialized(item_id))
+        if not data:
             error(status.HTTP_404_NOT_FOUND, f"Item with id '{item_id}' was not found.")
 
-        app.logger.info("Returning item: %s", item.name)
-        return item.serialize(), status.HTTP_200_OK
+        app.logger.info("Returning item: %s", data["name"])
+        return data, status.HTTP_200_OK
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING ITEM
@@ -169,22 +260,29 @@ class InventoryItemResource(Resource):
         """
         Update an item
 
-        This endpoint will update an item based the body that is posted
+        This endpoint will update an item based the body that is posted.
+        An archived item is moved back into the inventory, unless it is
+        still archived after the update.
         """
         app.logger.info("Request to Update an item with id [%s]", item_id)
 
-        # Attempt to find the item and abort if not found
+        # Attempt to find the item, archived or not, and abort if not found
         item = InventoryItem.find(item_id)
         if not item:
-            error(status.HTTP_404_NOT_FOUND, f"Item with id '{item_id}' was not found.")
+            archived = InventoryItemArchive.find(item_id)
+            if not archived:
+                error(status.HTTP_404_NOT_FOUND, f"Item with id '{item_id}' was not found.")
+            item = archived.restore()
+        InventoryItem.with_slot_quantities([item])
 
         # Update the Item with the new data
         data = api.payload
-        app.logger.info("Processing: %s", data)
+        app.logger.debug("Processing: %s", data)
         item.deserialize(data)
 
         # Save the updates to the database
         item.update()
+        item = archive_if_archived(item)
 
         app.logger.info("Item with ID: %d updated.", item.id)
         return item.serialize(), status.HTTP_200_OK
@@ -204,11 +302,8 @@ class InventoryItemResource(Resource):
         """
         app.logger.info("Request to Delete an inventory with id [%s]", item_id)
 
-        # Delete the Inventory if it exists
-        item = InventoryItem.find(item_id)
-        if item:
-            app.logger.info("Inventory with ID: %d found.", item_id)
-            item.delete()
+        # Delete the Inventory if it exists, archived or not, without reading it first
+        if InventoryItem.delete_by_id(item_id):
             app.logger.info("Inventory with ID: %d delete complete.", item_id)
         return "", status.HTTP_204_NO_CONTENT
 
@@ -227,28 +322,51 @@ class InventoryItemCollection(Resource):
 
     @api.doc("list_inventory_items")
     @api.expect(inventoryItem_args, validate=True)
-    @api.marshal_list_with(inventoryItem_model)
+    @api.response(200, "Success", [inventoryItem_model])
+    @api.response(400, "The ids were not valid")
     def get(self):
-        """Returns all of the Inventory Items"""
+        """
+        Returns all of the Inventory Items
+
+        With ?ids=1,2,3 it returns the items with those ids instead, in the
+        same form as POST /inventory/batch
+        """
         app.logger.info("Request for inventory item list")
-        items = []
         args = inventoryItem_args.parse_args()
-        if args["condition"]:
-            app.logger.info("Filtering by condition: %s", args["condition"])
-            items = InventoryItem.find_by_condition(args["condition"])
-        elif args["name"]:
-            app.logger.info("Filtering by name: %s", args["name"])
-            items = InventoryItem.find_by_name(args["name"])
-        elif args["id"]:
-            app.logger.info("Filtering by id: %s", args["id"])
-            items = InventoryItem.find(args["id"])
-        else:
-            app.logger.info("Returning unfiltered list.")
-            items = InventoryItem.all()
-
-        results = [item.serialize() for item in items]
+        if args["ids"]:
+            return get_batch(args["ids"].split(","))
+        results = coalesce("list_items", tuple(sorted(args.items())), lambda: list_serialized(args))
         app.logger.info("[%d] Inventory items returned", len(results))
-        return results, status.HTTP_200_OK
+        with span("marshal", items=len(results)):
+            return marshal(results, inventoryItem_model), status.HTTP_200_OK, {"X-Total-Count": len(results)}
+
+    # ------------------------------------------------------------------
+    # COUNT ALL ITEMS
+    # ------------------------------------------------------------------
+
+    @api.doc("count_inventory_items")
+    @api.expect(inventoryItem_args, validate=True)
+    @api.response(200, "Success, with the number of items in X-Total-Count")
+    @api.response(400, "The ids were not valid")
+    def head(self):
+        """
+        Counts the Inventory Items a GET with the same arguments would return
+
+        The count is in the X-Total-Count header. With ?count=estimate an
+        unfiltered count is read from the planner statistics of a large
+        table, and X-Total-Count-Estimated is set.
+        """
+        app.logger.info("Request for inventory item count")
+        args = inventoryItem_args.parse_args()
+        if args["ids"]:
+            # counting found ids needs the same lookups as finding them
+            return get_batch(args["ids"].split(","))
+        total, estimated = count_matching(args)
+        app.logger.info("[%d] Inventory items counted", total)
+        headers = {"X-Total-Count": total}
+        if estimated:
+            headers["X-Total-Count-Estimated"] = "true"
+        return app.response_class(status=status.HTTP_200_OK, headers=headers, mimetype="application/json")
 
     # ------------------------------------------------------------------
     # ADD A NEW ITEM
@@ -268,11 +386,67 @@ class InventoryItemCollection(Resource):
         app.logger.debug("Payload = %s", api.payload)
         item.deserialize(api.payload)
         item.create()
+        item = archive_if_archived(item)
         app.logger.info("Inventory Item with new id [%s] saved!", item.id)
         location_url = api.url_for(InventoryItemResource, item_id=item.id, _external=True)
         return item.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
 
 
+######################################################################
+#  PATH: /inventory/batch
+######################################################################
+@api.route("/inventory/batch")
+class InventoryItemBatch(Resource):
+    """Fetches many inventory items at once"""
+
+    @api.doc("get_inventory_item_batch")
+    @api.response(400, "The ids were not valid")
+    @api.expect(batch_request_model)
+    def post(self):
+        """
+        Returns the items with the posted ids
+
+        Use this instead of GET /inventory?ids= when the list of ids is too
+        long for a URL. Nothing is changed.
+        """
+        app.logger.info("Request for a batch of inventory items")
+        payload = api.payload
+        values = payload.get("ids") if isinstance(payload, dict) else None
+        if not isinstance(values, list):
+            raise DataValidationError("ids must be a list of integers")
+        return get_batch(values)
+
+
+######################################################################
+#  PATH: /inventory/transfer
+######################################################################
+@api.route("/inventory/transfer")
+class TransferResource(Resource):
+    """Moves stock between inventory items"""
+
+    @api.doc("transfer_stock")
+    @api.response(400, "The posted transfer was not valid")
+    @api.response(404, "Item not found")
+    @api.response(409, "The source item does not have enough stock")
+    @api.expect(transfer_model)
+    def post(self):
+        """
+        Moves units of stock from one item to another
+
+        Both items are changed in one transaction, so the stock is never
+        counted twice or lost, not even for a moment.
+        """
+        app.logger.info("Request to transfer stock")
+        data = api.payload if isinstance(api.payload, dict) else {}
+        source_id, target_id = data.get("from_id"), data.get("to_id")
+        result = InventoryItem.transfer(source_id, target_id, data.get("quantity"))
+        if not result:
+            error(status.HTTP_404_NOT_FOUND, f"Items with ids '{source_id}' and '{target_id}' were not both found.")
+        source, target = result
+        app.logger.info("Transferred stock from item %d to item %d", source.id, target.id)
+        return {"from": source.serialize(), "to": target.serialize()}, status.HTTP_200_OK
+
+
 ######################################################################
 #  PATH: /inventory/{id}/archive
 ######################################################################
@@ -289,19 +463,19 @@ class ArchiveResource(Resource):
         Archive an item
 
         This endpoint will mark an item as archived based on the id specified in the path
+        and move it out of the inventory into the archive
         """
         app.logger.info("Request to archive item with id [%s]", item_id)
         # Find the item and abort if not found
         item = InventoryItem.find(item_id)
         if not item:
+            if InventoryItemArchive.find(item_id):
+                error(status.HTTP_400_BAD_REQUEST, "Item is already archived.")
             error(status.HTTP_404_NOT_FOUND, f"Item with id '{item_id}' was not found.")
 
-        if item.condition == "archived":
-            error(status.HTTP_400_BAD_REQUEST, "Item is already archived.")
-        item.condition = "archived"
-        item.update()
-        app.logger.info("Item with ID: %d archived.", item.id)
-        return item.serialize(), status.HTTP_200_OK
+        archived = item.archive()
+        app.logger.info("Item with ID: %d archived.", archived.id)
+        return archived.serialize(), status.HTTP_200_OK
 
 
 ######################################################################
@@ -314,6 +488,7 @@ class DecrementResource(Resource):
     """Decrement actions on a Inventory item"""
 
     @api.doc("decrement_items")
+    @api.response(202, "The decrement was accepted and will be written within WRITE_BEHIND_MS")
     @api.response(404, "Item not found")
     @api.response(409, "The item is not there to decrement")
     def put(self, item_id):
@@ -325,20 +500,27 @@ class DecrementResource(Resource):
         app.logger.info(
             "Request to decrement the quantity of an inventory with id [%s]", item_id
         )
-        item = InventoryItem.find(item_id)
+        # the client may take an acknowledgement instead of the new quantity
+        buffer = app.extensions.get("write_behind")
+        if buffer and "respond-async" in request.headers.get("Prefer", ""):
+            item = InventoryItem.find(item_id)
+            # hot items are decremented right away
+            if item and not item.slots:
+                pending = buffer.add(item.id)
+                if below_restock_level(item, pending):
+                    trigger_insufficient_product_notification(item)
+                app.logger.info("A decrement of the item with ID: %d was accepted.", item.id)
+                return {"id": item.id, "pending": pending}, status.HTTP_202_ACCEPTED, {"Preference-Applied": "respond-async"}
+
+        # decrement the current quantity for this item, never below zero
+        item = InventoryItem.decrement_by_id(item_id)
 
         if not item:
             error(
                 status.HTTP_404_NOT_FOUND, f"Item with id '{item_id}' was not found."
             )
 
-        # decrement the current quantity for this item
-        item.quantity -= 1
-        item.quantity = max(item.quantity, 0)
-
-        item.update()
-
-        if item.quantity < item.restock_level:
+        if below_restock_level(item):
             trigger_insufficient_product_notification(item)
         app.logger.info("The quantity of the item with ID: %d decremented.", item.id)
         return item.serialize(), status.HTTP_200_OK
@@ -347,6 +529,12 @@ class DecrementResource(Resource):
 ######################################################################
 # TRIGGER AN NOTIFICATION OF INSUFFICIENT ITEM
 ######################################################################
+def below_restock_level(item, pending: int = 0) -> bool:
+    """Returns True if the quantity of an item, less its pending decrements, is below its restock level"""
+    # an item without a restock level is never restocked
+    return item.restock_level is not None and item.quantity - pending < item.restock_level
+
+
 def trigger_insufficient_product_notification(item):
     """
     This function will be called only if the current inventory item's quantity is less than
@@ -361,6 +549,122 @@ def trigger_insufficient_product_notification(item):
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
 
+# ------------------------------------------------------------------
+# Keeps archived items out of the inventory table
+# ------------------------------------------------------------------
+def archive_if_archived(item):
+    """Returns the item, or its archived copy when it was written with the archived condition"""
+    if item.condition != Condition.ARCHIVED.value:
+        return item
+    # the default list would otherwise show it, as it only reads the inventory table
+    return item.archive()
+
+
+# ------------------------------------------------------------------
+# Queries shared by coalesced reads
+# ------------------------------------------------------------------
+def find_serialized(item_id):
+    """Returns an item, archived or not, as a dictionary or None if not found"""
+    item = InventoryItem.find(item_id) or InventoryItemArchive.find(item_id)
+    if not item:
+        return None
+    item = InventoryItem.with_slot_quantities([item])[0]
+    with span("serialize", items=1):
+        return item.serialize()
+
+
+def parse_ids(values: list) -> list:
+    """Returns the unique item ids of a batch request in the order they were given"""
+    limit = app.config["BATCH_MAX_IDS"]
+    try:
+        if any(isinstance(value, bool) or not isinstance(value, (int, str)) for value in values):
+            raise ValueError
+        ids = list(dict.fromkeys(int(value) for value in values))
+    except ValueError as exc:
+        raise DataValidationError("ids must be a list of integers") from exc
+    if not ids or len(ids) > limit:
+        raise DataValidationError(f"Between 1 and {limit} ids may be requested at once")
+    return ids
+
+
+def find_many_serialized(item_ids: list) -> dict:
+    """Returns the items with the given ids, archived or not, and the ids that were not found"""
+    found = {item.id: item for item in InventoryItem.with_slot_quantities(InventoryItem.find_many(item_ids))}
+    missing = [item_id for item_id in item_ids if item_id not in found]
+    if missing:
+        found.update((item.id, item) for item in InventoryItemArchive.find_many(missing))
+    with span("serialize", items=len(found)):
+        return {
+            "items": [found[item_id].serialize() for item_id in item_ids if item_id in found],
+            "missing": [item_id for item_id in item_ids if item_id not in found],
+        }
+
+
+def get_batch(values: list):
+    """Returns the response to a batch request for the given ids"""
+    item_ids = parse_ids(values)
+    data = coalesce("get_items", tuple(item_ids), lambda: find_many_serialized(item_ids))
+    app.logger.info("[%d] of [%d] inventory items found", len(data["items"]), len(item_ids))
+    with span("marshal", items=len(data["items"])):
+        return marshal(data, batch_model), status.HTTP_200_OK, {"X-Total-Count": len(data["items"])}
+
+
+def list_serialized(args) -> list:
+    """Returns the items matching the list query arguments as dictionaries"""
+    items = []
+    if args["condition"] == "archived":
+        app.logger.info("Returning the archive")
+        items = sorted(
+            InventoryItemArchive.all() + list(InventoryItem.find_by_condition("archived")),
+            key=lambda item: item.id,
+        )
+    elif args["condition"]:
+        app.logger.info("Filtering by condition: %s", args["condition"])
+        items = InventoryItem.find_by_condition(args["condition"])
+    elif args["name"]:
+        app.logger.info("Filtering by name: %s", args["name"])
+        items = InventoryItem.find_by_name(args["name"])
+        if args["include_archived"]:
+            items = sorted(list(items) + InventoryItemArchive.find_by_name(args["name"]), key=lambda item: item.id)
+    elif args["id"]:
+        app.logger.info("Filtering by id: %s", args["id"])
+        item = InventoryItem.find(args["id"])
+        items = [item] if item else []
+    else:
+        app.logger.info("Returning unfiltered list.")
+        items = InventoryItem.all()
+        if args["include_archived"]:
+            items = sorted(items + InventoryItemArchive.all(), key=lambda item: item.id)
+    items = InventoryItem.with_slot_quantities(items)
+    with span("serialize", items=len(items)):
+        return [item.serialize() for item in items]
+
+
+def count_matching(args) -> tuple:
+    """Returns how many items match the list query arguments, and whether that is an estimate"""
+    if args["count"] == "estimate" and not (args["condition"] or args["name"] or args["id"]):
+        models = [InventoryItem, InventoryItemArchive] if args["include_archived"] else [InventoryItem]
+        estimates = [estimate_rows(model) for model in models]
+        # small tables are counted exactly: it is cheap, and their statistics are the least accurate
+        if None not in estimates and sum(estimates) >= app.config["COUNT_ESTIMATE_MIN_ROWS"]:
+            return sum(estimates), True
+    if args["condition"] == "archived":
+        total = InventoryItemArchive.count() + InventoryItem.count(condition="archived")
+    elif args["condition"]:
+        total = InventoryItem.count(condition=args["condition"])
+    elif args["name"]:
+        total = InventoryItem.count(name=args["name"])
+        if args["include_archived"]:
+            total += InventoryItemArchive.count(name=args["name"])
+    elif args["id"]:
+        total = InventoryItem.count(item_id=args["id"])
+    else:
+        total = InventoryItem.count()
+        if args["include_archived"]:
+            total += InventoryItemArchive.count()
+    return total, False
+
+
 # ------------------------------------------------------------------
 # Logs error messages before aborting
 # ------------------------------------------------------------------
@@ -0,0 +1,192 @@
+"""
+Admission Control Tests
+"""
+
+import os
+import time
+from unittest import TestCase
+from service import config as service_config
+from service.common import status
+from service.common.admission import (
+    CRITICAL, EXPENSIVE, NORMAL, ConcurrencyLimit, TokenBuckets, init_admission, priority_of, queue_age
+)
+from tests.test_base import make_app
+
+
+class FakeClock:  # pylint: disable=too-few-public-methods
+    """A clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+CONFIG = {
+    "ADMISSION_MAX_CONCURRENT": 4,
+    "ADMISSION_EXPENSIVE_SHARE": 0.5,
+    "ADMISSION_RETRY_AFTER": 2,
+    "ADMISSION_MAX_QUEUE_MS": 1000,
+    "ADMISSION_RATE": 0,
+    "ADMISSION_BURST": 2,
+    "ADMISSION_EXPENSIVE_COST": 2,
+    "ADMISSION_WORKERS": 1,
+    "TRUSTED_PROXIES": 0,
+}
+
+# one route per priority
+ROUTES = [
+    ("/health", "health_check", lambda: "OK"),
+    ("/item", "inventory_item_resource", lambda: "item"),
+    ("/list", "inventory_item_collection", lambda: "list"),
+]
+
+
+######################################################################
+#  P R I O R I T Y   A N D   L I M I T E R   T E S T S
+######################################################################
+class TestLimiters(TestCase):
+    """Token Bucket and Concurrency Limit Tests"""
+
+    def test_priority_of(self):
+        """It should give every endpoint a priority"""
+        self.assertEqual(priority_of("health_check", "GET"), CRITICAL)
+        self.assertEqual(priority_of("decrement_resource", "PUT"), CRITICAL)
+        self.assertEqual(priority_of("inventory_item_collection", "GET"), EXPENSIVE)
+        self.assertEqual(priority_of("inventory_item_collection", "HEAD"), NORMAL)
+        self.assertEqual(priority_of("inventory_item_collection", "POST"), NORMAL)
+        self.assertEqual(priority_of("inventory_item_resource", "GET"), NORMAL)
+        self.assertEqual(priority_of(None, "GET"), NORMAL)
+
+    def test_token_bucket(self):
+        """It should allow a burst and then refill at the rate"""
+        clock = FakeClock()
+        buckets = TokenBuckets(rate=2, burst=3, clock=clock)
+        self.assertEqual([buckets.take("a", 1) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(buckets.take("a", 1), 0.5)
+        self.assertEqual(buckets.take("b", 1), 0)  # other clients are unaffected
+        clock.now = 0.5
+        self.assertEqual(buckets.take("a", 1), 0)
+
+    def test_token_bucket_forgets_clients(self):
+        """It should only remember the most recent clients"""
+        buckets = TokenBuckets(rate=1, burst=1, max_clients=2, clock=FakeClock())
+        for client in ("a", "b", "c"):
+            buckets.take(client, 1)
+        self.assertEqual(buckets.take("a", 1), 0)  # forgotten, so full again
+        self.assertEqual(buckets.take("c", 1), 1)
+
+    def test_queue_age(self):
+        """It should read X-Request-Start in seconds, milliseconds or microseconds"""
+        for header in ("t=1700000000.5", "1700000000500", "t=1700000000500000"):
+            self.assertAlmostEqual(queue_age(header, now=1700000002.0), 1.5, msg=header)
+        self.assertEqual(queue_age("t=1700000003", now=1700000002.0), 0.0)
+        for header in (None, "", "t=soon"):
+            self.assertIsNone(queue_age(header), header)
+
+    def test_concurrency_limit(self):
+        """It should refuse expensive requests first and never critical ones"""
+        limit = ConcurrencyLimit(limit=4, expensive_share=0.5)
+        self.assertTrue(limit.acquire(EXPENSIVE))
+        self.assertTrue(limit.acquire(EXPENSIVE))
+        self.assertFalse(limit.acquire(EXPENSIVE))
+        self.assertTrue(limit.acquire(NORMAL))
+        self.assertTrue(limit.acquire(NORMAL))
+        self.assertFalse(limit.acquire(NORMAL))
+        self.assertTrue(limit.acquire(CRITICAL))
+        limit.release()
+        limit.release()
+        self.assertTrue(limit.acquire(NORMAL))
+
+
+######################################################################
+#  A D M I S S I O N   T E S T S
+######################################################################
+class TestAdmission(TestCase):
+    """Admission Control Hook Tests"""
+
+    def test_sheds_when_busy(self):
+        """It should answer 503 with Retry-After when the worker is full"""
+        app = make_app(init_admission, ROUTES, CONFIG)
+        client = app.test_client()
+        limit = app.extensions["admission"]
+        self.assertEqual(client.get("/list").status_code, status.HTTP_200_OK)
+        self.assertEqual(limit.active, 0)  # the slot was given back
+        limit.active = 2
+        response = client.get("/list")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.headers["Retry-After"], "2")
+        self.assertEqual(response.get_json()["error"], "Service Unavailable")
+        self.assertEqual(client.get("/item").status_code, status.HTTP_200_OK)
+        limit.active = 4
+        self.assertEqual(client.get("/item").status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(client.get("/health").status_code, status.HTTP_200_OK)
+
+    def test_sheds_queued_requests(self):
+        """It should answer 503 to requests that waited too long, lists first"""
+        client = make_app(init_admission, ROUTES, CONFIG).test_client()
+        waited = {"X-Request-Start": f"t={time.time() - 0.7:.3f}"}
+        self.assertEqual(client.get("/item", headers=waited).status_code, status.HTTP_200_OK)
+        response = client.get("/list", headers=waited)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.headers["Retry-After"], "2")
+        waited = {"X-Request-Start": f"{(time.time() - 2) * 1000:.0f}"}
+        self.assertEqual(client.get("/item", headers=waited).status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(client.get("/health", headers=waited).status_code, status.HTTP_200_OK)
+        self.assertEqual(client.get("/list").status_code, status.HTTP_200_OK)
+
+    def test_rate_limits_forwarded_clients(self):
+        """It should give every client behind the proxy its own bucket"""
+        client = make_app(init_admission, ROUTES, CONFIG, ADMISSION_RATE=1, ADMISSION_BURST=2, TRUSTED_PROXIES=1).test_client()
+        noisy = {"X-Forwarded-For": "203.0.113.7"}
+        self.assertEqual(client.get("/item", headers=noisy).status_code, status.HTTP_200_OK)
+        self.assertEqual(client.get("/item", headers=noisy).status_code, status.HTTP_200_OK)
+        self.assertEqual(client.get("/item", headers=noisy).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        quiet = {"X-Forwarded-For": "198.51.100.2"}
+        self.assertEqual(client.get("/item", headers=quiet).status_code, status.HTTP_200_OK)
+        # only the last address is the proxy's, a client cannot pick another bucket
+        spoofed = {"X-Forwarded-For": "192.0.2.1, 203.0.113.7"}
+        self.assertEqual(client.get("/item", headers=spoofed).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_rate_split_between_workers(self):
+        """It should give each worker its share of a client's rate"""
+        app = make_app(init_admission, ROUTES, CONFIG, ADMISSION_RATE=4, ADMISSION_BURST=8, ADMISSION_WORKERS=4)
+        client = app.test_client()
+        self.assertEqual(client.get("/item").status_code, status.HTTP_200_OK)
+        self.assertEqual(client.get("/item").status_code, status.HTTP_200_OK)
+        self.assertEqual(client.get("/item").status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_shipped_defaults(self):
+        """It should shed lists with the shipped defaults once half the threads are busy"""
+        defaults = {name: getattr(service_config, name) for name in dir(service_config) if name.startswith("ADMISSION_")}
+        app = make_app(init_admission, ROUTES, CONFIG, **defaults)
+        app.add_url_rule("/decrement", "decrement_resource", lambda: "decremented", methods=["PUT"])
+        client = app.test_client()
+        limit = app.extensions["admission"]
+        self.assertEqual(limit.limit, int(os.getenv("GUNICORN_THREADS", "4")))
+        self.assertLess(limit.expensive_limit, limit.limit)
+        # as many requests as lists may use are still running
+        for _ in range(limit.expensive_limit):
+            self.assertTrue(limit.acquire(NORMAL))
+        self.assertEqual(client.get("/list").status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(client.put("/decrement").status_code, status.HTTP_200_OK)
+        self.assertEqual(client.get("/item").status_code, status.HTTP_200_OK)
+
+    def test_rate_limits_clients(self):
+        """It should answer 429 with Retry-After when a client sends too much"""
+        app = make_app(init_admission, ROUTES, CONFIG, ADMISSION_RATE=0.5)
+        client = app.test_client()
+        self.assertEqual(client.get("/list").status_code, status.HTTP_200_OK)
+        response = client.get("/item")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response.headers["Retry-After"], "2")
+        for _ in range(5):
+            self.assertEqual(client.get("/health").status_code, status.HTTP_200_OK)
+
+    def test_disabled(self):
+        """It should admit everything when the limits are turned off"""
+        app = make_app(init_admission, ROUTES, CONFIG, ADMISSION_MAX_CONCURRENT=0)
+        client = app.test_client()
+        for _ in range(10):
+            self.assertEqual(client.get("/list").status_code, status.HTTP_200_OK)
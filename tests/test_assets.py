@@ -0,0 +1,91 @@
+"""
+Static Asset Tests
+"""
+
+import os
+import gzip
+import tempfile
+from unittest import TestCase
+from flask import Flask
+from service.common import status
+from service.common.assets import Assets, init_assets, precompress, send_index
+
+INDEX = '<link href="static/css/site.css"><script src="static/js/app.js"></script><img src="static/missing.png">'
+
+
+class TestAssets(TestCase):
+    """Fingerprinted Asset Tests"""
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmpdir.cleanup)
+        self.folder = tmpdir.name
+        files = {
+            "index.html": INDEX,
+            "css/site.css": "body { color: red; }\n" * 100,
+            "js/app.js": "console.log('hello');\n" * 100,
+            "images/logo.png": "not really a png",
+        }
+        for path, text in files.items():
+            os.makedirs(os.path.dirname(os.path.join(self.folder, path)), exist_ok=True)
+            with open(os.path.join(self.folder, path), "w", encoding="utf-8") as out:
+                out.write(text)
+
+    def make_client(self):
+        """Returns a test client of a tiny app serving the folder"""
+        app = Flask(__name__, static_folder=self.folder)
+        init_assets(app)
+        app.add_url_rule("/", "index", lambda: send_index(app))
+        return app, app.test_client()
+
+    def test_fingerprints(self):
+        """It should give every asset a URL that changes with its content"""
+        assets = Assets(self.folder)
+        self.assertRegex(assets.url_for("js/app.js"), r"^/assets/js/app\.[0-9a-f]{12}\.js$")
+        self.assertNotIn("index.html", assets.urls)
+        with open(os.path.join(self.folder, "js/app.js"), "a", encoding="utf-8") as out:
+            out.write("// changed\n")
+        self.assertNotEqual(Assets(self.folder).url_for("js/app.js"), assets.url_for("js/app.js"))
+
+    def test_index(self):
+        """It should rewrite index.html to the fingerprinted URLs and cache it briefly"""
+        app, client = self.make_client()
+        assets = app.extensions["assets"]
+        response = client.get("/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        html = response.get_data(as_text=True)
+        self.assertIn(f'href="{assets.url_for("css/site.css")}"', html)
+        self.assertIn(f'src="{assets.url_for("js/app.js")}"', html)
+        self.assertIn('src="static/missing.png"', html)
+        self.assertEqual(response.headers["Cache-Control"], "public, max-age=60")
+        response = client.get("/", headers={"If-None-Match": response.headers["ETag"]})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_immutable_asset(self):
+        """It should serve fingerprinted assets with a one year immutable cache"""
+        app, client = self.make_client()
+        url = app.extensions["assets"].url_for("js/app.js")
+        response = client.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.get_data(as_text=True), "console.log('hello');\n" * 100)
+        response.close()
+        self.assertEqual(client.get("/assets/js/app.000000000000.js").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_precompressed_asset(self):
+        """It should serve the precompressed copy to clients that accept it"""
+        written = precompress(self.folder)
+        self.assertIn("js/app.js.gz", written)
+        self.assertNotIn("images/logo.png.gz", written)
+        app, client = self.make_client()
+        url = app.extensions["assets"].url_for("css/site.css")
+        response = client.get(url, headers={"Accept-Encoding": "gzip, br;q=0"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.mimetype, "text/css")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertEqual(gzip.decompress(response.get_data()).decode(), "body { color: red; }\n" * 100)
+        response.close()
+        response = client.get(url)
+        self.assertNotIn("Content-Encoding", response.headers)
+        response.close()
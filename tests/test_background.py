@@ -0,0 +1,37 @@
+"""
+Background Thread Tests
+"""
+
+import threading
+from unittest import TestCase
+from service.common.background import Lazy
+
+
+class TestLazy(TestCase):
+    """Lazy Start Tests"""
+
+    def test_start_on_first_use(self):
+        """It should start nothing until first used, and then only once"""
+        started = []
+        lazy = Lazy(lambda: started.append(object()) or started[-1])
+        self.assertEqual(started, [])
+        first = lazy.get()
+        self.assertIs(lazy.get(), first)
+        self.assertEqual(started, [first])
+
+    def test_start_once_across_threads(self):
+        """It should start once when many threads use it at the same time"""
+        started = []
+        barrier = threading.Barrier(8)
+        lazy = Lazy(lambda: started.append(object()) or started[-1])
+
+        def use():
+            barrier.wait()
+            lazy.get()
+
+        threads = [threading.Thread(target=use) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(started), 1)
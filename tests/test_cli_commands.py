@@ -3,6 +3,11 @@ CLI Command Extensions for Flask
 """
 
 import os
+import gzip
+import json
+import tempfile
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
@@ -10,6 +15,9 @@ from click.testing import CliRunner
 # pylint: disable=unused-import
 from wsgi import app  # noqa: F401
 from service.common.cli_commands import db_create  # noqa: E402
+from service.models import InventoryItem, InventoryItemArchive, db, slot_totals
+from tests.factories import InventoryItemFactory
+from tests.test_base import BaseTestCase, ShardedTestCase
 
 
 class TestFlaskCLI(TestCase):
@@ -25,3 +33,257 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+
+class TestInventoryImport(BaseTestCase):
+    """Tests for the inventory-import command"""
+
+    def setUp(self):
+        super().setUp()
+        self.runner = app.test_cli_runner()
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def _write(self, name: str, text: str) -> str:
+        """Writes a file into the temporary directory and returns its path"""
+        path = os.path.join(self.tmpdir.name, name)
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(path, "wt", encoding="utf-8") as out:
+            out.write(text)
+        return path
+
+    def test_import_csv(self):
+        """It should import a CSV file and reject the bad rows"""
+        path = self._write(
+            "items.csv",
+            "name,description,quantity,price,product_id,restock_level,condition\n"
+            "Widget,A widget,10,1.50,1,2,new\n"
+            "Gadget,,five,2.00,2,,used\n"
+            "Gizmo,,3,9.99,3,,\n",
+        )
+        result = self.runner.invoke(args=["inventory-import", path, "--chunk-size", "2"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Imported 2 items", result.output)
+        self.assertIn("Rejected 1 rows", result.output)
+        items = sorted(InventoryItem.all(), key=lambda item: item.name)
+        self.assertEqual([item.name for item in items], ["Gizmo", "Widget"])
+        self.assertEqual(items[1].price, Decimal("1.50"))
+        self.assertIsNone(items[0].condition)
+        with open(f"{path}.rejects.ndjson", encoding="utf-8") as rejects:
+            rejected = [json.loads(line) for line in rejects]
+        self.assertEqual(len(rejected), 1)
+        self.assertEqual(rejected[0]["line"], 3)
+        self.assertIn("[quantity]", rejected[0]["errors"][0])
+
+    def test_import_ndjson_upserts_by_id(self):
+        """It should replace items that are imported with an existing id"""
+        item = InventoryItemFactory()
+        item.create()
+        rows = [
+            dict(item.serialize(), name="Renamed"),
+            dict(InventoryItemFactory().serialize(), id=None),
+            "{not json",
+            dict(InventoryItemFactory().serialize(), id="seven"),
+        ]
+        text = "\n".join(row if isinstance(row, str) else json.dumps(row) for row in rows) + "\n\n"
+        path = self._write("items.ndjson.gz", text)
+        rejects = os.path.join(self.tmpdir.name, "rejects.ndjson")
+        result = self.runner.invoke(args=["inventory-import", path, "--rejects", rejects])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Imported 2 items", result.output)
+        self.assertEqual(len(InventoryItem.all()), 2)
+        self.assertEqual(InventoryItem.find(item.id).name, "Renamed")
+        with open(rejects, encoding="utf-8") as rejected:
+            self.assertEqual(len(rejected.readlines()), 2)
+
+    def test_import_load_failure(self):
+        """It should stop with an error when a chunk cannot be loaded"""
+        path = self._write("items.json", json.dumps(InventoryItemFactory().serialize()) + "\n")
+        with patch("service.models.db.session.commit") as commit_mock:
+            commit_mock.side_effect = Exception("database is gone")
+            result = self.runner.invoke(args=["inventory-import", path, "--format", "ndjson"])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("database is gone", result.output)
+        self.assertFalse(os.path.exists(f"{path}.rejects.ndjson"))
+
+
+class TestInventoryExport(BaseTestCase):
+    """Tests for the inventory-export command"""
+
+    def setUp(self):
+        super().setUp()
+        self.runner = app.test_cli_runner()
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.tmpdir.cleanup)
+        self.items = InventoryItemFactory.create_batch(3)
+        for item in self.items:
+            item.create()
+
+    def test_export_csv(self):
+        """It should export every item to CSV in id order"""
+        path = os.path.join(self.tmpdir.name, "items.csv")
+        result = self.runner.invoke(args=["inventory-export", path, "--batch-size", "2"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Exported 3 items", result.output)
+        with open(path, encoding="utf-8") as exported:
+            lines = exported.read().splitlines()
+        self.assertEqual(lines[0], "id,name,description,quantity,price,product_id,restock_level,condition")
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[1].startswith(f"{self.items[0].id},"))
+
+    def test_export_ndjson_gzip_round_trip(self):
+        """It should export gzipped NDJSON that imports back unchanged"""
+        path = os.path.join(self.tmpdir.name, "items.ndjson")
+        result = self.runner.invoke(args=["inventory-export", path, "--gzip"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with gzip.open(path, "rt", encoding="utf-8") as exported:
+            rows = [json.loads(line) for line in exported]
+        self.assertEqual(rows, [item.serialize() for item in self.items])
+
+        # recognized as gzip by its content, not its name
+        InventoryItem.query.delete()
+        result = self.runner.invoke(args=["inventory-import", path])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual([item.serialize() for item in InventoryItem.all()], rows)
+
+
+class TestInventoryHot(BaseTestCase):
+    """Tests for the inventory-hot command"""
+
+    def setUp(self):
+        super().setUp()
+        self.runner = app.test_cli_runner()
+
+    def test_inventory_hot(self):
+        """It should spread the quantity of an item over slots and back"""
+        item = InventoryItemFactory(quantity=10)
+        item.create()
+        result = self.runner.invoke(args=["inventory-hot", str(item.id), "--slots", "4"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("over 4 slots", result.output)
+        self.assertEqual(slot_totals(), {item.id: 10})
+        item.decrement()
+        self.assertEqual(next(InventoryItem.export_rows())["quantity"], 9)
+        result = self.runner.invoke(args=["inventory-hot", str(item.id), "--slots", "1"])
+        self.assertIn("back into the item", result.output)
+        self.assertEqual(slot_totals(), {})
+        result = self.runner.invoke(args=["inventory-hot", "9999"])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("was not found", result.output)
+
+
+class TestOpenapiDump(TestCase):
+    """Tests for the openapi-dump command"""
+
+    def setUp(self):
+        self.runner = app.test_cli_runner()
+
+    def test_openapi_dump(self):
+        """It should write the spec that /api/swagger.json serves"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "swagger.json")
+            result = self.runner.invoke(args=["openapi-dump", path])
+            self.assertEqual(result.exit_code, 0, result.output)
+            with open(path, "rb") as spec:
+                self.assertEqual(spec.read(), app.test_client().get("/api/swagger.json").get_data())
+
+    def test_openapi_dump_error(self):
+        """It should fail when the spec could not be built"""
+        with patch.dict(app.extensions):
+            del app.extensions["openapi"]
+            result = self.runner.invoke(args=["openapi-dump", "-"])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("could not be built", result.output)
+
+
+class TestArchiveCompact(BaseTestCase):
+    """Tests for the archive-compact command"""
+
+    def setUp(self):
+        super().setUp()
+        self.runner = app.test_cli_runner()
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, "archive.ndjson.gz")
+
+    def test_archive_compact(self):
+        """It should write old archived items to a gzipped file and delete them"""
+        InventoryItemFactory(condition="archived").create()
+        archived = []
+        for item in InventoryItemFactory.create_batch(3):
+            item.create()
+            archived.append(item.archive())
+        for old in archived[:2]:
+            old.archived_at = datetime.now(timezone.utc) - timedelta(days=400)
+        db.session.commit()
+        old_ids = [old.id for old in archived[:2]]
+        result = self.runner.invoke(args=["archive-compact", self.path, "--batch-size", "1"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Moved 1 items marked archived", result.output)
+        self.assertIn("Compacted 2 archived items", result.output)
+        with gzip.open(self.path, "rt", encoding="utf-8") as archive:
+            rows = [json.loads(line) for line in archive]
+        self.assertEqual([row["id"] for row in rows], old_ids)
+        self.assertEqual(rows[0]["condition"], "archived")
+        self.assertEqual(len(InventoryItemArchive.all()), 2)
+
+        result = self.runner.invoke(args=["archive-compact", self.path])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("already exists", result.output)
+
+    def test_archive_compact_write_fails(self):
+        """It should not delete any archived item when the file cannot be written"""
+        item = InventoryItemFactory()
+        item.create()
+        item.archive().archived_at = datetime.now(timezone.utc) - timedelta(days=400)
+        db.session.commit()
+        with patch("service.common.cli_commands._write_ndjson", side_effect=OSError("disk full")):
+            result = self.runner.invoke(args=["archive-compact", self.path])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertEqual(len(InventoryItemArchive.all()), 1)
+
+
+class TestInventoryRebalance(ShardedTestCase):
+    """Tests for the inventory-rebalance command"""
+
+    def setUp(self):
+        super().setUp()
+        self.runner = app.test_cli_runner()
+
+    def _insert(self, engine, item_id: int, product_id: int) -> None:
+        """Writes an item straight into one database"""
+        row = dict(InventoryItemFactory(id=item_id, product_id=product_id).serialize())
+        with engine.begin() as connection:
+            connection.execute(InventoryItem.__table__.insert(), row)
+
+    def test_rebalance(self):
+        """It should move items from the primary and wrong shards to their own shard"""
+        self._insert(db.engine, 1, 2)
+        self._insert(db.engine, 2, 3)
+        self._insert(self.shards[0], 3, 5)
+        self._insert(self.shards[1], 4, 7)
+        result = self.runner.invoke(args=["inventory-rebalance", "--dry-run"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Would move 3 items in total", result.output)
+        self.assertEqual(self.ids_on(1), [4])
+        # written behind the directory's back, so not found by id yet
+        self.assertIsNone(InventoryItem.find(4))
+
+        result = self.runner.invoke(args=["inventory-rebalance", "--batch-size", "1"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Moved 3 items in total", result.output)
+        self.assertEqual(self.ids_on(0), [1])
+        self.assertEqual(self.ids_on(1), [2, 3, 4])
+        with db.engine.connect() as connection:
+            self.assertEqual(connection.execute(InventoryItem.__table__.select()).all(), [])
+        self.assertEqual([InventoryItem.find(item_id).id for item_id in (1, 2, 3, 4)], [1, 2, 3, 4])
+        item = InventoryItemFactory()
+        item.create()
+        self.assertEqual(item.id, 5)
+
+    def test_rebalance_without_shards(self):
+        """It should refuse to rebalance when there are no shards"""
+        with patch("service.common.cli_commands.shard_keys", return_value=[]):
+            result = self.runner.invoke(args=["inventory-rebalance"])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("No shards are configured", result.output)
@@ -0,0 +1,84 @@
+"""
+Request Coalescing Tests
+"""
+
+import threading
+from unittest import TestCase
+from service.common.coalescing import SingleFlight
+
+
+class TestSingleFlight(TestCase):
+    """Single Flight Tests"""
+
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def _slow(self, result):
+        """Returns a call that blocks until released"""
+        def call():
+            self.calls += 1
+            self.started.set()
+            self.release.wait(5)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return call
+
+    def _run_together(self, key, func, followers: int) -> list:
+        """Starts a leader, then followers with the same key, and returns what each got"""
+        outcomes = []
+
+        def run():
+            try:
+                outcomes.append(self.flight.do("read", key, func))
+            except ValueError as error:
+                outcomes.append(error)
+
+        leader = threading.Thread(target=run)
+        leader.start()
+        self.assertTrue(self.started.wait(5))
+        threads = [threading.Thread(target=run) for _ in range(followers)]
+        for thread in threads:
+            thread.start()
+        # wait until every follower is queued behind the leader
+        while self.flight.stats()["read"]["coalesced"] < followers:
+            threading.Event().wait(0.001)
+        self.release.set()
+        for thread in [leader] + threads:
+            thread.join(5)
+        return outcomes
+
+    def test_shares_one_call(self):
+        """It should run concurrent identical calls once"""
+        outcomes = self._run_together(1, self._slow({"id": 1}), followers=3)
+        self.assertEqual(outcomes, [{"id": 1}] * 4)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.flight.stats(), {"read": {"executions": 1, "coalesced": 3, "timed_out": 0}})
+
+    def test_shares_errors(self):
+        """It should raise the error of the shared call in every caller"""
+        error = ValueError("boom")
+        outcomes = self._run_together(1, self._slow(error), followers=2)
+        self.assertEqual(outcomes, [error] * 3)
+        self.assertEqual(self.calls, 1)
+
+    def test_does_not_cache(self):
+        """It should run calls that do not overlap every time"""
+        self.assertEqual(self.flight.do("read", 1, lambda: 1), 1)
+        self.assertEqual(self.flight.do("read", 1, lambda: 2), 2)
+        self.assertEqual(self.flight.do("read", 2, lambda: 3), 3)
+        self.assertEqual(self.flight.stats(), {"read": {"executions": 3, "coalesced": 0, "timed_out": 0}})
+
+    def test_stops_waiting(self):
+        """It should run the call itself when the shared one takes too long"""
+        self.flight = SingleFlight(timeout=0.01)
+        leader = threading.Thread(target=self.flight.do, args=("read", 1, self._slow("slow")))
+        leader.start()
+        self.assertTrue(self.started.wait(5))
+        self.assertEqual(self.flight.do("read", 1, lambda: "own"), "own")
+        self.release.set()
+        leader.join(5)
+        self.assertEqual(self.flight.stats(), {"read": {"executions": 1, "coalesced": 1, "timed_out": 1}})
@@ -0,0 +1,100 @@
+"""
+Response Compression Tests
+"""
+
+import gzip
+import zlib
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+from flask import Response, jsonify
+from service.common import compression, status
+from service.common.compression import available_encoders, compress, init_compression
+from tests.test_base import make_app
+
+PAYLOAD = [{"id": index, "name": "widget", "condition": "new"} for index in range(200)]
+
+CONFIG = {"COMPRESSION_MIN_SIZE": 1024, "COMPRESSION_LEVELS": {"gzip": 6, "br": 4, "zstd": 3}}
+
+# a large, small and streamed route
+ROUTES = [
+    ("/large", "large", lambda: jsonify(PAYLOAD)),
+    ("/small", "small", lambda: {"status": "OK"}),
+    ("/image", "image", lambda: Response(b"x" * 4096, mimetype="image/png")),
+    ("/tagged", "tagged", lambda: Response("x" * 4096, headers={"ETag": '"abc"'})),
+    ("/stream", "stream", lambda: Response((f"line {index}\n" for index in range(500)), mimetype="text/plain")),
+]
+
+
+class TestCompression(TestCase):
+    """Response Compression Tests"""
+
+    def setUp(self):
+        self.client = make_app(init_compression, ROUTES, CONFIG).test_client()
+
+    def test_gzip_large_response(self):
+        """It should gzip a large JSON response"""
+        response = self.client.get("/large", headers={"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        body = response.get_data()
+        self.assertLess(len(body), len(jsonify_bytes()) / 4)
+        self.assertEqual(int(response.headers["Content-Length"]), len(body))
+        self.assertEqual(gzip.decompress(body), jsonify_bytes())
+
+    def test_not_compressed(self):
+        """It should leave responses alone that are small, binary or not accepted"""
+        response = self.client.get("/small", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        response = self.client.get("/image", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        response = self.client.get("/large")
+        self.assertNotIn("Content-Encoding", response.headers)
+        response = self.client.get("/large", headers={"Accept-Encoding": "gzip;q=0, compress"})
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_streamed_response(self):
+        """It should compress a streamed response chunk by chunk"""
+        response = self.client.get("/stream", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", response.headers)
+        text = "".join(f"line {index}\n" for index in range(500))
+        self.assertEqual(zlib.decompress(response.get_data(), 31).decode(), text)
+
+    def test_etag(self):
+        """It should make the ETag of a compressed body weak"""
+        response = self.client.get("/tagged", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["ETag"], 'W/"abc"')
+
+    def test_preferred_encoding(self):
+        """It should prefer zstd and brotli when they are installed"""
+        with patch.object(compression, "brotli", object()), patch.object(compression, "zstandard", object()):
+            self.assertEqual(list(available_encoders()), ["zstd", "br", "gzip"])
+        self.assertEqual(gzip.decompress(compress(b"abc" * 100, "gzip", 9)), b"abc" * 100)
+
+    @skipIf(compression.brotli is None, "brotli is not installed")
+    def test_brotli(self):
+        """It should send brotli to clients that prefer it, streamed too"""
+        response = self.client.get("/large", headers={"Accept-Encoding": "gzip;q=0.5, br"})
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        self.assertEqual(compression.brotli.decompress(response.get_data()), jsonify_bytes())
+        response = self.client.get("/stream", headers={"Accept-Encoding": "br"})
+        text = "".join(f"line {index}\n" for index in range(500))
+        self.assertEqual(compression.brotli.decompress(response.get_data()).decode(), text)
+
+    @skipIf(compression.zstandard is None, "zstandard is not installed")
+    def test_zstd(self):
+        """It should send zstd to clients that accept it, streamed too"""
+        response = self.client.get("/large", headers={"Accept-Encoding": "gzip, br, zstd"})
+        self.assertEqual(response.headers["Content-Encoding"], "zstd")
+        decompressor = compression.zstandard.ZstdDecompressor()
+        self.assertEqual(decompressor.decompressobj().decompress(response.get_data()), jsonify_bytes())
+        response = self.client.get("/stream", headers={"Accept-Encoding": "zstd"})
+        text = "".join(f"line {index}\n" for index in range(500))
+        self.assertEqual(decompressor.decompressobj().decompress(response.get_data()).decode(), text)
+
+
+def jsonify_bytes() -> bytes:
+    """Returns the uncompressed body of /large"""
+    return make_app(init_compression, ROUTES, CONFIG).test_client().get("/large").get_data()
@@ -0,0 +1,162 @@
+"""
+Log Handler Tests
+"""
+
+import json
+import logging
+from unittest import TestCase
+from unittest.mock import patch
+from flask import Flask
+from service.common import tracing
+from service.common.log_handlers import JsonFormatter, SamplingFilter, init_logging, restart_logging
+from service.common.tracing import Span
+from tests.test_base import make_app
+
+
+class ListHandler(logging.Handler):
+    """Keeps the formatted lines"""
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+def init_test_logging(app) -> None:
+    """Sets up the logging of an app, with the server logger of these tests"""
+    init_logging(app, "tests.log_handlers")
+
+
+def server_handler() -> ListHandler:
+    """Returns a new handler that the lines of the server's logger end up in"""
+    handler = ListHandler()
+    server_logger = logging.getLogger("tests.log_handlers")
+    server_logger.handlers = [handler]
+    server_logger.setLevel(logging.INFO)
+    return handler
+
+
+class TestLogHandlers(TestCase):
+    """Log Handler Tests"""
+
+    def test_synchronous(self):
+        """It should write straight to the server's handlers without a queue"""
+        handler = server_handler()
+        app = make_app(init_test_logging, LOG_QUEUE=False)
+        self.assertEqual(app.logger.handlers, [handler])
+        app.logger.info("hello %s", "world")
+        self.assertIn("[INFO] [test_log_handlers] hello world", handler.lines[-1])
+
+    def test_queue(self):
+        """It should write the lines from the listener thread"""
+        handler = server_handler()
+        app = make_app(init_test_logging, LOG_QUEUE=True)
+        self.assertNotIn(handler, app.logger.handlers)
+        app.logger.info("hello %s", "world")
+        app.extensions["log_listener"].stop()
+        self.assertIn("[INFO] [test_log_handlers] hello world", handler.lines[-1])
+
+    def test_json(self):
+        """It should write one JSON object per line"""
+        handler = server_handler()
+        app = make_app(init_test_logging, LOG_QUEUE=False, LOG_FORMAT="json")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            app.logger.exception("failed %d", 42)
+        entry = json.loads(handler.lines[-1])
+        self.assertEqual(entry["level"], "ERROR")
+        self.assertEqual(entry["message"], "failed 42")
+        self.assertIn("ValueError: boom", entry["exception"])
+        self.assertIn("time", entry)
+
+    def test_json_queue(self):
+        """It should keep the exception when it goes through the queue"""
+        handler = server_handler()
+        app = make_app(init_test_logging, LOG_QUEUE=True, LOG_FORMAT="json")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            app.logger.exception("failed")
+        app.extensions["log_listener"].stop()
+        self.assertIn("ValueError: boom", json.loads(handler.lines[-1])["message"])
+
+    def test_sampling(self):
+        """It should drop sampled out lines and keep the other levels"""
+        handler = server_handler()
+        app = make_app(init_test_logging, LOG_QUEUE=False, LOG_SAMPLE_RATES={"info": 0.25})
+        handler.lines.clear()
+        with patch("service.common.log_handlers.random.random", side_effect=[0.1, 0.5]):
+            app.logger.info("kept")
+            app.logger.info("dropped")
+        app.logger.warning("always")
+        self.assertEqual([line.rsplit(" ", 1)[-1] for line in handler.lines], ["kept", "always"])
+        # the server's own lines are not sampled, however often it is set up
+        init_test_logging(app)
+        self.assertFalse(handler.filters)
+        self.assertEqual(len(app.logger.filters), 1)
+        with patch("service.common.log_handlers.random.random", return_value=0.9):
+            logging.getLogger("tests.log_handlers").info("server")
+        self.assertTrue(handler.lines[-1].endswith("server"))
+
+    def test_sampling_filter(self):
+        """It should keep every line of a level without a rate"""
+        sampler = SamplingFilter({"DEBUG": 0})
+        record = logging.LogRecord("test", logging.DEBUG, __file__, 1, "debug", None, None)
+        self.assertFalse(sampler.filter(record))
+        record.levelno = logging.ERROR
+        self.assertTrue(sampler.filter(record))
+
+    def test_init_twice(self):
+        """It should stop the listener of an earlier call"""
+        server_handler()
+        app = make_app(init_test_logging, LOG_QUEUE=True)
+        first = app.extensions["log_listener"]
+        init_test_logging(app)
+        self.assertIsNone(first._thread)
+        self.assertIsNot(app.extensions["log_listener"], first)
+        app.config["LOG_QUEUE"] = False
+        init_test_logging(app)
+        self.assertNotIn("log_listener", app.extensions)
+
+    def test_restart(self):
+        """It should start a new listener thread after a fork"""
+        handler = server_handler()
+        app = make_app(init_test_logging, LOG_QUEUE=True)
+        listener = app.extensions["log_listener"]
+        inherited = listener._thread
+        # a forked worker holds the master's thread, which is not running there
+        listener.stop()
+        listener._thread = inherited
+        restart_logging(app)
+        self.assertIsNot(listener._thread, inherited)
+        app.logger.info("after fork")
+        listener.stop()
+        self.assertTrue(handler.lines[-1].endswith("after fork"))
+        restart_logging(Flask(__name__))
+
+    def test_json_formatter(self):
+        """It should format a record without an exception"""
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "%s items", (3,), None)
+        self.assertEqual(json.loads(JsonFormatter().format(record))["message"], "3 items")
+
+    def test_trace_ids(self):
+        """It should add the trace id of the request to every line while tracing"""
+        handler = server_handler()
+        app = make_app(init_test_logging, LOG_QUEUE=False, TRACING_EXPORTER="stdout")
+        app.logger.info("outside")
+        self.assertIn("[-] outside", handler.lines[-1])
+        logging.getLogger("tests.log_handlers").info("server")
+        self.assertIn("[-] server", handler.lines[-1])
+        token = tracing._current.set(Span("test", "a" * 32, None, True, []))
+        try:
+            app.logger.info("inside")
+            self.assertIn(f"[{'a' * 32}] inside", handler.lines[-1])
+            app.config["LOG_FORMAT"] = "json"
+            init_test_logging(app)
+            app.logger.info("inside")
+            self.assertEqual(json.loads(handler.lines[-1])["trace_id"], "a" * 32)
+        finally:
+            tracing._current.reset(token)
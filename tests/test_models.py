@@ -5,10 +5,15 @@ Test cases for InventoryItem Model
 import os
 import logging
 from decimal import Decimal
+from unittest import TestCase
 from unittest.mock import patch
-from service.models import InventoryItem, DataValidationError
+from sqlalchemy import create_engine, inspect, text
+from service.models import (
+    InventoryItem, InventoryItemArchive, DataValidationError, InsufficientStockError, estimate_rows, item_validator,
+    forget_shards, locate_shard, record_shards, slot_totals, spread, upgrade_tables, use_primary, db
+)
 from tests.factories import InventoryItemFactory
-from tests.test_base import BaseTestCase
+from tests.test_base import QueryCounter, ReplicaTestCase, ShardedTestCase, TransactionalTestCase
 
 
 DATABASE_URI = os.getenv(
@@ -19,7 +24,8 @@ DATABASE_URI = os.getenv(
 ######################################################################
 #  I N V E N T O R Y   M O D E L   T E S T   C A S E S
 ######################################################################
-class TestInventoryItemModel(BaseTestCase):
+# pylint: disable=too-many-public-methods
+class TestInventoryItemModel(TransactionalTestCase):
     """Test Cases for InventoryItem Model"""
 
     ######################################################################
@@ -192,6 +198,70 @@ class TestInventoryItemModel(BaseTestCase):
         item = InventoryItem()
         self.assertRaises(DataValidationError, item.deserialize, data)
 
+    def test_deserialize_reports_every_bad_field(self):
+        """It should report every invalid field in one error"""
+        data = InventoryItemFactory().serialize()
+        data["quantity"] = "one hundred"
+        data["price"] = "ten dollars"
+        data["condition"] = "excellent"
+        del data["product_id"]
+        with self.assertRaises(DataValidationError) as context:
+            InventoryItem().deserialize(data)
+        message = str(context.exception)
+        self.assertIn("[quantity]", message)
+        self.assertIn("[price]", message)
+        self.assertIn("[condition]", message)
+        self.assertIn("missing product_id", message)
+
+    def test_validate_optional_fields(self):
+        """It should accept missing optional fields as None"""
+        data = {"name": "Widget", "quantity": 1, "price": "1.50", "product_id": 7}
+        cleaned = item_validator.validate(data)
+        self.assertEqual(cleaned["price"], Decimal("1.50"))
+        self.assertIsNone(cleaned["description"])
+        self.assertIsNone(cleaned["restock_level"])
+        self.assertIsNone(cleaned["condition"])
+
+    def test_validate_many(self):
+        """It should validate payloads in bulk and report the bad rows"""
+        rows = [item.serialize() for item in InventoryItemFactory.build_batch(3)]
+        rows[1]["price"] = None
+        rows.append("not a dictionary")
+        valid, rejected = item_validator.validate_many(rows)
+        self.assertEqual(len(valid), 2)
+        self.assertEqual([index for index, _ in rejected], [1, 3])
+        self.assertIn("[price]", rejected[0][1][0])
+        self.assertIn("bad or no data", rejected[1][1][0])
+
+    def test_bulk_load(self):
+        """It should bulk load new rows and replace rows with a known id"""
+        self.assertEqual(InventoryItem.bulk_load([]), 0)
+        item = InventoryItemFactory()
+        item.create()
+        rows = [item_validator.validate(data.serialize()) for data in InventoryItemFactory.build_batch(3)]
+        rows[0]["id"] = item.id
+        rows.append(dict(rows[0], name="Last one wins"))
+        self.assertEqual(InventoryItem.bulk_load(rows), 3)
+        self.assertEqual(len(InventoryItem.all()), 3)
+        self.assertEqual(InventoryItem.find(item.id).name, "Last one wins")
+
+    def test_bulk_load_unsupported_database(self):
+        """It should refuse to bulk load into a database other than PostgreSQL or SQLite"""
+        rows = [item_validator.validate(InventoryItemFactory().serialize())]
+        with patch.object(db.session, "get_bind") as get_bind:
+            get_bind.return_value.dialect.name = "mysql"
+            self.assertRaises(DataValidationError, InventoryItem.bulk_load, rows)
+
+    def test_remove_all(self):
+        """It should remove every Inventory Item and restart the ids"""
+        for item in InventoryItemFactory.create_batch(3):
+            item.create()
+        InventoryItem.remove_all()
+        self.assertEqual(InventoryItem.all(), [])
+        item = InventoryItemFactory()
+        item.create()
+        self.assertEqual(item.id, 1)
+
     def test_delete_an_inventory(self):
         """It should Delete an Inventory"""
         inventory = InventoryItemFactory()
@@ -201,6 +271,19 @@ class TestInventoryItemModel(BaseTestCase):
         inventory.delete()
         self.assertEqual(len(InventoryItem.all()), 0)
 
+    def test_delete_by_id(self):
+        """It should Delete an Inventory Item, its slots or its archived copy by id"""
+        hot, archived = InventoryItemFactory(quantity=4), InventoryItemFactory()
+        hot.create()
+        hot.split_quantity(2)
+        archived.create()
+        archived_id = archived.archive().id
+        hot_id = hot.id
+        self.assertTrue(InventoryItem.delete_by_id(hot_id))
+        self.assertTrue(InventoryItem.delete_by_id(archived_id))
+        self.assertFalse(InventoryItem.delete_by_id(hot_id))
+        self.assertEqual((InventoryItem.all(), InventoryItemArchive.all(), slot_totals()), ([], [], {}))
+
 
 ######################################################################
 #  T E S T   E X C E P T I O N   H A N D L E R S
@@ -229,6 +312,51 @@ class TestExceptionHandlers(TestInventoryItemModel):
         item = InventoryItemFactory()
         self.assertRaises(DataValidationError, item.delete)
 
+    @patch("service.models.db.session.commit")
+    def test_delete_by_id_exception(self, exception_mock):
+        """It should catch an exception deleting by id"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, InventoryItem.delete_by_id, 1)
+
+    @patch("service.models.db.session.commit")
+    def test_archive_exception(self, exception_mock):
+        """It should catch an archive exception"""
+        exception_mock.side_effect = Exception()
+        item = InventoryItemFactory()
+        self.assertRaises(DataValidationError, item.archive)
+
+    @patch("service.models.db.session.commit")
+    def test_delete_archived_exception(self, exception_mock):
+        """It should catch an exception deleting an archived item"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, InventoryItemArchive(name="x").delete)
+        self.assertRaises(DataValidationError, InventoryItemArchive(name="x").restore)
+
+    @patch("service.models.db.session.commit")
+    def test_decrement_and_split_exception(self, exception_mock):
+        """It should catch decrement and split exceptions"""
+        item = InventoryItemFactory(quantity=5)
+        item.create()
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, item.decrement)
+        self.assertRaises(DataValidationError, InventoryItem.decrement_by_id, item.id)
+        self.assertRaises(DataValidationError, item.split_quantity, 4)
+
+    @patch("service.models.db.session.commit")
+    def test_transfer_exception(self, exception_mock):
+        """It should catch a transfer exception"""
+        items = InventoryItemFactory.create_batch(2, quantity=5)
+        for item in items:
+            item.create()
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, InventoryItem.transfer, items[0].id, items[1].id, 1)
+
+    @patch("service.models.db.session.commit")
+    def test_remove_all_exception(self, exception_mock):
+        """It should catch a remove all exception"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, InventoryItem.remove_all)
+
 
 ######################################################################
 #  Q U E R Y   T E S T   C A S E S
@@ -256,6 +384,16 @@ class TestModelQueries(TestInventoryItemModel):
         self.assertEqual(item.restock_level, items[1].restock_level)
         self.assertEqual(item.condition, items[1].condition)
 
+    def test_find_many(self):
+        """It should Find several Inventory items by ID at once"""
+        items = InventoryItemFactory.create_batch(4)
+        for item in items:
+            item.create()
+        found = InventoryItem.find_many([items[2].id, items[0].id, 9999])
+        self.assertEqual([item.id for item in found], [items[0].id, items[2].id])
+        items[1].archive()
+        self.assertEqual([item.id for item in InventoryItemArchive.find_many([items[1].id])], [items[1].id])
+
     def test_find_by_name(self):
         """It should Find a InventoryItem by Name"""
         items = InventoryItemFactory.create_batch(10)
@@ -279,3 +417,472 @@ class TestModelQueries(TestInventoryItemModel):
         self.assertEqual(found.count(), count)
         for item in found:
             self.assertEqual(item.condition, condition)
+
+    def test_count(self):
+        """It should count the InventoryItems that match every filter"""
+        items = InventoryItemFactory.create_batch(10)
+        for item in items:
+            item.create()
+        name, condition = items[0].name, items[0].condition
+        self.assertEqual(InventoryItem.count(), 10)
+        self.assertEqual(InventoryItem.count(name=name), len([item for item in items if item.name == name]))
+        self.assertEqual(
+            InventoryItem.count(condition=condition), len([item for item in items if item.condition == condition])
+        )
+        both = [item for item in items if item.name == name and item.condition == condition]
+        self.assertEqual(InventoryItem.count(name=name, condition=condition), len(both))
+        self.assertEqual(InventoryItem.count(item_id=items[0].id), 1)
+        self.assertEqual(InventoryItem.count(item_id=0), 0)
+        # SQLite keeps no row estimates
+        self.assertIsNone(estimate_rows(InventoryItem))
+
+
+######################################################################
+#  A R C H I V E   T E S T   C A S E S
+######################################################################
+class TestInventoryItemArchive(TestInventoryItemModel):
+    """Archived Inventory Item Tests"""
+
+    def test_archive(self):
+        """It should move an Inventory Item into the archive"""
+        item = InventoryItemFactory()
+        item.create()
+        archived = item.archive()
+        self.assertEqual(archived.id, item.id)
+        self.assertEqual(archived.condition, "archived")
+        self.assertIsNotNone(archived.archived_at)
+        self.assertIsNone(InventoryItem.find(item.id))
+        self.assertEqual(InventoryItemArchive.find(item.id).name, item.name)
+        data = archived.serialize()
+        self.assertEqual(data["condition"], "archived")
+        self.assertIn("archived_at", data)
+
+    def test_restore(self):
+        """It should move an archived Item back into the inventory"""
+        item = InventoryItemFactory()
+        item.create()
+        restored = item.archive().restore()
+        self.assertEqual(restored.id, item.id)
+        self.assertEqual(restored.condition, "archived")
+        self.assertIsNone(InventoryItemArchive.find(item.id))
+        self.assertEqual(InventoryItem.find(item.id).name, item.name)
+
+    def test_archive_queries(self):
+        """It should list, find and delete archived items"""
+        items = InventoryItemFactory.create_batch(3, name="same")
+        for item in items:
+            item.create()
+        InventoryItemFactory().create()
+        archived = [item.archive() for item in reversed(items)]
+        self.assertEqual([item.id for item in InventoryItemArchive.all()], sorted(item.id for item in items))
+        self.assertEqual(len(InventoryItemArchive.find_by_name("same")), 3)
+        self.assertEqual(len(InventoryItem.all()), 1)
+        self.assertEqual(InventoryItemArchive.count(), 3)
+        self.assertEqual(InventoryItemArchive.count(name="same"), 3)
+        self.assertEqual(InventoryItemArchive.count(name="other"), 0)
+        archived[0].delete()
+        self.assertIsNone(InventoryItemArchive.find(archived[0].id))
+
+    def test_sweep(self):
+        """It should move items marked archived into the archive"""
+        item = InventoryItemFactory(condition="archived")
+        item.create()
+        InventoryItemFactory(condition="new").create()
+        self.assertEqual(InventoryItemArchive.sweep(), 1)
+        self.assertEqual(len(InventoryItem.all()), 1)
+        self.assertEqual([found.id for found in InventoryItemArchive.all()], [item.id])
+
+
+######################################################################
+#  T R A N S F E R   T E S T   C A S E S
+######################################################################
+class TestTransfer(TestInventoryItemModel):
+    """Stock Transfer Tests"""
+
+    def _create_pair(self) -> list:
+        """Creates two items with 5 units each and returns their ids"""
+        items = InventoryItemFactory.create_batch(2, quantity=5)
+        for item in items:
+            item.create()
+        return [item.id for item in items]
+
+    def test_transfer(self):
+        """It should move stock from one Inventory Item to another"""
+        ids = self._create_pair()
+        source, target = InventoryItem.transfer(ids[1], ids[0], 3)
+        self.assertEqual((source.id, source.quantity), (ids[1], 2))
+        self.assertEqual((target.id, target.quantity), (ids[0], 8))
+        db.session.expire_all()
+        self.assertEqual([InventoryItem.find(item_id).quantity for item_id in ids], [8, 2])
+
+    def test_transfer_insufficient_stock(self):
+        """It should not move more stock than the source has"""
+        ids = self._create_pair()
+        self.assertRaises(InsufficientStockError, InventoryItem.transfer, ids[0], ids[1], 6)
+        db.session.expire_all()
+        self.assertEqual([InventoryItem.find(item_id).quantity for item_id in ids], [5, 5])
+
+    def test_transfer_not_found(self):
+        """It should return None when an item does not exist"""
+        ids = self._create_pair()
+        self.assertIsNone(InventoryItem.transfer(ids[0], 9999, 1))
+
+    def test_transfer_invalid(self):
+        """It should reject transfers that make no sense"""
+        ids = self._create_pair()
+        for args in ((ids[0], ids[0], 1), (ids[0], ids[1], 0), (ids[0], ids[1], "1")):
+            self.assertRaises(DataValidationError, InventoryItem.transfer, *args)
+        InventoryItem.find(ids[0]).split_quantity(2)
+        self.assertRaises(DataValidationError, InventoryItem.transfer, ids[0], ids[1], 1)
+
+
+######################################################################
+#  H O T   I T E M   T E S T   C A S E S
+######################################################################
+class TestHotItems(TestInventoryItemModel):
+    """Hot Item Counter Tests"""
+
+    def test_spread(self):
+        """It should split a quantity into near equal parts"""
+        self.assertEqual(spread(10, 4), [3, 3, 2, 2])
+        self.assertEqual(spread(2, 4), [1, 1, 0, 0])
+
+    def test_decrement(self):
+        """It should decrement an Inventory Item but never below zero"""
+        item = InventoryItemFactory(quantity=1)
+        item.create()
+        self.assertTrue(item.decrement())
+        self.assertEqual(item.quantity, 0)
+        self.assertFalse(item.decrement())
+        self.assertEqual(InventoryItem.find(item.id).quantity, 0)
+
+    def test_decrement_by_id(self):
+        """It should decrement an item by id with one statement while it is in stock"""
+        item = InventoryItemFactory(quantity=1)
+        item.create()
+        item_id = item.id
+        with QueryCounter() as counter:
+            decremented = InventoryItem.decrement_by_id(item_id)
+            self.assertEqual((decremented.id, decremented.name, decremented.quantity), (item_id, item.name, 0))
+        self.assertEqual(len(counter.statements), 1, counter.statements)
+        self.assertEqual(InventoryItem.decrement_by_id(item.id).quantity, 0)
+        self.assertIsNone(InventoryItem.decrement_by_id(0))
+
+    def test_hot_items_only(self):
+        """It should only look for slots of the items that have them"""
+        items = InventoryItemFactory.create_batch(2, quantity=5)
+        for item in items:
+            item.create()
+        items[1].split_quantity(2)
+        self.assertEqual([item.slots for item in items], [0, 2])
+        with QueryCounter() as counter:
+            found = InventoryItem.with_slot_quantities(items[:1])
+        self.assertEqual((found, counter.statements), (items[:1], []))
+        with QueryCounter() as counter:
+            self.assertEqual(InventoryItem.decrement_by_id(items[1].id).quantity, 4)
+        self.assertTrue(any("inventory_item_slot" in statement for statement in counter.statements))
+        self.assertEqual(slot_totals(), {items[1].id: 4})
+        items[1].split_quantity(1)
+        self.assertEqual(items[1].slots, 0)
+
+    def test_split_quantity(self):
+        """It should decrement the slots of a hot item and add them up on reads"""
+        item = InventoryItemFactory(quantity=3)
+        item.create()
+        item.split_quantity(4)
+        self.assertEqual(slot_totals(), {item.id: 3})
+        for remaining in (2, 1, 0):
+            self.assertTrue(item.decrement())
+            self.assertEqual(item.quantity, remaining)
+        self.assertFalse(item.decrement())
+        item.quantity = 8
+        item.update()
+        self.assertEqual(slot_totals([item.id]), {item.id: 8})
+        self.assertTrue(item.decrement())
+        found = InventoryItem.with_slot_quantities(InventoryItem.all())
+        self.assertEqual(found[0].quantity, 7)
+        item.split_quantity(1)
+        self.assertEqual(slot_totals(), {})
+        self.assertEqual(InventoryItem.find(item.id).quantity, 7)
+
+    def test_hot_item_archive_and_delete(self):
+        """It should fold the slots into an archived item and remove them with a deleted one"""
+        items = InventoryItemFactory.create_batch(2, quantity=6)
+        for item in items:
+            item.create()
+            item.split_quantity(3)
+            item.decrement()
+        self.assertEqual(items[0].archive().quantity, 5)
+        items[1].delete()
+        self.assertEqual(slot_totals(), {})
+
+
+######################################################################
+#  U P G R A D E   T E S T   C A S E S
+######################################################################
+class TestUpgradeTables(TestCase):
+    """Upgrades of databases created by older versions"""
+
+    def test_upgrade_old_tables(self):
+        """It should add the slots column, the indexes and AUTOINCREMENT to an old database"""
+        for primary_key in ("INTEGER PRIMARY KEY", "INTEGER PRIMARY KEY AUTOINCREMENT"):
+            with self.subTest(primary_key=primary_key):
+                self.assert_upgraded(primary_key)
+
+    def assert_upgraded(self, primary_key: str):
+        """Upgrades an old database whose items have the given primary key"""
+        engine = create_engine("sqlite://")
+        with engine.begin() as connection:
+            connection.execute(text(
+                f"CREATE TABLE inventory_item (id {primary_key}, name VARCHAR(63) NOT NULL, "
+                "description VARCHAR(255), quantity INTEGER NOT NULL, price NUMERIC(8, 2) NOT NULL, "
+                "product_id INTEGER NOT NULL, restock_level INTEGER, condition VARCHAR(15))"
+            ))
+            connection.execute(text(
+                "INSERT INTO inventory_item (id, name, quantity, price, product_id, condition) "
+                "VALUES (3, 'old', 5, 1.50, 1, 'new')"
+            ))
+            InventoryItemArchive.__table__.create(connection)
+            connection.execute(text(
+                "INSERT INTO inventory_item_archive (id, name, quantity, price, product_id, condition, archived_at) "
+                "VALUES (7, 'gone', 1, 1.00, 1, 'archived', '2024-01-01 00:00:00')"
+            ))
+
+        upgrade_tables(engine)
+        upgrade_tables(engine)  # and nothing more the second time
+
+        with engine.begin() as connection:
+            connection.execute(text(
+                "INSERT INTO inventory_item (name, quantity, price, product_id) VALUES ('new', 1, 1.00, 1)"
+            ))
+            inspector = inspect(connection)
+            self.assertIn("slots", [column["name"] for column in inspector.get_columns("inventory_item")])
+            self.assertEqual(
+                sorted(index["name"] for index in inspector.get_indexes("inventory_item")),
+                ["ix_inventory_item_condition", "ix_inventory_item_name"],
+            )
+            row = connection.execute(text("SELECT name, quantity, slots FROM inventory_item WHERE id = 3")).one()
+            self.assertEqual(tuple(row), ("old", 5, 0))
+            self.assertIn("AUTOINCREMENT", connection.execute(
+                text("SELECT sql FROM sqlite_master WHERE name = 'inventory_item'")
+            ).scalar())
+            if primary_key == "INTEGER PRIMARY KEY":
+                # the rebuilt table hands out ids above the archived ones
+                self.assertEqual(connection.execute(text("SELECT max(id) FROM inventory_item")).scalar(), 8)
+
+
+######################################################################
+#  R E A D   R E P L I C A   T E S T   C A S E S
+######################################################################
+class TestReplicaRouting(ReplicaTestCase):
+    """Read Replica Routing Tests"""
+
+    def test_reads_go_to_replica(self):
+        """It should read Inventory Items from the replica"""
+        item = InventoryItemFactory(id=1000)
+        self.add_to_replica(item)
+        self.assertEqual([found.id for found in InventoryItem.all()], [item.id])
+        self.assertEqual(InventoryItem.find(item.id).name, item.name)
+        self.assertEqual(InventoryItem.find_by_name(item.name).count(), 1)
+
+    def test_reads_after_write_go_to_primary(self):
+        """It should read from the primary once the session has written"""
+        self.add_to_replica(InventoryItemFactory(id=1000))
+        item = InventoryItemFactory()
+        item.create()
+        self.assertEqual([found.id for found in InventoryItem.all()], [item.id])
+
+    def test_use_primary(self):
+        """It should read from the primary when asked to"""
+        self.add_to_replica(InventoryItemFactory(id=1000))
+        use_primary()
+        self.assertEqual(InventoryItem.all(), [])
+
+
+######################################################################
+#  S H A R D I N G   T E S T   C A S E S
+######################################################################
+class TestSharding(ShardedTestCase):
+    """Sharded Inventory Item Tests"""
+
+    def test_create_routes_by_product_id(self):
+        """It should store an Inventory Item on the shard of its product"""
+        even = InventoryItemFactory(product_id=2)
+        even.create()
+        odd = InventoryItemFactory(product_id=3)
+        odd.create()
+        self.assertEqual((even.id, odd.id), (1, 2))
+        self.assertEqual(self.ids_on(0), [1])
+        self.assertEqual(self.ids_on(1), [2])
+        with db.engine.connect() as connection:  # nothing on the primary
+            self.assertEqual(connection.execute(InventoryItem.__table__.select()).all(), [])
+
+    def test_reads_fan_out(self):
+        """It should merge the Inventory Items of every shard in id order"""
+        for product_id in (1, 2, 3, 4):
+            InventoryItemFactory(product_id=product_id, name="same", condition="used").create()
+        db.session.remove()
+        self.assertEqual([item.id for item in InventoryItem.all()], [1, 2, 3, 4])
+        self.assertEqual(len(InventoryItem.find_by_name("same")), 4)
+        self.assertEqual(len(InventoryItem.find_by_condition("used")), 4)
+        self.assertEqual(InventoryItem.count(), 4)
+        self.assertEqual(InventoryItem.count(name="same", condition="used"), 4)
+        self.assertEqual(InventoryItemArchive.count(), 0)
+        self.assertIsNone(estimate_rows(InventoryItem))
+        self.assertEqual([row["id"] for row in InventoryItem.export_rows()], [1, 2, 3, 4])
+
+    def test_find_many(self):
+        """It should find Inventory Items by id on every shard"""
+        for product_id in (1, 2, 3):
+            InventoryItemFactory(product_id=product_id).create()
+        db.session.remove()
+        self.assertEqual([item.id for item in InventoryItem.find_many([3, 1, 2, 42])], [1, 2, 3])
+        self.assertEqual(InventoryItemArchive.find_many([1]), [])
+
+    def test_find_update_delete(self):
+        """It should find, update and delete an Inventory Item on its shard"""
+        InventoryItemFactory(product_id=2).create()
+        db.session.remove()
+        self.assertIsNone(InventoryItem.find(42))
+        with QueryCounter() as counter:
+            item = InventoryItem.find(1)
+        # the directory on the primary, then the item's own shard only
+        self.assertEqual(len(counter.statements), 2)
+        self.assertIn("inventory_item_shard", counter.statements[0])
+        item.quantity = 999
+        item.update()
+        db.session.remove()
+        self.assertEqual(InventoryItem.find(1).quantity, 999)
+        InventoryItem.find(1).delete()
+        self.assertEqual(self.ids_on(0), [])
+        self.assertIsNone(locate_shard(1))
+
+    def test_delete_by_id(self):
+        """It should Delete an Inventory Item or its archived copy on its shard by id"""
+        for product_id in (2, 3):
+            InventoryItemFactory(product_id=product_id).create()
+        db.session.remove()
+        InventoryItem.find(2).archive()
+        db.session.remove()
+        self.assertTrue(InventoryItem.delete_by_id(1))
+        db.session.remove()
+        self.assertTrue(InventoryItem.delete_by_id(2))
+        db.session.remove()
+        self.assertFalse(InventoryItem.delete_by_id(1))
+        self.assertEqual((self.ids_on(0), self.ids_on(1), InventoryItemArchive.find(2)), ([], [], None))
+        self.assertEqual((locate_shard(1), locate_shard(2)), (None, None))
+
+    def test_hot_item_moves_with_its_slots(self):
+        """It should keep the slots of a hot item on the shard of its product"""
+        for product_id in (2, 3):
+            InventoryItemFactory(product_id=product_id, quantity=4).create()
+        db.session.remove()
+        InventoryItem.find(1).split_quantity(2)
+        db.session.remove()
+        item = InventoryItem.find(1)
+        item.product_id = 5
+        item.update()
+        db.session.remove()
+        self.assertEqual(slot_totals(), {1: 4})
+        item = InventoryItem.find(1)
+        self.assertTrue(item.decrement())
+        self.assertEqual(item.quantity, 3)
+        self.assertEqual((InventoryItem.decrement_by_id(1).quantity, InventoryItem.decrement_by_id(2).quantity), (2, 3))
+        self.assertIsNone(InventoryItem.decrement_by_id(3))
+
+    def test_transfer(self):
+        """It should only transfer stock between items on the same shard"""
+        for product_id in (2, 4, 3):
+            InventoryItemFactory(product_id=product_id, quantity=5).create()
+        db.session.remove()
+        source, target = InventoryItem.transfer(1, 2, 5)
+        self.assertEqual((source.quantity, target.quantity), (0, 10))
+        db.session.remove()
+        self.assertRaises(DataValidationError, InventoryItem.transfer, 2, 3, 1)
+        db.session.remove()
+        self.assertIsNone(InventoryItem.transfer(1, 42, 1))
+
+    def test_update_moves_item(self):
+        """It should move an Inventory Item when its product_id changes shard"""
+        InventoryItemFactory(product_id=2).create()
+        db.session.remove()
+        item = InventoryItem.find(1)
+        item.product_id = 5
+        item.update()
+        self.assertEqual(self.ids_on(0), [])
+        self.assertEqual(self.ids_on(1), [1])
+        self.assertEqual(locate_shard(1), "shard_1")
+        db.session.remove()
+        self.assertEqual(InventoryItem.find(1).product_id, 5)
+
+    def test_update_finds_item_by_id(self):
+        """It should update an Inventory Item on the shard the directory has it on"""
+        item = InventoryItemFactory(id=1, product_id=3, quantity=5)
+        # on the first shard though its product_id maps to the second, as before a rebalance
+        with self.shards[0].begin() as connection:
+            connection.execute(InventoryItem.__table__.insert(), item.serialize())
+        record_shards({1: "shard_0"})
+        item = InventoryItem.find(1)
+        item.quantity = 7
+        item.update()
+        db.session.remove()
+        self.assertEqual(InventoryItem.find(1).quantity, 7)
+        # and moved to the shard of its product_id on the way
+        self.assertEqual(self.ids_on(1), [1])
+
+        # one the directory does not know is where its product_id puts it
+        item = InventoryItem.find(1)
+        forget_shards([1])
+        item.quantity = 8
+        item.update()
+        record_shards({1: "shard_1"})
+        db.session.remove()
+        self.assertEqual(InventoryItem.find(1).quantity, 8)
+
+    def test_bulk_load(self):
+        """It should load rows onto their shards and keep ids unique"""
+        rows = [item_validator.validate(item.serialize()) for item in InventoryItemFactory.build_batch(4)]
+        for product_id, row in enumerate(rows):
+            row["product_id"] = product_id
+        rows[0]["id"] = 10
+        self.assertEqual(InventoryItem.bulk_load(rows), 4)
+        self.assertEqual(self.ids_on(0), [10, 12])
+        self.assertEqual(self.ids_on(1), [11, 13])
+        # reloading a row with another product moves it
+        rows[0]["product_id"] = 1
+        InventoryItem.bulk_load(rows[:1])
+        self.assertEqual(self.ids_on(0), [12])
+        self.assertEqual(self.ids_on(1), [10, 11, 13])
+        item = InventoryItemFactory(product_id=0)
+        item.create()
+        self.assertEqual(item.id, 14)
+
+    def test_archive(self):
+        """It should archive an Inventory Item on its own shard"""
+        InventoryItemFactory(product_id=1).create()
+        InventoryItemFactory(product_id=2).create()
+        db.session.remove()
+        InventoryItem.find(1).archive()
+        db.session.remove()
+        self.assertEqual(self.ids_on(1), [])
+        self.assertEqual([item.id for item in InventoryItemArchive.all()], [1])
+        self.assertEqual(InventoryItemArchive.find(1).product_id, 1)
+        self.assertIsNone(InventoryItemArchive.find(2))
+        self.assertEqual(len(InventoryItemArchive.find_by_name(InventoryItemArchive.find(1).name)), 1)
+        InventoryItemFactory(product_id=3, condition="archived").create()
+        self.assertEqual(InventoryItemArchive.sweep(), 1)
+        db.session.remove()
+        InventoryItemArchive.find(1).restore()
+        db.session.remove()
+        self.assertEqual(self.ids_on(1), [1])
+        self.assertEqual(InventoryItem.find(1).product_id, 1)
+
+    def test_remove_all(self):
+        """It should empty every shard and restart the ids"""
+        InventoryItemFactory(product_id=1).create()
+        InventoryItemFactory(product_id=2).create()
+        InventoryItem.remove_all()
+        self.assertEqual(self.ids_on(0) + self.ids_on(1), [])
+        item = InventoryItemFactory()
+        item.create()
+        self.assertEqual(item.id, 1)
@@ -0,0 +1,55 @@
+"""
+OpenAPI Specification Tests
+"""
+
+import json
+from unittest import TestCase
+from unittest.mock import MagicMock
+from flask import Flask
+from wsgi import app
+from service import api
+from service.common import status
+from service.common.openapi import OPENAPI_MAX_AGE, init_openapi
+
+SPEC_URL = "/api/swagger.json"
+
+
+class TestOpenAPI(TestCase):
+    """OpenAPI Specification Tests"""
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_spec(self):
+        """It should serve the prebuilt spec with an ETag and a long max-age"""
+        resp = self.client.get(SPEC_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/json")
+        self.assertEqual(resp.headers["ETag"], f'"{app.extensions["openapi"].etag}"')
+        self.assertEqual(resp.headers["Cache-Control"], f"public, max-age={OPENAPI_MAX_AGE}")
+        data = resp.get_json()
+        self.assertIn("/inventory/{item_id}", data["paths"])
+        self.assertIn("InventoryItem", data["definitions"])
+        with app.test_request_context("/"):
+            self.assertEqual(data, json.loads(json.dumps(api.__schema__)))
+
+    def test_not_modified(self):
+        """It should answer 304 without a body when the client has the spec"""
+        etag = self.client.get(SPEC_URL).headers["ETag"]
+        resp = self.client.get(SPEC_URL, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.get_data(), b"")
+
+    def test_docs(self):
+        """It should still serve the Swagger UI"""
+        resp = self.client.get("/apidocs/")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_schema_error(self):
+        """It should leave the flask-restx view alone when the spec cannot be built"""
+        broken = MagicMock()
+        broken.__schema__ = {"error": "Unable to render schema"}
+        tiny = Flask(__name__)
+        init_openapi(tiny, broken)
+        self.assertNotIn("openapi", tiny.extensions)
+        broken.endpoint.assert_not_called()
@@ -0,0 +1,125 @@
+"""
+Request Profiling Tests
+"""
+
+import os
+import time
+import pstats
+import marshal
+import tempfile
+from unittest import TestCase
+from service.common import status
+from service.common.profiling import SamplingProfiler, init_profiling
+from tests.test_base import make_app
+
+TOKEN = "let-me-profile"
+
+
+def busy(seconds: float = 0.03) -> dict:
+    """Keeps the request thread busy for a while"""
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+    return {"status": "OK"}
+
+
+CONFIG = {"PROFILING_TOKEN": TOKEN, "PROFILING_DIR": "", "PROFILING_INTERVAL_MS": 1}
+
+ROUTES = [("/busy", "busy", busy), ("/broken", "broken", lambda: 1 / 0)]
+
+
+class TestProfiling(TestCase):
+    """Request Profiling Tests"""
+
+    def setUp(self):
+        self.app = make_app(init_profiling, ROUTES, CONFIG)
+        self.client = self.app.test_client()
+
+    def test_not_profiled(self):
+        """It should answer as usual without the right token"""
+        for headers in ({}, {"X-Profile": "guess"}):
+            resp = self.client.get("/busy", headers=headers)
+            self.assertEqual(resp.get_json(), {"status": "OK"})
+        resp = self.client.get(f"/busy?profile={TOKEN}")
+        self.assertEqual(resp.get_json(), {"status": "OK"})
+
+    def test_disabled(self):
+        """It should not profile without a token configured"""
+        app = make_app(init_profiling, ROUTES, CONFIG, PROFILING_TOKEN="")
+        self.assertNotIn("profiling", app.extensions)
+        resp = app.test_client().get("/busy", headers={"X-Profile": ""})
+        self.assertEqual(resp.get_json(), {"status": "OK"})
+
+    def test_sample(self):
+        """It should return the collapsed stacks of the request"""
+        resp = self.client.get("/busy", headers={"X-Profile": TOKEN})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "text/plain")
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertTrue(lines)
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertGreater(int(count), 0)
+        self.assertIn("busy (test_profiling.py:", stack)
+
+    def test_cprofile(self):
+        """It should return the pstats of the request"""
+        resp = self.client.get("/busy?profile_mode=cprofile", headers={"X-Profile": TOKEN})
+        self.assertEqual(resp.mimetype, "application/octet-stream")
+        with tempfile.NamedTemporaryFile(suffix=".prof") as prof:
+            prof.write(resp.get_data())
+            prof.flush()
+            functions = {name for _, _, name in pstats.Stats(prof.name).stats}
+        self.assertIn("busy", functions)
+        self.assertTrue(marshal.loads(resp.get_data()))
+
+    def test_store(self):
+        """It should write the profile to PROFILING_DIR"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = make_app(init_profiling, ROUTES, CONFIG, PROFILING_DIR=tmpdir).test_client()
+            resp = client.get("/busy", headers={"X-Profile": TOKEN, "X-Profile-Mode": "cprofile"})
+            self.assertEqual(resp.get_json(), {"status": "OK"})
+            name = resp.headers["X-Profile-File"]
+            self.assertTrue(name.endswith("-busy.prof"))
+            self.assertTrue(os.path.getsize(os.path.join(tmpdir, name)))
+
+    def test_one_at_a_time(self):
+        """It should not profile a request while another one is, or in an unknown mode"""
+        lock = self.app.extensions["profiling"]
+        with lock:
+            resp = self.client.get("/busy", headers={"X-Profile": TOKEN})
+        self.assertEqual(resp.get_json(), {"status": "OK"})
+        resp = self.client.get("/busy", headers={"X-Profile": TOKEN, "X-Profile-Mode": "strace"})
+        self.assertEqual(resp.get_json(), {"status": "OK"})
+        self.assertFalse(lock.locked())
+
+    def test_error(self):
+        """It should profile a request that failed, and be free for the next one"""
+        resp = self.client.get("/broken", headers={"X-Profile": TOKEN, "X-Profile-Mode": "cprofile"})
+        self.assertEqual(resp.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(resp.mimetype, "application/octet-stream")
+        self.assertFalse(self.app.extensions["profiling"].locked())
+
+    def test_abandoned(self):
+        """It should stop a profiler when the response was never finished"""
+        with self.app.test_request_context("/busy", headers={"X-Profile": TOKEN}):
+            self.app.preprocess_request()
+            self.assertTrue(self.app.extensions["profiling"].locked())
+            self.app.do_teardown_request()
+        self.assertFalse(self.app.extensions["profiling"].locked())
+
+
+class TestSamplingProfiler(TestCase):
+    """Sampling Profiler Tests"""
+
+    def test_other_thread(self):
+        """It should sample a thread other than its own"""
+        profiler = SamplingProfiler(0.001)
+        profiler.start()
+        busy(0.02)
+        profiler.stop()
+        self.assertIn("busy", profiler.collapsed())
+        idle = SamplingProfiler(0.001, thread_id=-1)
+        idle.start()
+        time.sleep(0.01)
+        idle.stop()
+        self.assertEqual(idle.collapsed(), "")
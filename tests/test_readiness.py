@@ -0,0 +1,116 @@
+"""
+Readiness Probe Tests
+"""
+
+import threading
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from wsgi import app
+from service.common import status
+from service.common.readiness import DEGRADED, FAIL, OK, Readiness, pool_usage
+from service.models import db
+from tests.test_base import BaseTestCase
+
+
+class FakeClock:  # pylint: disable=too-few-public-methods
+    """A clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPoolUsage(TestCase):
+    """Pool Usage Tests"""
+
+    def test_queue_pool(self):
+        """It should count the overflow in the capacity"""
+        engine = MagicMock()
+        engine.pool.checkedout.return_value = 3
+        engine.pool.size.return_value = 5
+        engine.pool._max_overflow = 10
+        self.assertEqual(pool_usage(engine), (3, 15))
+
+    def test_unbounded_pool(self):
+        """It should have no capacity without an overflow limit"""
+        engine = MagicMock()
+        engine.pool.checkedout.return_value = 3
+        engine.pool._max_overflow = -1
+        self.assertEqual(pool_usage(engine), (3, None))
+        engine.pool = object()
+        self.assertEqual(pool_usage(engine), (0, None))
+
+
+class TestReadiness(BaseTestCase):
+    """Readiness Probe Tests"""
+
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        self.readiness = Readiness(app, 0.5, 2, clock=self.clock)
+
+    def test_ready(self):
+        """It should be ready when the database answers"""
+        resp = self.client.get("/ready")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["status"], OK)
+        self.assertIn("primary", data["databases"])
+        self.assertEqual(data["pools"]["primary"]["status"], OK)
+
+    def test_cached(self):
+        """It should check the database at most once per interval"""
+        with patch("service.common.readiness.ping", return_value={"primary": 1.0}) as ping_mock:
+            self.assertEqual(self.readiness.status()["status"], OK)
+            self.clock.now = 1.9
+            self.readiness.status()
+            self.assertEqual(ping_mock.call_count, 1)
+            self.clock.now = 2.0
+            self.readiness.status()
+            self.assertEqual(ping_mock.call_count, 2)
+
+    def test_pool_exhausted(self):
+        """It should be degraded, without asking the database, when the pool is exhausted"""
+        with patch("service.common.readiness.pool_usage", return_value=(15, 15)), \
+                patch("service.common.readiness.ping") as ping_mock:
+            result = self.readiness.status()
+        self.assertEqual(result["status"], DEGRADED)
+        self.assertEqual(result["pools"]["primary"], {"status": DEGRADED, "checked_out": 15, "capacity": 15})
+        ping_mock.assert_not_called()
+
+    def test_not_ready(self):
+        """It should answer 503 when not ready"""
+        with patch.object(Readiness, "status", return_value={"status": DEGRADED}):
+            resp = self.client.get("/ready")
+        self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_database_error(self):
+        """It should fail when the database refuses"""
+        with patch("service.common.readiness.ping", side_effect=Exception("connection refused")):
+            result = self.readiness.status()
+        self.assertEqual(result["status"], FAIL)
+        self.assertEqual(result["message"], "connection refused")
+
+    def test_timeout(self):
+        """It should fail in time when the database hangs, and not ask again while it does"""
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.readiness.timeout = 0.01
+        with patch("service.common.readiness.ping", side_effect=lambda engines: release.wait()) as ping_mock:
+            result = self.readiness.status()
+            self.assertEqual(result["status"], FAIL)
+            self.assertIn("in time", result["message"])
+            self.clock.now = 5
+            result = self.readiness.status()
+            self.assertEqual(result["status"], FAIL)
+            self.assertIn("not finished", result["message"])
+            self.assertEqual(ping_mock.call_count, 1)
+
+    def test_shards(self):
+        """It should check every database"""
+        engines = {None: db.engines[None], "shard_1": db.engines[None]}
+        with patch.object(type(db), "engines", new=engines):
+            result = self.readiness.status()
+        self.assertEqual(sorted(result["databases"]), ["primary", "shard_1"])
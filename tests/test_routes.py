@@ -4,13 +4,15 @@ TestInventoryItem API Service Test Suite
 
 import os
 import logging
+from unittest.mock import patch
 from decimal import Decimal
 from urllib.parse import quote_plus
 
 from service.common import status
-from service.routes import validate_decimal
+from service.models import InventoryItem, InventoryItemArchive, db
+from service.routes import PRIMARY_COOKIE
 
-from tests.test_base import BaseTestCase
+from tests.test_base import QueryBudgetMixin, ReplicaTestCase, ShardedTestCase, TransactionalTestCase
 from .factories import InventoryItemFactory
 
 
@@ -25,7 +27,7 @@ BASE_URL = "/api/inventory"
 #  T E S T   C A S E S
 ######################################################################
 # pylint: disable=too-many-public-methods
-class TestInventoryItemService(BaseTestCase):
+class TestInventoryItemService(TransactionalTestCase):
     """REST API Server Tests"""
 
     ############################################################
@@ -51,6 +53,19 @@ class TestInventoryItemService(BaseTestCase):
     #  T E S T   C A S E S
     ######################################################################
 
+    def test_metrics(self):
+        """It should count the reads that ran in this worker"""
+        item = self._create_items(1)[0]
+        before = self.client.get("/metrics").get_json()["coalescing"].get("get_item", {"executions": 0})
+        self.client.get(f"{BASE_URL}/{item.id}")
+        self.client.get(f"{BASE_URL}/{item.id}")
+        self.client.get(BASE_URL, query_string={"name": item.name})
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stats = response.get_json()["coalescing"]
+        self.assertEqual(stats["get_item"]["executions"], before["executions"] + 2)
+        self.assertIn("list_items", stats)
+
     def test_health_check(self):
         """It should return 200 OK with the correct JSON response"""
         response = self.client.get("/health")
@@ -59,24 +74,6 @@ class TestInventoryItemService(BaseTestCase):
         # Assert that the response JSON is {"status": "OK"}
         self.assertEqual(response.json, {"status": "OK"})
 
-    def test_valid_decimal(self):
-        """It should pass for valid decimal strings"""
-        try:
-            validate_decimal("123.45")
-            validate_decimal("0.001")
-            validate_decimal("-123.45")
-        except ValueError:
-            self.fail("validate_decimal() raised ValueError unexpectedly!")
-
-    def test_invalid_decimal(self):
-        """It should raise ValueError for invalid decimal strings"""
-        with self.assertRaises(ValueError):
-            validate_decimal("abc")
-        with self.assertRaises(ValueError):
-            validate_decimal("123.45.67")
-        with self.assertRaises(ValueError):
-            validate_decimal("")
-
     # ----------------------------------------------------------
     # TEST CREATE
     # ----------------------------------------------------------
@@ -233,6 +230,21 @@ class TestInventoryItemService(BaseTestCase):
         data = response.get_json()
         self.assertEqual(data["quantity"], 0)
 
+    def test_decrement_hot_item(self):
+        """It should decrement a hot item and report the total of its slots"""
+        item = self._create_items(1)[0]
+        data = self.client.get(f"{BASE_URL}/{item.id}").get_json()
+        data["quantity"] = 10
+        self.client.put(f"{BASE_URL}/{item.id}", json=data)
+        InventoryItem.find(item.id).split_quantity(4)
+        response = self.client.put(f"{BASE_URL}/{item.id}/decrement")
+        self.assertEqual(response.get_json()["quantity"], 9)
+        self.assertEqual(self.client.get(f"{BASE_URL}/{item.id}").get_json()["quantity"], 9)
+        self.assertEqual(self.client.get(BASE_URL).get_json()[0]["quantity"], 9)
+        data["quantity"] = 20
+        self.assertEqual(self.client.put(f"{BASE_URL}/{item.id}", json=data).get_json()["quantity"], 20)
+        self.assertEqual(self.client.put(f"{BASE_URL}/{item.id}/decrement").get_json()["quantity"], 19)
+
     def test_item_not_found(self):
         """It should return 404 Not Found when the item does not exist"""
         non_existent_id = 99999  # Assuming this ID does not exist in your test database
@@ -279,6 +291,126 @@ class TestInventoryItemService(BaseTestCase):
         data = response.get_json()
         self.assertIn("Item is already archived", data["message"])
 
+    def test_archived_items_leave_the_list(self):
+        """It should only list archived Items when asked to"""
+        items = self._create_items(3)
+        self.client.put(f"{BASE_URL}/{items[0].id}/archive")
+
+        response = self.client.get(BASE_URL)
+        self.assertEqual([item["id"] for item in response.get_json()], [item.id for item in items[1:]])
+        response = self.client.get(BASE_URL, query_string="include_archived=true")
+        self.assertEqual([item["id"] for item in response.get_json()], [item.id for item in items])
+        response = self.client.get(BASE_URL, query_string="condition=archived")
+        self.assertEqual([item["id"] for item in response.get_json()], [items[0].id])
+        response = self.client.get(BASE_URL, query_string=f"name={items[0].name}&include_archived=true")
+        self.assertIn(items[0].id, [item["id"] for item in response.get_json()])
+
+    def test_write_archived_condition(self):
+        """It should archive Items created or updated with the archived condition"""
+        item = InventoryItemFactory()
+        response = self.client.post(BASE_URL, json=dict(item.serialize(), condition="archived"))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        created = response.get_json()
+        self.assertEqual(created["condition"], "archived")
+        updated = self._create_items(1)[0]
+        response = self.client.put(f"{BASE_URL}/{updated.id}", json=dict(updated.serialize(), condition="archived"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["condition"], "archived")
+
+        # neither is left in the default list, both are in the archive
+        self.assertEqual(self.client.get(BASE_URL).get_json(), [])
+        self.assertIsNotNone(InventoryItemArchive.find(created["id"]))
+        self.assertIsNotNone(InventoryItemArchive.find(updated.id))
+
+    def test_update_archived_item(self):
+        """It should move an archived Item back into the inventory when it is updated"""
+        item = self._create_items(1)[0]
+        self.client.put(f"{BASE_URL}/{item.id}/archive")
+        response = self.client.put(f"{BASE_URL}/{item.id}", json=dict(item.serialize(), condition="used", quantity=5))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["condition"], "used")
+        self.assertEqual([data["id"] for data in self.client.get(BASE_URL).get_json()], [item.id])
+        self.assertIsNone(InventoryItemArchive.find(item.id))
+        response = self.client.put(f"{BASE_URL}/{item.id}/decrement")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # an update that keeps it archived leaves it in the archive
+        self.client.put(f"{BASE_URL}/{item.id}/archive")
+        response = self.client.put(f"{BASE_URL}/{item.id}", json=dict(item.serialize(), condition="archived", quantity=3))
+        self.assertEqual(response.get_json()["quantity"], 3)
+        self.assertEqual(InventoryItemArchive.find(item.id).quantity, 3)
+        self.assertEqual(self.client.get(BASE_URL).get_json(), [])
+        response = self.client.put(f"{BASE_URL}/0", json=item.serialize())
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_and_delete_archived_item(self):
+        """It should Read and Delete an archived Item"""
+        item = self._create_items(1)[0]
+        self.client.put(f"{BASE_URL}/{item.id}/archive")
+        response = self.client.get(f"{BASE_URL}/{item.id}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["condition"], "archived")
+        response = self.client.delete(f"{BASE_URL}/{item.id}")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.get(f"{BASE_URL}/{item.id}")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    # ----------------------------------------------------------
+    # TEST TRANSFER
+    # ----------------------------------------------------------
+    def test_transfer_stock(self):
+        """It should move stock between two InventoryItems"""
+        items = self._create_items(2)
+        ids = [item.id for item in items]
+        quantity = items[0].quantity
+        body = {"from_id": ids[0], "to_id": ids[1], "quantity": quantity}
+        response = self.client.post(f"{BASE_URL}/transfer", json=body)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(data["from"]["quantity"], 0)
+        self.assertEqual(data["to"]["quantity"], items[1].quantity + quantity)
+
+        response = self.client.post(f"{BASE_URL}/transfer", json=body)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.get_json()["error"], "Conflict")
+
+    def test_transfer_stock_bad_requests(self):
+        """It should not transfer stock of missing items or with a bad body"""
+        item = self._create_items(1)[0]
+        response = self.client.post(f"{BASE_URL}/transfer", json={"from_id": item.id, "to_id": 9999, "quantity": 1})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        for body in ({"from_id": item.id, "to_id": item.id, "quantity": 1}, {"from_id": item.id}, []):
+            response = self.client.post(f"{BASE_URL}/transfer", json=body)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
+
+    # ----------------------------------------------------------
+    # TEST BATCH
+    # ----------------------------------------------------------
+    def test_get_batch(self):
+        """It should Get several InventoryItems by id in one request"""
+        items = self._create_items(3)
+        self.client.put(f"{BASE_URL}/{items[1].id}/archive")
+        ids = [items[2].id, 9999, items[1].id, items[2].id]
+        response = self.client.get(BASE_URL, query_string={"ids": ",".join(str(item_id) for item_id in ids)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual([item["id"] for item in data["items"]], [items[2].id, items[1].id])
+        self.assertEqual(data["items"][1]["condition"], "archived")
+        self.assertEqual(data["missing"], [9999])
+
+        response = self.client.post(f"{BASE_URL}/batch", json={"ids": ids})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), data)
+
+    def test_get_batch_bad_ids(self):
+        """It should not Get a batch with invalid or too many ids"""
+        for query in ("ids=1,x", "ids=1.5", f"ids={','.join(map(str, range(101)))}"):
+            response = self.client.get(BASE_URL, query_string=query)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+        for body in ({"ids": "1,2"}, {"ids": [1, True]}, {"ids": []}, [1, 2]):
+            response = self.client.post(f"{BASE_URL}/batch", json=body)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
+
     # ----------------------------------------------------------
     # TEST LIST
     # ----------------------------------------------------------
@@ -289,6 +421,49 @@ class TestInventoryItemService(BaseTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         data = response.get_json()
         self.assertEqual(len(data), 5)
+        self.assertEqual(response.headers["X-Total-Count"], "5")
+
+    def test_count_items(self):
+        """It should count the InventoryItems a list would return with HEAD"""
+        items = self._create_items(4)
+        self.client.put(f"{BASE_URL}/{items[0].id}/archive")
+        queries = (
+            "",
+            "include_archived=true",
+            "condition=archived",
+            f"condition={quote_plus(items[1].condition)}",
+            f"name={quote_plus(items[0].name)}&include_archived=true",
+            f"name={quote_plus(items[1].name)}",
+            f"id={items[1].id}",
+            f"ids={items[1].id},{items[0].id},9999",
+        )
+        for query in queries:
+            with self.subTest(query=query):
+                listed = self.client.get(BASE_URL, query_string=query)
+                response = self.client.head(BASE_URL, query_string=query)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response.data, b"")
+                self.assertEqual(response.headers["X-Total-Count"], listed.headers["X-Total-Count"])
+        self.assertEqual(self.client.head(BASE_URL).headers["X-Total-Count"], "3")
+        response = self.client.head(BASE_URL, query_string="count=roughly")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_count_items_estimate(self):
+        """It should estimate an unfiltered count of a large table, and count anything else"""
+        self._create_items(2)
+        with patch("service.routes.estimate_rows", return_value=250000):
+            response = self.client.head(BASE_URL, query_string="count=estimate&include_archived=true")
+            self.assertEqual(response.headers["X-Total-Count"], "500000")
+            self.assertEqual(response.headers["X-Total-Count-Estimated"], "true")
+            response = self.client.head(BASE_URL, query_string="count=estimate&condition=new")
+            self.assertNotIn("X-Total-Count-Estimated", response.headers)
+        with patch("service.routes.estimate_rows", return_value=10):
+            response = self.client.head(BASE_URL, query_string="count=estimate")
+            self.assertEqual(response.headers["X-Total-Count"], "2")
+            self.assertNotIn("X-Total-Count-Estimated", response.headers)
+        # SQLite has no estimate to read
+        response = self.client.head(BASE_URL, query_string="count=estimate")
+        self.assertEqual(response.headers["X-Total-Count"], "2")
 
     # ----------------------------------------------------------
     # TEST QUERY
@@ -342,12 +517,102 @@ class TestInventoryItemService(BaseTestCase):
             self.assertEqual(item["id"], test_id)
 
 
+######################################################################
+#  T E S T   Q U E R Y   B U D G E T S
+######################################################################
+class TestQueryBudgets(QueryBudgetMixin, TransactionalTestCase):
+    """Most SQL statements each endpoint may run"""
+
+    def setUp(self):
+        super().setUp()
+        self.item = InventoryItemFactory(quantity=10, restock_level=0)
+        self.item.create()
+        self.url = f"{BASE_URL}/{self.item.id}"
+
+    def test_read_budgets(self):
+        """It should read an item, a list or a batch with one query"""
+        hot = InventoryItemFactory(quantity=10)
+        hot.create()
+        hot.split_quantity(2)
+        budgets = {
+            self.url: 1,
+            f"{BASE_URL}/0": 2,  # and the archive
+            f"{BASE_URL}/{hot.id}": 2,  # and its slots
+            BASE_URL: 2,  # and the slots of the hot item
+            f"{BASE_URL}?name=x": 1,
+            f"{BASE_URL}?ids={self.item.id}": 1,
+            f"{BASE_URL}?ids={self.item.id},0": 2,  # and the archive
+        }
+        for url, budget in budgets.items():
+            with self.subTest(url=url), self.assertQueries(budget):
+                self.client.get(url)
+
+    def test_count_budgets(self):
+        """It should count a list with one statement per table"""
+        budgets = {
+            BASE_URL: 1,
+            f"{BASE_URL}?name=x": 1,
+            f"{BASE_URL}?name=x&include_archived=true": 2,
+            f"{BASE_URL}?condition=archived": 2,
+        }
+        for url, budget in budgets.items():
+            with self.subTest(url=url), self.assertQueries(budget) as counter:
+                self.client.head(url)
+            self.assertTrue(all("count(*)" in statement for statement in counter.statements))
+
+    def test_create_budget(self):
+        """It should create an item with an insert and a read back"""
+        with self.assertQueries(2):
+            response = self.client.post(BASE_URL, json=InventoryItemFactory().serialize())
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_update_budget(self):
+        """It should update an item with a read, an update and a read back"""
+        data = self.item.serialize()
+        data["quantity"] = 3
+        with self.assertQueries(3):
+            response = self.client.put(self.url, json=data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_decrement_budget(self):
+        """It should decrement an item with one update and no reads"""
+        with self.assertQueries(1) as counter:
+            response = self.client.put(f"{self.url}/decrement")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["quantity"], 9)
+        self.assertTrue(counter.statements[0].startswith("UPDATE inventory_item SET"))
+
+    def test_delete_budget(self):
+        """It should delete an item, archived or not, without reading it first"""
+        item_id = self.item.id
+        archived = InventoryItemFactory()
+        archived.create()
+        archived_id = archived.archive().id
+        # the archive is only tried when the item was not in the inventory
+        budgets = {self.url: 1, f"{BASE_URL}/{archived_id}": 2, f"{BASE_URL}/0": 2}
+        for url, budget in budgets.items():
+            with self.subTest(url=url), self.assertQueries(budget) as counter:
+                response = self.client.delete(url)
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+            self.assertFalse([statement for statement in counter.statements if statement.startswith("SELECT")])
+        self.assertIsNone(InventoryItem.find(item_id))
+        self.assertIsNone(InventoryItemArchive.find(archived_id))
+
+    def test_over_budget(self):
+        """It should fail with the statements that were run"""
+        with self.assertRaises(AssertionError) as failure:
+            with self.assertQueries(0):
+                self.client.get(self.url)
+        self.assertIn("1 SQL statements run, the budget is 0", str(failure.exception))
+        self.assertIn("1. SELECT inventory_item.id", str(failure.exception))
+
+
 ######################################################################
 #  T E S T   S A D   P A T H S
 ######################################################################
 
 
-class TestSadPaths(BaseTestCase):
+class TestSadPaths(TransactionalTestCase):
     """Test REST Exception Handling"""
 
     def test_method_not_allowed(self):
@@ -384,3 +649,89 @@ class TestSadPaths(BaseTestCase):
         non_existent_id = 9999  # Assuming this ID does not exist in test database
         response = self.client.get(f"{BASE_URL}/{non_existent_id}")
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+######################################################################
+#  T E S T   R E A D   R E P L I C A S
+######################################################################
+class TestReadReplicas(ReplicaTestCase):
+    """Read Replica Routing Tests"""
+
+    def test_list_reads_from_replica(self):
+        """It should list the Inventory Items on the replica"""
+        self.add_to_replica(InventoryItemFactory(id=1000))
+        response = self.client.get(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item["id"] for item in response.get_json()], [1000])
+
+    def test_client_reads_its_writes(self):
+        """It should read from the primary for a while after a client writes"""
+        response = self.client.post(BASE_URL, json=InventoryItemFactory().serialize())
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIsNotNone(self.client.get_cookie(PRIMARY_COOKIE))
+        location = response.headers["Location"]
+        db.session.remove()  # end the request's session
+        response = self.client.get(location)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # another client still reads from the replica, which lacks the item
+        db.session.remove()
+        response = self.app_client().get(location)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_writes_read_from_primary(self):
+        """It should look items up on the primary when updating them"""
+        item = InventoryItemFactory()
+        item.create()
+        item_id = item.id
+        db.session.remove()
+        response = self.client.put(f"{BASE_URL}/{item_id}/decrement")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_bad_cookie_reads_from_replica(self):
+        """It should ignore a malformed stickiness cookie"""
+        self.add_to_replica(InventoryItemFactory(id=1000))
+        self.client.set_cookie(PRIMARY_COOKIE, "garbage")
+        response = self.client.get(f"{BASE_URL}/1000")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def app_client(self):
+        """Returns a test client without any cookies"""
+        return self.client.application.test_client()
+
+
+######################################################################
+#  T E S T   S H A R D I N G
+######################################################################
+class TestShardedRoutes(ShardedTestCase):
+    """Sharded REST API Tests"""
+
+    def test_crud_across_shards(self):
+        """It should create, list, update and delete items on two shards"""
+        for product_id in (1, 2):
+            response = self.client.post(BASE_URL, json=InventoryItemFactory(product_id=product_id).serialize())
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            db.session.remove()
+        self.assertEqual((self.ids_on(0), self.ids_on(1)), ([2], [1]))
+
+        response = self.client.get(BASE_URL)
+        self.assertEqual([item["id"] for item in response.get_json()], [1, 2])
+        self.assertEqual(self.client.head(BASE_URL).headers["X-Total-Count"], "2")
+        db.session.remove()
+
+        data = self.client.get(f"{BASE_URL}/1").get_json()
+        db.session.remove()
+        data["product_id"] = 4
+        response = self.client.put(f"{BASE_URL}/1", json=data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["product_id"], 4)
+        db.session.remove()
+        self.assertEqual((self.ids_on(0), self.ids_on(1)), ([1, 2], []))
+
+        response = self.client.get(BASE_URL, query_string="ids=2,1,3")
+        self.assertEqual([item["id"] for item in response.get_json()["items"]], [2, 1])
+        self.assertEqual(response.get_json()["missing"], [3])
+        db.session.remove()
+
+        response = self.client.delete(f"{BASE_URL}/2")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.ids_on(0), [1])
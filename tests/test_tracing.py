@@ -0,0 +1,239 @@
+"""
+Request Tracing Tests
+"""
+
+import os
+import json
+import tempfile
+from unittest import TestCase
+from flask import Flask
+from sqlalchemy import text
+from wsgi import app as service_app
+from service import routes
+from service.common import status, tracing
+from service.common.tracing import Span, init_tracing, load_exporter, parse_traceparent, span
+from service.models import InventoryItem, db
+from tests.factories import InventoryItemFactory
+from tests.test_base import BaseTestCase, ShardedTestCase, make_app
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+class ListExporter:  # pylint: disable=too-few-public-methods
+    """Keeps the exported traces"""
+
+    def __init__(self, app):
+        self.app = app
+        self.traces = []
+
+    def export(self, spans):
+        """Keeps the spans of one request"""
+        self.traces.append([item.serialize() for item in spans])
+
+
+def nested(item_id):  # pylint: disable=unused-argument
+    """Does some traced work"""
+    with span("work", step=1):
+        pass
+    return {"status": "OK"}
+
+
+def failing():
+    """Fails in the middle of traced work"""
+    with span("work"):
+        raise ValueError("boom")
+
+
+CONFIG = {"TRACING_EXPORTER": "tests.test_tracing:ListExporter", "TRACING_SAMPLE_RATE": 1.0}
+
+ROUTES = [("/items/<int:item_id>", "nested", nested), ("/broken", "broken", failing)]
+
+
+def traced(func):
+    """Runs func() within a sampled request span and returns the spans it made"""
+    root = Span("test", TRACE_ID, None, True, [])
+    token = tracing._current.set(root)
+    try:
+        func()
+    finally:
+        tracing._current.reset(token)
+    return root._finished
+
+
+class TestTraceparent(TestCase):
+    """Traceparent Header Tests"""
+
+    def test_parse(self):
+        """It should parse a valid traceparent header"""
+        self.assertEqual(parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-01"), (TRACE_ID, PARENT_ID, True))
+        self.assertEqual(parse_traceparent(f"00-{TRACE_ID.upper()}-{PARENT_ID}-00"), (TRACE_ID, PARENT_ID, False))
+
+    def test_parse_invalid(self):
+        """It should ignore a traceparent header that is not valid"""
+        for header in (None, "", "garbage", f"01-{TRACE_ID}-{PARENT_ID}-01",
+                       f"00-{'0' * 32}-{PARENT_ID}-01", f"00-{TRACE_ID}-{'0' * 16}-01"):
+            self.assertIsNone(parse_traceparent(header), header)
+
+
+class TestRequestTracing(TestCase):
+    """Request Span Tests"""
+
+    def setUp(self):
+        self.app = make_app(init_tracing, ROUTES, CONFIG)
+        self.exporter = self.app.extensions["tracing"]
+        self.client = self.app.test_client()
+
+    def test_new_trace(self):
+        """It should start a new trace and return its traceparent"""
+        resp = self.client.get("/items/7?debug=1")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        trace_id, span_id, sampled = parse_traceparent(resp.headers["traceparent"])
+        self.assertTrue(sampled)
+        [spans] = self.exporter.traces
+        work, root = spans
+        self.assertEqual(root["name"], "GET /items/<int:item_id>")
+        self.assertEqual((root["trace_id"], root["span_id"], root["parent_id"]), (trace_id, span_id, None))
+        self.assertEqual(root["attributes"]["http.status_code"], 200)
+        self.assertEqual(root["attributes"]["http.target"], "/items/7?debug=1")
+        self.assertEqual((work["name"], work["parent_id"], work["attributes"]), ("work", span_id, {"step": 1}))
+        self.assertGreaterEqual(root["duration_ms"], work["duration_ms"])
+
+    def test_join_trace(self):
+        """It should continue the trace of the caller"""
+        resp = self.client.get("/items/7", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"})
+        root = self.exporter.traces[0][-1]
+        self.assertEqual((root["trace_id"], root["parent_id"]), (TRACE_ID, PARENT_ID))
+        self.assertEqual(resp.headers["traceparent"], f"00-{TRACE_ID}-{root['span_id']}-01")
+
+    def test_not_sampled(self):
+        """It should export nothing when the caller or the sample rate says so"""
+        resp = self.client.get("/items/7", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-00"})
+        self.assertTrue(resp.headers["traceparent"].endswith("-00"))
+        app = make_app(init_tracing, ROUTES, CONFIG, TRACING_SAMPLE_RATE=0)
+        app.test_client().get("/items/7")
+        self.assertEqual(self.exporter.traces + app.extensions["tracing"].traces, [])
+
+    def test_error(self):
+        """It should record the exception that ended a span"""
+        resp = self.client.get("/broken")
+        self.assertEqual(resp.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        work, root = self.exporter.traces[0]
+        self.assertEqual(work["attributes"]["error"], "ValueError")
+        self.assertEqual(root["attributes"]["error"], "ValueError")
+        self.assertEqual(root["name"], "GET /broken")
+
+    def test_export_error(self):
+        """It should still answer when the trace cannot be exported"""
+        self.exporter.export = None
+        resp = self.client.get("/items/7")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_early_answer(self):
+        """It should trace a request that a hook registered before it answered"""
+        app = Flask(__name__)
+        app.config.update(CONFIG)
+        app.before_request(lambda: ("busy", status.HTTP_503_SERVICE_UNAVAILABLE))
+        init_tracing(app)
+        resp = app.test_client().get("/")
+        self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn("traceparent", resp.headers)
+        [[root]] = app.extensions["tracing"].traces
+        self.assertEqual(root["attributes"]["http.status_code"], 503)
+
+    def test_not_started(self):
+        """It should do nothing when a hook put in front of it answered the request"""
+        app = make_app(init_tracing, config=CONFIG)
+        app.before_request_funcs[None].insert(0, lambda: ("busy", status.HTTP_503_SERVICE_UNAVAILABLE))
+        resp = app.test_client().get("/")
+        self.assertNotIn("traceparent", resp.headers)
+        self.assertEqual(app.extensions["tracing"].traces, [])
+
+    def test_span_outside_request(self):
+        """It should do nothing outside of a traced request"""
+        with span("work") as work:
+            self.assertIsNone(work)
+
+
+class TestExporters(TestCase):
+    """Trace Exporter Tests"""
+
+    def test_file(self):
+        """It should append the spans to a file as lines of JSON"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            app = Flask(__name__)
+            app.config["TRACING_FILE"] = os.path.join(tmpdir, "traces.ndjson")
+            exporter = load_exporter(app, "file")
+            spans = traced(lambda: None)
+            root = Span("test", TRACE_ID, None, True, spans)
+            root.end()
+            exporter.export(spans)
+            exporter.stream.close()
+            with open(app.config["TRACING_FILE"], encoding="utf-8") as traces:
+                self.assertEqual(json.loads(traces.readline())["trace_id"], TRACE_ID)
+
+    def test_stdout_and_unknown(self):
+        """It should write to stdout and refuse an unknown exporter"""
+        app = Flask(__name__)
+        self.assertIsNotNone(load_exporter(app, "stdout").stream)
+        self.assertRaises(ValueError, load_exporter, app, "carrier-pigeon")
+
+    def test_disabled(self):
+        """It should not trace without an exporter"""
+        app = make_app(init_tracing)
+        self.assertNotIn("tracing", app.extensions)
+
+
+class TestDatabaseSpans(BaseTestCase):
+    """SQL Statement and Serialization Span Tests"""
+
+    def setUp(self):
+        super().setUp()
+        # registers the statement listeners
+        make_app(init_tracing, ROUTES, CONFIG)
+
+    def test_query_spans(self):
+        """It should time every statement of a traced request"""
+        InventoryItemFactory().create()
+        spans = traced(InventoryItem.all)
+        [query] = [item for item in spans if item.name == "db.query"]
+        self.assertIn("SELECT", query.attributes["statement"])
+        self.assertEqual(query.trace_id, TRACE_ID)
+
+    def test_failed_statement(self):
+        """It should close the span of a statement that failed"""
+        def broken():
+            try:
+                db.session.execute(text("SELECT * FROM no_such_table"))
+            except Exception:  # pylint: disable=broad-except
+                db.session.rollback()
+
+        [query] = [item for item in traced(broken) if item.name == "db.query"]
+        self.assertEqual(query.attributes["error"], "OperationalError")
+
+    def test_serialize_spans(self):
+        """It should time the serialization of a list"""
+        for item in InventoryItemFactory.create_batch(3):
+            item.create()
+        with service_app.test_request_context("/api/inventory"):
+            args = routes.inventoryItem_args.parse_args()
+            names = [item.name for item in traced(lambda: routes.list_serialized(args))]
+        self.assertIn("serialize", names)
+        self.assertIn("db.query", names)
+
+
+class TestShardSpans(ShardedTestCase):
+    """Shard Statement Span Tests"""
+
+    def setUp(self):
+        super().setUp()
+        # registers the statement listeners
+        make_app(init_tracing, ROUTES, CONFIG)
+
+    def test_fan_out_spans(self):
+        """It should time the statements run on every shard in the request's trace"""
+        for product_id in (2, 3):
+            InventoryItemFactory(product_id=product_id).create()
+        queries = [item for item in traced(InventoryItem.all) if item.name == "db.query"]
+        self.assertEqual(len(queries), 2)
+        self.assertTrue(all(query.trace_id == TRACE_ID for query in queries))
@@ -0,0 +1,159 @@
+"""
+Write-behind Decrement Tests
+"""
+
+import os
+import json
+import time
+import tempfile
+from unittest.mock import patch
+from wsgi import app
+from service.common import status
+from service.common.write_behind import DecrementBuffer, init_write_behind
+from service.models import InventoryItem, DataValidationError, db
+from tests.factories import InventoryItemFactory
+from tests.test_base import BaseTestCase
+
+BASE_URL = "/api/inventory"
+
+
+class TestWriteBehind(BaseTestCase):
+    """Decrement Buffer Tests"""
+
+    def setUp(self):
+        super().setUp()
+        tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmpdir.cleanup)
+        self.journal = os.path.join(tmpdir.name, "decrements.ndjson")
+        # flush by hand, unless a test starts the thread itself
+        self.background = patch.object(DecrementBuffer, "_run")
+        self.background.start()
+        self.addCleanup(patch.stopall)
+        self.buffer = DecrementBuffer(app, 0.001, self.journal)
+        self.items = InventoryItemFactory.create_batch(2, quantity=5, restock_level=0)
+        for item in self.items:
+            item.create()
+        self.ids = [item.id for item in self.items]
+
+    def quantities(self) -> list:
+        """Returns the stored quantities of the test items"""
+        db.session.expire_all()
+        items = InventoryItem.with_slot_quantities([InventoryItem.find(item_id) for item_id in self.ids])
+        return [item.quantity for item in items]
+
+    def test_apply_decrements(self):
+        """It should take many units from many items at once, never below zero"""
+        InventoryItem.apply_decrements({self.ids[0]: 2, self.ids[1]: 9})
+        self.assertEqual(self.quantities(), [3, 0])
+
+    def test_apply_decrements_hot_item(self):
+        """It should take the units of an item that turned hot from its slots"""
+        self.buffer.add(self.ids[0])
+        self.buffer.add(self.ids[0])
+        self.buffer.add(self.ids[1])
+        # the item turns hot while its decrements wait in the buffer
+        InventoryItem.find(self.ids[0]).split_quantity(3)
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(self.quantities(), [3, 4])
+        InventoryItem.apply_decrements({self.ids[0]: 9})
+        self.assertEqual(self.quantities(), [0, 4])
+
+    @patch("service.models.db.session.commit")
+    def test_apply_decrements_exception(self, exception_mock):
+        """It should catch an exception applying decrements"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, InventoryItem.apply_decrements, {self.ids[0]: 1})
+
+    def test_flush(self):
+        """It should write the counted decrements in one batch"""
+        for item_id in (self.ids[0], self.ids[0], self.ids[1]):
+            self.buffer.add(item_id)
+        self.assertEqual(self.buffer.pending(self.ids[0]), 2)
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(self.buffer.pending(self.ids[0]), 0)
+        self.assertEqual(self.quantities(), [3, 4])
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_journal_on_failure(self):
+        """It should journal a batch that fails and write it with the next one"""
+        self.buffer.add(self.ids[0])
+        with patch.object(InventoryItem, "apply_decrements", side_effect=DataValidationError("down")):
+            self.assertEqual(self.buffer.flush(), 0)
+        with open(self.journal, encoding="utf-8") as journal:
+            self.assertEqual([json.loads(line) for line in journal], [{str(self.ids[0]): 1}])
+        self.buffer.add(self.ids[1])
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.quantities(), [4, 4])
+        self.assertEqual(os.path.getsize(self.journal), 0)
+
+    def test_reject_unreadable_lines(self):
+        """It should set aside journal lines it cannot read and write the others"""
+        with open(self.journal, "w", encoding="utf-8") as journal:
+            journal.write(f'{{"{self.ids[0]}": 1}}\n{{"{self.ids[1]}": 1\n["x"]\n\n')
+        self.buffer.add(self.ids[1])
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.quantities(), [4, 4])
+        self.assertEqual(os.path.getsize(self.journal), 0)
+        with open(f"{self.journal}.rejected", encoding="utf-8") as quarantine:
+            self.assertEqual(quarantine.read(), f'{{"{self.ids[1]}": 1\n["x"]\n')
+
+    def test_keep_counts_journal_fails(self):
+        """It should keep the counts in memory when they can be neither written nor journaled"""
+        self.buffer.add(self.ids[0])
+        with patch.object(InventoryItem, "apply_decrements", side_effect=DataValidationError("down")):
+            with patch("service.common.write_behind.os.fsync", side_effect=OSError("disk full")):
+                self.assertRaises(OSError, self.buffer.flush)
+        self.assertEqual(self.buffer.pending(self.ids[0]), 1)
+
+    def test_background_survives_errors(self):
+        """It should keep writing from its thread after a flush failed"""
+        self.background.stop()
+        with patch.object(DecrementBuffer, "flush", side_effect=[RuntimeError("boom"), 0]) as flush:
+            self.buffer.add(self.ids[0])
+            for _ in range(500):
+                if flush.call_count:
+                    break
+                time.sleep(0.01)
+            self.buffer.add(self.ids[0])
+            for _ in range(500):
+                if flush.call_count == 2:
+                    break
+                time.sleep(0.01)
+        self.assertEqual(flush.call_count, 2)
+
+    def test_background_flush(self):
+        """It should write the decrements from its own thread"""
+        self.background.stop()
+        self.buffer.add(self.ids[0])
+        for _ in range(500):
+            if self.quantities()[0] == 4:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.quantities()[0], 4)
+
+    def test_decrement_route(self):
+        """It should accept a decrement with Prefer: respond-async"""
+        self.assertNotIn("write_behind", app.extensions)
+        app.config["WRITE_BEHIND_MS"] = 60000
+        app.config["WRITE_BEHIND_JOURNAL"] = self.journal
+        with patch("service.common.write_behind.atexit.register"):
+            init_write_behind(app)
+        buffer = app.extensions.pop("write_behind")
+        app.config["WRITE_BEHIND_MS"] = 0
+        with patch.dict(app.extensions, {"write_behind": buffer}):
+            headers = {"Prefer": "respond-async"}
+            response = self.client.put(f"{BASE_URL}/{self.ids[0]}/decrement", headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            self.assertEqual(response.headers["Preference-Applied"], "respond-async")
+            self.assertEqual(response.get_json(), {"id": self.ids[0], "pending": 1})
+            response = self.client.put(f"{BASE_URL}/{self.ids[0]}/decrement")
+            self.assertEqual(response.get_json()["quantity"], 4)
+            # an item without a restock level is never below it
+            self.items[1].restock_level = None
+            self.items[1].update()
+            response = self.client.put(f"{BASE_URL}/{self.ids[1]}/decrement", headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            response = self.client.put(f"{BASE_URL}/{self.ids[1]}/decrement")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            buffer.flush()
+        self.assertEqual(self.quantities(), [3, 3])